@@ -29,10 +29,123 @@ LEDStrip led_strip;
 // Global Veriables
 //---------------------
 String data;
-uint8_t newInstruction = NO;
+bool discardLine = false; //set by a corrupt frame or a non-ASCII byte, cleared by the next newline
 const int MAX_LEDS = 30; // Maximum number of LEDs
 const int RGB_VALUES = 3; // Number of RGB values per LED
 uint32_t lastISR_time = 0;
+volatile bool ballPending = false;
+
+//---------------------
+// Binary Framed Protocol
+//---------------------
+// SYNC TYPE LEN PAYLOAD[LEN] CRC16_HI CRC16_LO, CRC-16/CCITT-FALSE over TYPE,
+// LEN and PAYLOAD. Mirrors buildings/pi/arduino-adapter/src/serial_protocol.py,
+// keep the two in step. The old ASCII protocol keeps working until the first
+// valid frame arrives, after that hits go up as frames too.
+const uint8_t FRAME_SYNC = 0xA5;
+const uint8_t FRAME_PIXELS = 0x01;   // runs of [count, r, g, b]
+const uint8_t FRAME_HIT = 0x02;      // [kind, millis u32 LE]
+const uint8_t FRAME_SET_BAUD = 0x03; // [baud u32 LE]
+const uint8_t FRAME_ACK = 0x04;
+const uint8_t FRAME_PING = 0x05;
+const uint8_t FRAME_PONG = 0x06;
+const uint8_t HIT_LASER = 1;
+const uint8_t HIT_BALL = 2;
+const uint32_t DEFAULT_BAUD = 9600;
+const uint32_t BAUD_CONFIRM_MS = 1000; // fall back if no PING follows a baud switch
+
+bool binaryMode = false;
+bool awaitingBaudConfirm = false;
+uint32_t baudSwitchTime = 0;
+
+uint16_t crc16(uint16_t crc, uint8_t b)
+{
+    crc ^= (uint16_t)b << 8;
+    for (uint8_t i = 0; i < 8; i++)
+    {
+        crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : (crc << 1);
+    }
+    return crc;
+}
+
+struct FrameParser
+{
+    enum State { WAIT_SYNC, TYPE, LEN, PAYLOAD, CRC_HI, CRC_LO };
+    State state = WAIT_SYNC;
+    uint8_t type = 0;
+    uint8_t len = 0;
+    uint8_t index = 0;
+    uint16_t crc = 0xFFFF;
+    uint16_t received_crc = 0;
+    bool failed = false; // the last frame ended with a bad CRC
+    uint8_t payload[255];
+
+    bool idle() { return state == WAIT_SYNC; }
+
+    // returns true when a complete frame with a good CRC is in type/len/payload
+    bool feed(uint8_t b)
+    {
+        switch (state)
+        {
+        case WAIT_SYNC:
+            if (b == FRAME_SYNC) { state = TYPE; crc = 0xFFFF; failed = false; }
+            break;
+        case TYPE:
+            type = b; crc = crc16(crc, b); state = LEN;
+            break;
+        case LEN:
+            len = b; index = 0; crc = crc16(crc, b);
+            state = (len > 0) ? PAYLOAD : CRC_HI;
+            break;
+        case PAYLOAD:
+            payload[index++] = b; crc = crc16(crc, b);
+            if (index >= len) { state = CRC_HI; }
+            break;
+        case CRC_HI:
+            received_crc = (uint16_t)b << 8; state = CRC_LO;
+            break;
+        case CRC_LO:
+            received_crc |= b; state = WAIT_SYNC;
+            failed = (received_crc != crc);
+            return !failed;
+        }
+        return false;
+    }
+};
+FrameParser frameParser;
+
+void sendFrame(uint8_t type, const uint8_t* payload, uint8_t len)
+{
+    uint16_t crc = 0xFFFF;
+    crc = crc16(crc, type);
+    crc = crc16(crc, len);
+    for (uint8_t i = 0; i < len; i++) { crc = crc16(crc, payload[i]); }
+    Serial.write(FRAME_SYNC);
+    Serial.write(type);
+    Serial.write(len);
+    Serial.write(payload, len);
+    Serial.write((uint8_t)(crc >> 8));
+    Serial.write((uint8_t)(crc & 0xFF));
+}
+
+uint32_t readU32(const uint8_t* p)
+{
+    return (uint32_t)p[0] | ((uint32_t)p[1] << 8) | ((uint32_t)p[2] << 16) | ((uint32_t)p[3] << 24);
+}
+
+void sendHit(uint8_t kind)
+{
+    if (binaryMode)
+    {
+        uint32_t now = millis();
+        uint8_t payload[5] = {kind, (uint8_t)now, (uint8_t)(now >> 8), (uint8_t)(now >> 16), (uint8_t)(now >> 24)};
+        sendFrame(FRAME_HIT, payload, 5);
+    }
+    else
+    {
+        Serial.println(kind == HIT_LASER ? "laser" : "ball");
+    }
+}
 
 
 //---------------------
@@ -85,27 +198,12 @@ void ballDetectISR()
 {
     if((millis() - lastISR_time) > 50)
     {
-      Serial.println("ball"); //send to pi via serial 
+      ballPending = true; //sent to pi from the main loop, not from inside the ISR
       lastISR_time = millis(); //reset fire itme. 
     }
     
 }
 
-String piInstructionsSerial()
-{
-    if(Serial.available() > 0) //if > 0 then somthing is in buffer
-    {
-        //data is a command from pi
-        newInstruction = YES;
-        data = Serial.readStringUntil('\n'); //read string untll a new line
-    }
-    else 
-    {
-      newInstruction = NO;
-    }
-    return data;
-}
-
 //---------------------
 // LED Controller
 //---------------------
@@ -129,6 +227,95 @@ void LEDdisplay(String& inputString)
     led_animations.draw();    
 }
 
+void LEDdisplayRuns(const uint8_t* payload, uint8_t len)
+{
+    // runs of [count, r, g, b] from a FRAME_PIXELS payload
+    led_animations.strips[0].blackout_strip();
+    int ledIndex = 0;
+    for (uint8_t i = 0; i + 3 < len; i += 4)
+    {
+        CRGB color(payload[i + 2], payload[i + 1], payload[i + 3]); //RED GREEN BLUE order of data stream
+        for (uint8_t n = 0; n < payload[i] && ledIndex < MAX_LEDS; n++)
+        {
+            led_animations.strips[0].set_pixel_color(ledIndex++, color);
+        }
+    }
+    led_animations.draw();
+}
+
+void handleFrame(uint8_t type, const uint8_t* payload, uint8_t len)
+{
+    binaryMode = true;
+    if (type == FRAME_PING)
+    {
+        awaitingBaudConfirm = false;
+        sendFrame(FRAME_PONG, payload, 0);
+    }
+    else if (type == FRAME_SET_BAUD && len == 4)
+    {
+        // acknowledge at the old rate, then switch
+        sendFrame(FRAME_ACK, payload, len);
+        Serial.flush();
+        Serial.end();
+        Serial.begin(readU32(payload));
+        awaitingBaudConfirm = true;
+        baudSwitchTime = millis();
+    }
+    else if (type == FRAME_PIXELS)
+    {
+        LEDdisplayRuns(payload, len);
+    }
+}
+
+void serviceSerial()
+{
+    while (Serial.available() > 0)
+    {
+        uint8_t b = Serial.read();
+        if (!frameParser.idle() || b == FRAME_SYNC)
+        {
+            if (frameParser.feed(b))
+            {
+                handleFrame(frameParser.type, frameParser.payload, frameParser.len);
+                discardLine = false;
+            }
+            else if (frameParser.failed)
+            {
+                //what follows a corrupt frame may be more of it, drop it up to the next newline or good frame
+                discardLine = true;
+                data = "";
+            }
+        }
+        else if (b == '\n')
+        {
+            //an ASCII LED command from the pi
+            if (!discardLine)
+            {
+                LEDdisplay(data);
+            }
+            discardLine = false;
+            data = "";
+        }
+        else if (b != '\r' && (b < 0x20 || b > 0x7E))
+        {
+            //not part of an LED command, drop the whole line
+            discardLine = true;
+        }
+        else if (!discardLine)
+        {
+            data += (char)b;
+        }
+    }
+
+    if (awaitingBaudConfirm && (millis() - baudSwitchTime) > BAUD_CONFIRM_MS)
+    {
+        //the pi never got through at the new rate, go back
+        Serial.end();
+        Serial.begin(DEFAULT_BAUD);
+        awaitingBaudConfirm = false;
+    }
+}
+
 //---------------------
 // Setup Loop
 //---------------------
@@ -136,7 +323,7 @@ void setup()
 {
     //Serial Setup 
     //Serial.println(F("Serial Comunication Setup..."));
-    Serial.begin(9600); //baudrate, opens serial for USB port and RX/TX. 
+    Serial.begin(DEFAULT_BAUD); //baudrate, opens serial for USB port and RX/TX. the pi can raise it with FRAME_SET_BAUD
     Serial.setTimeout(100); //was 10 //lower it is the higher the risk of not complete reciving or sending. 
     while(!Serial){} //this is for portability. not needed on Arduino Mega. waits for serial to be configured
 
@@ -165,11 +352,13 @@ void setup()
 //---------------------
 void loop()
 {
-    //Look for instructions. 
-    String instruction = piInstructionsSerial(); //take instuctions from pi 
-    if(newInstruction == YES)
+    //Look for instructions, ASCII lines or binary frames
+    serviceSerial();
+
+    if (ballPending)
     {
-        LEDdisplay(instruction);
+        ballPending = false;
+        sendHit(HIT_BALL);
     }
 
     //Check for ball drop
@@ -183,7 +372,7 @@ void loop()
     int8_t trigger = laser_detect.laser_detect();
     if (trigger == 1)
     {
-        Serial.println("laser");
+        sendHit(HIT_LASER);
         trigger = 0;
     }
 }
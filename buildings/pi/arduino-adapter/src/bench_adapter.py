@@ -0,0 +1,302 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections import Counter, deque
+from queue import Queue
+from threading import Lock, Thread
+from typing import Any, Callable, Deque, Dict, List, Union
+
+from loguru import logger
+from pysm import Event as SMEvent
+
+import main as adapter_main
+from fake_arduino import FakeArduino
+from mqtt_client import TopicTrie
+import tracing
+
+# Hardware-free rig for the building adapter. Runs ArduinoAdapter through its
+# own init and run states against a pty fake Arduino (fake_arduino.py), the
+# in-memory GPIO chip (gpio_backend "fake") and an in-process broker. Scripted
+# laser/ball hits go up the serial line, and every published hit is answered
+# with a fire_level/set frame like the controller would, so LED traffic comes
+# down the same port. Reports sustained hits/s, serial -> MQTT publish latency
+# and what the LED writer did:
+#
+#   python bench_adapter.py --rate 200 --duration 5 --protocol binary
+#
+# --rate 0 sends hits back to back to find the ceiling.
+
+DETECTORS = {"laser": "laser_detector", "ball": "ball_detector"}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LocalBroker(object):
+    '''
+    In-process stand-in for the broker. Counts every publish per topic, tells
+    on_publish hooks (topic, monotonic time) as the publish call happens, and
+    hands matching messages to each connected client's inbox.
+    '''
+    def __init__(self):
+        self.clients: List["LocalClient"] = []
+        self.counts: Counter = Counter()
+        self.counts_lock = Lock()
+        self.on_publish: List[Callable] = []
+
+    def connect(self, name: str) -> "LocalClient":
+        client = LocalClient(self, name)
+        self.clients.append(client)
+        return client
+
+    def publish(self, topic: str, payload: Union[str, bytes]):
+        now = time.monotonic()
+        with self.counts_lock:
+            self.counts[topic] += 1
+        for hook in self.on_publish:
+            hook(topic, now)
+        for client in self.clients:
+            if client.topic_trie.match(topic):
+                client.inbox.put((topic, payload))
+
+
+class LocalClient(object):
+    '''
+    Same surface as mqtt_client.MQTTClient, handlers run on one thread per
+    client like paho's loop thread.
+    '''
+    def __init__(self, broker: LocalBroker, name: str):
+        self.broker = broker
+        self.name = name
+        self.topic_map: Dict[str, List[Callable]] = {}
+        self.topic_trie = TopicTrie()
+        self.inbox: Queue = Queue()
+        self.thread: Any = None
+
+    def register_callback(self, topic: str, function: Callable):
+        handlers = self.topic_map.setdefault(topic, [])
+        if function not in handlers:
+            handlers.append(function)
+            self.topic_trie.add(topic, function)
+
+    def publish(self, topic: str, message: Any):
+        self.broker.publish(topic, json.dumps(message))
+
+    def is_connected(self) -> bool:
+        return True
+
+    def start_threaded(self):
+        if self.thread is None:
+            self.thread = Thread(target=self.run, args=(), daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            topic, payload = self.inbox.get()
+            msg = json.loads(payload)
+            for handler in self.topic_trie.match(topic):
+                handler(topic, msg)
+
+
+class HitScript(Thread):
+    '''
+    Sends hits from the fake arduino at rate per second (0 = back to back)
+    for duration seconds, every ball_every'th one a ball hit and the rest
+    laser. Send times are queued per detector before the write, so the rig
+    can pair each publish with the hit that caused it.
+    '''
+    def __init__(self, fake: FakeArduino, rate: float, duration: float, ball_every: int):
+        super().__init__(daemon=True)
+        self.fake = fake
+        self.rate = rate
+        self.duration = duration
+        self.ball_every = ball_every
+        self.sent_at: Dict[str, Deque[float]] = {name: deque() for name in DETECTORS.values()}
+        self.sent = 0
+
+    def run(self):
+        start = time.monotonic()
+        deadline = start
+        while deadline - start < self.duration:
+            if self.rate > 0:
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                deadline += 1.0 / self.rate
+            else:
+                deadline = time.monotonic()
+            kind = "ball" if self.ball_every > 0 and self.sent % self.ball_every == self.ball_every - 1 else "laser"
+            self.sent_at[DETECTORS[kind]].append(time.monotonic())
+            self.fake.send_hit(kind)
+            self.sent += 1
+
+
+class AdapterRig(object):
+    def __init__(self, args):
+        self.args = args
+        self.broker = LocalBroker()
+        self.fake = FakeArduino(speaks_binary=args.firmware == "binary").start()
+
+        config = {
+            "id": args.id,
+            "serial_port": self.fake.slave_name,
+            "serial_protocol": args.protocol,
+            "serial_baud": args.baud,
+            "serial_startup_delay": 0,
+            "gpio_backend": "fake",
+        }
+        self.config_dir = tempfile.TemporaryDirectory()
+        self.config_file = os.path.join(self.config_dir.name, "config.json")
+        with open(self.config_file, "w") as file:
+            json.dump(config, file)
+
+        self.adapter_client = self.broker.connect("adapter")
+        self.adapter_client.start_threaded()
+        self.adapter = adapter_main.ArduinoAdapter(config_file=self.config_file, client=self.adapter_client)
+
+        # plays the controller: one fire_level/set per hit
+        self.field_client = self.broker.connect("field")
+        self.fire_level = args.initial_fire_level
+
+        self.script: Any = None
+        self.latencies: List[float] = []
+        self.published = 0
+        self.first_publish = 0.0
+        self.last_publish = 0.0
+        self.broker.on_publish.append(self.adapter_published)
+
+    def adapter_published(self, topic: str, at: float):
+        # "<id>/events/<detector>/"
+        levels = topic.split("/")
+        if self.script is None or len(levels) < 3 or levels[1] != "events":
+            return
+        sent_at = self.script.sent_at.get(levels[2], None)
+        if not sent_at:
+            return
+        self.latencies.append(at - sent_at.popleft())
+        if self.published == 0:
+            self.first_publish = at
+        self.last_publish = at
+        self.published += 1
+
+    def answer_hit(self, topic: str, msg: dict):
+        if msg.get("event_type", None) != "hit":
+            return
+        initial = self.args.initial_fire_level
+        self.fire_level = self.fire_level - 1 if self.fire_level > 0 else initial
+        command = {"level": self.fire_level, "initial": initial}
+        trace = msg.get("trace", None)
+        if trace is not None:
+            # same process, so these stamps share the adapter's clock
+            tracing.stamp(trace, "controller_receive")
+            command["trace"] = tracing.stamp(trace, "led_publish")
+        self.field_client.publish(f"{self.args.id}/fire_level/set", command)
+
+    def dispatch_pending(self):
+        # what ArduinoAdapter.run does, without its state publisher thread
+        while not self.adapter.event_queue.empty():
+            self.adapter.sm.dispatch(self.adapter.event_queue.get())
+
+    def start_adapter(self):
+        self.field_client.register_callback(f"{self.args.id}/events/#", self.answer_hit)
+        self.field_client.start_threaded()
+
+        self.adapter.sm.dispatch(SMEvent("goto_init_event"))
+        self.dispatch_pending()
+        connected = f"{self.args.id}/events/connected/"
+        end = time.time() + 5
+        while self.broker.counts[connected] == 0:
+            if time.time() > end:
+                raise Exception("adapter never reached its run state")
+            time.sleep(0.01)
+
+    def run(self):
+        args = self.args
+        self.start_adapter()
+        protocol = self.adapter.serial_protocol
+        baud = self.adapter.ser_connection.baudrate
+
+        self.script = HitScript(self.fake, args.rate, args.duration, args.ball_every)
+        start = time.monotonic()
+        self.script.start()
+        self.script.join()
+        sent_end = time.monotonic()
+
+        # give the adapter a moment to work through what's still in flight
+        end = time.monotonic() + args.drain
+        while self.published < self.script.sent and time.monotonic() < end:
+            time.sleep(0.01)
+        drain_time = time.monotonic() - sent_end
+
+        self.adapter.run_state_stop = True
+        self.adapter.run_state_thread.join()
+        self.report(protocol, baud, sent_end - start, drain_time)
+        self.adapter.ser_connection.close()
+        self.fake.close()
+        self.config_dir.cleanup()
+
+    def report(self, protocol: str, baud: int, send_window: float, drain_time: float):
+        sent = self.script.sent
+        active = max(self.last_publish - self.first_publish, 1e-9)
+
+        print("=== link ===")
+        print(f"protocol           {protocol} at {baud} baud (firmware: {self.args.firmware})")
+        print("=== throughput ===")
+        print(f"hits sent          {sent} over {send_window:.2f}s ({sent / max(send_window, 1e-9):.1f}/s)")
+        print(f"hits published     {self.published} ({self.published / active:.1f}/s sustained)")
+        print(f"hits missing       {sent - self.published}")
+        print(f"drain after send   {drain_time * 1000:.1f} ms")
+
+        print("=== serial -> MQTT publish latency ===")
+        latencies = [l * 1000 for l in self.latencies]
+        for pct in [50, 90, 99, 99.9]:
+            print(f"p{pct:<5}             {percentile(latencies, pct):.3f} ms")
+        print(f"max                {max(latencies) if latencies else 0:.3f} ms")
+        reader = [l * 1000 for l in self.adapter.hit_latencies]
+        print(f"in adapter p99     {percentile(reader, 99):.3f} ms (read -> publish returned)")
+
+        print("=== LED frames ===")
+        stats = self.adapter.led_writer_stats()
+        print(f"frames requested   {self.broker.counts[f'{self.args.id}/fire_level/set']}")
+        print(f"frames written     {stats['written']}")
+        print(f"frames skipped     {stats['dropped']} (replaced by a newer one first)")
+        print(f"frames at arduino  {len(self.fake.frames)}")
+        latency = stats.get("latency_ms", {})
+        print(f"write p99/max      {latency.get('p99', 0):.3f} / {latency.get('max', 0):.3f} ms")
+        print(f"bytes to arduino   {self.fake.received_bytes}")
+
+        print("=== trace stages (hit -> LED frame written) ===")
+        for line in self.adapter.trace_stats.summary():
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hardware-free adapter benchmark")
+    parser.add_argument("--rate", type=float, default=100.0, help="hits/s, 0 sends back to back")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of hits")
+    parser.add_argument("--ball-every", type=int, default=4, help="every n'th hit is a ball hit, 0 for none")
+    parser.add_argument("--protocol", default="binary", choices=["ascii", "binary"], help="adapter serial_protocol")
+    parser.add_argument("--firmware", default="binary", choices=["ascii", "binary"], help="what the fake arduino speaks")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--initial-fire-level", type=int, default=16)
+    parser.add_argument("--drain", type=float, default=2.0, help="max seconds to wait for stragglers")
+    parser.add_argument("--id", default="3")
+    parser.add_argument("--verbose", action="store_true", help="keep the adapter's debug logging")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logger.remove()
+        logger.add(lambda m: None, level="WARNING")
+
+    AdapterRig(args).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import shutil
+import sys
+import time
+import libregpio as GPIO
+
+# times relay changes through each libregpio backend: one channel at a time
+# and all eight relay channels in one call. The shell backend runs gpioset,
+# or "true" on boxes without it so the fork+exec cost still shows up. Then
+# runs software PWM for a second at a few frequencies and prints what it
+# actually achieved.
+# run with: python bench_gpio.py [--chardev]
+
+RELAY_PINS = ["GPIOX_17", "GPIOX_18", "GPIOX_6", "GPIOX_2", "GPIOX_7", "GPIOX_3", "GPIOX_4", "GPIOX_5"]
+SHELL_ROUNDS = 50
+FAST_ROUNDS = 20000
+PWM_FREQS = [50, 200, 1000]
+PWM_SECONDS = 1.0
+
+
+def time_single(group, rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        group.set({i % len(group.pins): i & 1})
+    return (time.perf_counter() - start) / rounds
+
+
+def time_batch(group, rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        group.set({index: i & 1 for index in range(len(group.pins))})
+    return (time.perf_counter() - start) / rounds
+
+
+def time_readback(group, rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        group.get(i % len(group.pins))
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    backends = [
+        ("shell", GPIO.ShellBackend("gpioset" if shutil.which("gpioset") else "true"), SHELL_ROUNDS),
+        ("fake", GPIO.FakeChipBackend(), FAST_ROUNDS),
+    ]
+    if "--chardev" in sys.argv:
+        backends.append(("chardev", GPIO.ChipBackend(), FAST_ROUNDS))
+
+    print(f"{'backend':>8} {'1 relay us':>12} {'8 relays us':>13} {'read us':>10}")
+    for name, backend, rounds in backends:
+        GPIO.set_backend(backend)
+        group = GPIO.OUTGroup(RELAY_PINS, label="bench")
+        single = time_single(group, rounds)
+        batch = time_batch(group, rounds)
+        read = time_readback(group, rounds)
+        group.close()
+        print(f"{name:>8} {single * 1e6:>12.2f} {batch * 1e6:>13.2f} {read * 1e6:>10.2f}")
+
+    # the fake chip should hold exactly what was last written
+    fake = GPIO.FakeChipBackend()
+    GPIO.set_backend(fake)
+    group = GPIO.OUTGroup(RELAY_PINS, label="check")
+    group.set({0: 1, 3: 1, 7: 1})
+    expected = [1, 0, 0, 1, 0, 0, 0, 1]
+    if [group.get(i) for i in range(len(RELAY_PINS))] != expected:
+        raise Exception("fake chip readback mismatch")
+
+    print()
+    print(f"{'pwm hz':>8} {'achieved hz':>12} {'jitter us':>10} {'max late us':>12}")
+    for freq in PWM_FREQS:
+        pwm = GPIO.PWM("GPIOX_8", 30, freq, hardware=False)
+        pwm.start()
+        time.sleep(PWM_SECONDS)
+        stats = pwm.stats()
+        pwm.stop()
+        print(f"{freq:>8} {stats['achieved_freq']:>12.1f} {stats['jitter_us']:>10.1f} {stats['max_late_us']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
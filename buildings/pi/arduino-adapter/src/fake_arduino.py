@@ -0,0 +1,365 @@
+import argparse
+import os
+import sys
+import time
+import tty
+from threading import Event, Lock, Thread, current_thread
+from typing import List, Tuple
+import serial_protocol
+
+# A fake Arduino on a pseudo-terminal, speaking the same serial protocols as
+# buildings/arduino/src/main.cpp: ASCII "r,g,b/..." lines down and
+# "laser"/"ball" lines up, or binary frames once it has seen a valid one.
+#
+# Run it directly for a self-check of the adapter's serial code against it:
+#   python fake_arduino.py
+
+
+def parse_led_string(line: str) -> List[List[int]]:
+    # the same parse as parseLEDString in main.cpp
+    pixels = []
+    for entry in line.strip().split("/"):
+        if entry == "":
+            continue
+        values = [int(v) if v.isdigit() else 0 for v in entry.split(",")]
+        pixels.append((values + [0, 0, 0])[:3])
+    return pixels
+
+
+class FakeArduino(object):
+    '''
+    Owns the master side of a pty, the adapter opens slave_name like a real port.
+    frames holds (monotonic time, pixel_data) for every LED frame received.
+    With speaks_binary=False it behaves like firmware from before the binary
+    protocol and ignores frames.
+    '''
+    def __init__(self, speaks_binary: bool = True):
+        self.master, slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(slave)
+        self.slave_name = os.ttyname(slave)
+        # keep the slave open so the pty stays up between adapter connections
+        self.slave = slave
+
+        self.speaks_binary = speaks_binary
+        self.binary = False
+        self.baud = 9600
+        self.decoder = serial_protocol.FrameDecoder()
+        self.frames: List[Tuple[float, List[List[int]]]] = []
+        self.received_bytes = 0
+        self.write_lock = Lock()
+        self.stop_event = Event()
+        self.thread = Thread(target=self.run, args=(), daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def close(self):
+        self.stop()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def write(self, data: bytes):
+        with self.write_lock:
+            os.write(self.master, data)
+
+    def send_frame(self, frame_type: int, payload: bytes = b""):
+        self.write(serial_protocol.encode_frame(frame_type, payload))
+
+    def send_hit(self, kind: str):
+        if self.binary:
+            code = serial_protocol.HIT_LASER if kind == "laser" else serial_protocol.HIT_BALL
+            self.write(serial_protocol.hit_frame(code, int(time.monotonic() * 1000)))
+        else:
+            self.write(f"{kind}\r\n".encode("utf-8"))
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            self.received_bytes += len(data)
+            if not self.speaks_binary:
+                data = bytes([b for b in data if b != serial_protocol.SYNC])
+            for item in self.decoder.feed(data):
+                if item[0] == "line":
+                    self.frames.append((time.monotonic(), parse_led_string(item[1])))  # type: ignore
+                else:
+                    self.handle_frame(item[1], item[2])  # type: ignore
+
+    def handle_frame(self, frame_type: int, payload: bytes):
+        self.binary = True
+        if frame_type == serial_protocol.PING:
+            self.send_frame(serial_protocol.PONG)
+        elif frame_type == serial_protocol.SET_BAUD:
+            # a pty has no line rate, just remember what was asked for
+            self.send_frame(serial_protocol.ACK, payload)
+            self.baud = serial_protocol.decode_baud(payload)
+        elif frame_type == serial_protocol.PIXELS:
+            self.frames.append((time.monotonic(), serial_protocol.decode_pixels(payload)))
+
+
+def check(name: str, ok: bool, failures: List[str]):
+    print(f"{'PASS' if ok else 'FAIL'}  {name}")
+    if not ok:
+        failures.append(name)
+
+
+def wait_for(condition, timeout: float = 2.0) -> bool:
+    end = time.time() + timeout
+    while time.time() < end:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class RecordingClient(object):
+    def __init__(self):
+        self.published: List[Tuple[str, dict]] = []
+
+    def publish(self, topic: str, message: dict):
+        self.published.append((topic, message))
+
+
+def load_controller_led_frames():
+    # the controller's copy of led_frames.py, when this runs from a checkout
+    import importlib.util
+    here = os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(here, "..", "..", "..", "..", "controller_modules", "controller", "src", "led_frames.py")
+    if not os.path.exists(path):
+        return None
+    spec = importlib.util.spec_from_file_location("controller_led_frames", path)
+    module = importlib.util.module_from_spec(spec)  # type: ignore
+    spec.loader.exec_module(module)  # type: ignore
+    return module
+
+
+def group_write_race() -> bool:
+    '''
+    One thread's write to an OUTGroup stalls in the "kernel" after the values
+    were read, until another thread has set a different pin of the group. Without
+    the group lock the stalled write then lands with a stale value for that pin.
+    True if both pins end up set.
+    '''
+    import libregpio as GPIO
+    backend = GPIO.FakeChipBackend()
+    ioctl = backend.ioctl
+    stalled = Event()
+    other_done = Event()
+
+    def stalling_ioctl(fd, request, buffer):
+        if request == GPIO.GPIOHANDLE_SET_LINE_VALUES_IOCTL and current_thread().name == "stalled":
+            # the kernel reads the values on entry
+            buffer = bytearray(buffer)
+            stalled.set()
+            # with the lock the other write is waiting on us, don't wait forever
+            other_done.wait(0.2)
+        return ioctl(fd, request, buffer)
+
+    backend.ioctl = stalling_ioctl  # type: ignore
+    previous = GPIO.get_backend()
+    GPIO.set_backend(backend)
+    try:
+        # pins the relay module doesn't use
+        group = GPIO.OUTGroup(["GPIOX_8", "GPIOX_9"])
+        group.request()
+        writer = Thread(target=group.set, args=({0: 1},), name="stalled", daemon=True)
+        writer.start()
+        stalled.wait(1.0)
+        group.set({1: 1})
+        other_done.set()
+        writer.join()
+        ok = group.get(0) == 1 and group.get(1) == 1
+        group.close()
+    finally:
+        GPIO.set_backend(previous)
+    return ok
+
+
+def pwm_own_line() -> bool:
+    '''
+    Software PWM on a free pin next to a held multi-pin group: no toggle may
+    write the group's lines, and a pin of the group is refused for PWM.
+    '''
+    import libregpio as GPIO
+    backend = GPIO.FakeChipBackend()
+    ioctl = backend.ioctl
+    written = set()
+
+    def recording_ioctl(fd, request, buffer):
+        if request == GPIO.GPIOHANDLE_SET_LINE_VALUES_IOCTL:
+            written.add(fd)
+        return ioctl(fd, request, buffer)
+
+    backend.ioctl = recording_ioctl  # type: ignore
+    previous = GPIO.get_backend()
+    GPIO.set_backend(backend)
+    try:
+        group = GPIO.OUTGroup(["GPIOX_8", "GPIOX_9"])
+        group.set({1: 1})
+        group_fds = set(lines.fd for indexes, lines in group.request().values())
+        written.clear()
+        pwm = GPIO.PWM("GPIOX_10", 50, 500, hardware=False)
+        pwm.start()
+        time.sleep(0.05)
+        pwm.stop()
+        ok = len(written) > 0 and not (written & group_fds) and group.get(1) == 1
+        try:
+            GPIO.PWM("GPIOX_8", 50, 500, hardware=False).start()
+            ok = False
+        except ValueError:
+            pass
+        group.close()
+    finally:
+        GPIO.set_backend(previous)
+    return ok
+
+
+def make_adapter(fake: FakeArduino, protocol: str, start_writer: bool = True):
+    import serial
+    import main
+
+    adapter = main.ArduinoAdapter("unused.json")
+    adapter.id = "3"
+    adapter.mqtt_client = RecordingClient()  # type: ignore
+    adapter.ser_connection = serial.Serial(fake.slave_name, 9600, timeout=0.2)
+    adapter.serial_baud = 115200
+    if protocol == "binary":
+        adapter.negotiate_serial()
+    if start_writer:
+        adapter.start_led_writer()
+    return adapter
+
+
+def self_check() -> List[str]:
+    import libregpio as GPIO
+    import led_frames
+    GPIO.set_backend("fake")
+    failures: List[str] = []
+
+    fire_frame = led_frames.render_frame(12, 16)
+    ascii_size = len(led_frames.pixel_string(fire_frame)) + 1
+    binary_size = len(serial_protocol.pixels_frame(fire_frame))
+    print(f"30 pixel fire frame: {ascii_size} bytes ASCII, {binary_size} bytes binary")
+
+    # render_frame is copied from the controller, the two have to agree on every frame
+    controller_frames = load_controller_led_frames()
+    if controller_frames is None:
+        print("SKIP  render_frame matches the controller's (controller_modules not found)")
+    else:
+        pairs = [(level, initial) for initial in range(1, 21) for level in range(0, initial + 3)]
+        check("render_frame matches the controller's",
+              all(led_frames.render_frame(level, initial) == controller_frames.render_frame(level, initial)
+                  for level, initial in pairs), failures)
+
+    cache = led_frames.FrameCache(max_size=8)
+    for initial in range(1, 100):
+        cache.frame(0, initial)
+    check("frame cache stays bounded",
+          len(cache.frames) == 8 and cache.frame(12, 16) == led_frames.pixel_string(fire_frame), failures)
+
+    check("OUTGroup keeps a pin set by another thread", group_write_race(), failures)
+    check("software PWM writes only its own line", pwm_own_line(), failures)
+
+    # round trips that don't need a port
+    decoder = serial_protocol.FrameDecoder()
+    good = serial_protocol.pixels_frame(fire_frame)
+    bad = bytearray(good)
+    bad[5] ^= 0xFF
+    items = decoder.feed(b"Setup Complete\r\n" + bytes(bad) + good[:4])
+    items += decoder.feed(good[4:])
+    check("decoder splits text, drops a bad CRC, reassembles a split frame",
+          [i[0] for i in items] == ["line", "frame"] and decoder.crc_errors == 1
+          and serial_protocol.decode_pixels(items[1][2]) == fire_frame, failures)  # type: ignore
+
+    # a corrupt frame whose payload holds newlines must not come out as lines
+    decoder = serial_protocol.FrameDecoder()
+    dim = serial_protocol.pixels_frame([[10, 10, 10]] * 3 + [[0, 0, 0]])
+    bad = bytearray(dim)
+    bad[4] ^= 0xFF
+    items = decoder.feed(bytes(bad) + b"\n" + good)
+    check("decoder turns no corrupt frame bytes into lines",
+          [i[0] for i in items] == ["frame"] and decoder.crc_errors == 1, failures)
+
+    # binary firmware
+    fake = FakeArduino().start()
+    adapter = make_adapter(fake, "binary")
+    check("negotiates binary frames", adapter.serial_protocol == "binary", failures)
+    check("negotiates 115200 baud", fake.baud == 115200 and adapter.ser_connection.baudrate == 115200, failures)
+
+    adapter.fire_level_commands("", {"level": 12, "initial": 16})
+    first = wait_for(lambda: len(fake.frames) == 1)
+    adapter.led_commands("", {"pixel_hex": "0000ff" * 30})
+    check("LED frames arrive intact",
+          first and wait_for(lambda: len(fake.frames) == 2)
+          and fake.frames[0][1] == fire_frame and fake.frames[1][1] == [[0, 0, 255]] * 30, failures)
+
+    # a hit that doesn't change the frame still finishes its trace
+    adapter.led_commands("", {"pixel_hex": "0000ff" * 30, "trace": {"id": "skip", "stamps": [["serial_read", 0.0]]}})
+    check("unchanged LED frame finishes its trace",
+          wait_for(lambda: "serial_read->serial_skip" in adapter.trace_stats.snapshot()["stages"])
+          and len(fake.frames) == 2, failures)
+
+    # a burst of frames, the writer may skip any but the last
+    before = len(fake.frames)
+    for level in range(16, -1, -1):
+        adapter.fire_level_commands("", {"level": level, "initial": 16})
+    check("latest LED frame wins a burst",
+          wait_for(lambda: len(fake.frames) > before and fake.frames[-1][1] == led_frames.render_frame(0, 16))
+          and adapter.frames_written + adapter.frames_dropped >= 19, failures)
+    print(f"LED writer: {adapter.led_writer_stats()}")
+
+    reader = Thread(target=adapter.serial_reader, args=(), daemon=True)
+    reader.start()
+    fake.send_hit("laser")
+    fake.send_hit("ball")
+    expected = [("3/events/laser_detector/", "hit"), ("3/events/ball_detector/", "hit")]
+    published = lambda: [(topic, msg.get("event_type")) for topic, msg in adapter.mqtt_client.published if "/events/" in topic]  # type: ignore
+    check("hit frames publish events", wait_for(lambda: published() == expected), failures)
+    adapter.run_state_stop = True
+    reader.join()
+    adapter.ser_connection.close()
+    fake.close()
+
+    # provisioning runs before the run state, it has to get its pattern out on its own
+    fake = FakeArduino().start()
+    adapter = make_adapter(fake, "binary", start_writer=False)
+    adapter.provision_state_enter(None, None)
+    colors = {"r": [255, 0, 0], "g": [0, 255, 0], "b": [0, 0, 255], "bl": [0, 0, 0], "w": [255, 255, 255]}
+    discovery = adapter.mqtt_client.published[-1][1]  # type: ignore
+    pattern = [colors[entry] for entry in discovery["pattern"]] * 6
+    check("provisioning pattern reaches the arduino",
+          wait_for(lambda: len(fake.frames) > 0) and fake.frames[-1][1] == pattern, failures)
+    adapter.ser_connection.close()
+    fake.close()
+
+    # firmware from before the binary protocol
+    old = FakeArduino(speaks_binary=False).start()
+    adapter = make_adapter(old, "binary")
+    check("falls back to ASCII for old firmware", adapter.serial_protocol == "ascii", failures)
+    adapter.fire_level_commands("", {"level": 12, "initial": 16})
+    check("ASCII LED frame arrives intact",
+          wait_for(lambda: len(old.frames) > 0) and old.frames[-1][1] == fire_frame, failures)
+    adapter.ser_connection.close()
+    old.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pty fake arduino, self-check of the adapter serial code")
+    parser.parse_args()
+    from loguru import logger
+    logger.remove()
+    failures = self_check()
+    print(f"{len(failures)} failure(s)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from typing import Any, Callable, List
+
+# Renders progress bar frames on the adapter so the controller can send a
+# short {building}/fire_level/set {"level", "initial"} instead of 30 pixels.
+# render_frame is the same window split the controller's led_frames.py uses,
+# fake_arduino.py's self-check fails if the two drift apart.
+
+STRIP_LEN = 30
+FIRE_COLOR = [0, 0, 255]
+
+
+def render_frame(fire_level: int, initial_fire_level: int, strip_len: int = STRIP_LEN) -> List[List[int]]:
+    frame = [[0, 0, 0] for _ in range(strip_len)]
+
+    init = initial_fire_level
+    pixels_per_fs = 2 if init <= 8 else 1
+
+    if fire_level > (init // 2):
+        left = (init // 2) * pixels_per_fs
+        right = (fire_level - (init // 2)) * pixels_per_fs
+    elif fire_level <= (init // 2):
+        left = fire_level * pixels_per_fs
+        right = 0
+    else:
+        left = 0
+        right = 0
+
+    # do the first window's portion of the led strip
+    if left > 0:
+        for i in range(0, left):
+            frame[i] = list(FIRE_COLOR)
+    # do the second window's portion of the led strip
+    if right > 0:
+        for i in range(strip_len - 1, strip_len - 1 - right, -1):
+            frame[i] = list(FIRE_COLOR)
+
+    return frame
+
+
+def decode_hex(pixel_hex: str) -> List[List[int]]:
+    return [
+        [int(pixel_hex[i:i + 2], 16), int(pixel_hex[i + 2:i + 4], 16), int(pixel_hex[i + 4:i + 6], 16)]
+        for i in range(0, len(pixel_hex) - 5, 6)
+    ]
+
+
+def pixel_string(pixel_data: List[List[int]]) -> str:
+    # what the arduino parses: "r,g,b/r,g,b/..."
+    return "/".join([f"{r},{g},{b}" for r, g, b in pixel_data])
+
+
+class LRUCache(object):
+    '''
+    dict with a size limit, the least recently used entry goes first. keys
+    come off MQTT, so a misbehaving sender can't grow it without bound
+    '''
+    def __init__(self, max_size: int = 64):
+        self.max_size = max_size
+        self.entries: OrderedDict = OrderedDict()
+
+    def get(self, key: Any) -> Any:
+        value = self.entries.get(key, None)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: Any, value: Any):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class FrameCache(object):
+    '''
+    rendered frames keyed by (level, initial), a building only ever shows a
+    few dozen. encode turns a frame into whatever goes on the wire, the ASCII
+    pixel string unless told otherwise
+    '''
+    def __init__(self, strip_len: int = STRIP_LEN, encode: Callable[[List[List[int]]], Any] = pixel_string, max_size: int = 64):
+        self.strip_len = strip_len
+        self.encode = encode
+        self.frames = LRUCache(max_size)
+
+    def frame(self, level: int, initial: int) -> Any:
+        key = (level, initial)
+        frame = self.frames.get(key)
+        if frame is None:
+            frame = self.encode(render_frame(level, initial, self.strip_len))
+            self.frames.put(key, frame)
+        return frame
+
+    def clear(self):
+        self.frames.clear()
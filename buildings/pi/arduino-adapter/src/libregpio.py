@@ -1,7 +1,373 @@
-from pin_mapping import PIN_NAME
+from pin_mapping import PIN_NAME, PWM_CHANNEL
 from os import system, popen
-from threading import Thread
-from time import sleep
+from threading import Lock, Thread
+from time import sleep, monotonic_ns
+from collections import deque
+import ctypes
+import os
+import struct
+import fcntl
+
+
+# Output backends. Every OUT goes through a line handle from the active
+# backend:
+#   "chardev" - opens /dev/gpiochipN once and holds GPIO v1 line handles, a set
+#               or get is one ioctl instead of a gpioset fork+exec
+#   "shell"   - the original gpioset/gpioget shell-outs
+#   "fake"    - the chardev code path against an in-memory chip, for tests and
+#               benchmarks on any linux box
+#   "auto"    - chardev when /dev/gpiochip0 is usable, otherwise shell
+
+GPIOHANDLES_MAX = 64
+GPIOHANDLE_REQUEST_OUTPUT = 1 << 1
+GPIOHANDLE_REQUEST_ACTIVE_LOW = 1 << 2
+
+# struct gpiohandle_request / gpiohandle_data from linux/gpio.h (v1 ABI)
+HANDLE_REQUEST = struct.Struct(f"={GPIOHANDLES_MAX}II{GPIOHANDLES_MAX}B32sIi")
+HANDLE_DATA = struct.Struct(f"={GPIOHANDLES_MAX}B")
+
+
+def _iowr(type_, nr, size):
+    return (3 << 30) | (size << 16) | (type_ << 8) | nr
+
+
+GPIO_GET_LINEHANDLE_IOCTL = _iowr(0xB4, 0x03, HANDLE_REQUEST.size)
+GPIOHANDLE_GET_LINE_VALUES_IOCTL = _iowr(0xB4, 0x08, HANDLE_DATA.size)
+GPIOHANDLE_SET_LINE_VALUES_IOCTL = _iowr(0xB4, 0x09, HANDLE_DATA.size)
+
+# timerfd for software PWM
+CLOCK_MONOTONIC = 1
+TFD_CLOEXEC = 0o2000000
+TFD_TIMER_ABSTIME = 1
+# rising edges kept for PWM.stats()
+STATS_EDGES = 1000
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+class _itimerspec(ctypes.Structure):
+    _fields_ = [("it_interval", _timespec), ("it_value", _timespec)]
+
+
+class ShellLines:
+    """Output lines driven with ``gpioset``, one process per set.
+
+    Reads return the last value written, ``gpioget`` would turn an output back into an input.
+    """
+    def __init__(self, chip, offsets, values, active_low=False, command="gpioset"):
+        self.chip = chip
+        self.offsets = list(offsets)
+        self.values = list(values)
+        self.active_low = active_low
+        self.command = command
+
+    def set_values(self, values):
+        self.values = list(values)
+        flags = " -l" if self.active_low else ""
+        pins = " ".join([f"{offset}={value}" for offset, value in zip(self.offsets, self.values)])
+        system(f"{self.command}{flags} {self.chip} {pins}")
+
+    def get_values(self):
+        return list(self.values)
+
+    def close(self):
+        pass
+
+
+class ShellBackend:
+    """The original behaviour, a ``gpioset`` shell-out per change.
+
+    :param command: program to run, defaults to ``gpioset``
+    :type command: str, optional
+    """
+    name = "shell"
+
+    def __init__(self, command="gpioset"):
+        self.command = command
+
+    def request_outputs(self, chip, offsets, values, active_low=False, label="libregpio"):
+        return ShellLines(chip, offsets, values, active_low, self.command)
+
+
+class ChipLines:
+    """Output lines held open through one GPIO v1 line handle.
+
+    :param backend: the backend that requested the handle
+    :param fd: line handle file descriptor
+    :param count: number of lines in the handle
+    """
+    def __init__(self, backend, fd, count):
+        self.backend = backend
+        self.fd = fd
+        self.count = count
+        self.buffer = bytearray(HANDLE_DATA.size)
+
+    def set_values(self, values):
+        """Set every line in the handle with a single ioctl.
+
+        :param values: one ``0``/``1`` per line, in request order
+        :type values: list
+        """
+        HANDLE_DATA.pack_into(self.buffer, 0, *(list(values) + [0] * (GPIOHANDLES_MAX - len(values))))
+        self.backend.ioctl(self.fd, GPIOHANDLE_SET_LINE_VALUES_IOCTL, self.buffer)
+
+    def get_values(self):
+        """Read the lines back from the chip.
+
+        :return: one ``0``/``1`` per line
+        :rtype: list
+        """
+        buffer = bytearray(HANDLE_DATA.size)
+        self.backend.ioctl(self.fd, GPIOHANDLE_GET_LINE_VALUES_IOCTL, buffer)
+        return list(buffer[:self.count])
+
+    def close(self):
+        if self.fd is not None:
+            self.backend.close_fd(self.fd)
+            self.fd = None
+
+
+class ChipBackend:
+    """Linux GPIO character device backend, each gpiochip is opened once.
+
+    :param dev_dir: where the ``gpiochipN`` nodes live, defaults to ``/dev``
+    :type dev_dir: str, optional
+    """
+    name = "chardev"
+
+    def __init__(self, dev_dir="/dev"):
+        self.dev_dir = dev_dir
+        self.chips = {}
+
+    def chip_fd(self, chip):
+        fd = self.chips.get(chip, None)
+        if fd is None:
+            fd = self.open_chip(chip)
+            self.chips[chip] = fd
+        return fd
+
+    def open_chip(self, chip):
+        return os.open(os.path.join(self.dev_dir, f"gpiochip{chip}"), os.O_RDWR | os.O_CLOEXEC)
+
+    def ioctl(self, fd, request, buffer):
+        fcntl.ioctl(fd, request, buffer, True)
+
+    def close_fd(self, fd):
+        os.close(fd)
+
+    def request_outputs(self, chip, offsets, values, active_low=False, label="libregpio"):
+        """Request output lines on a chip as one handle.
+
+        :param chip: gpio chip number as a string (see :func:`set_chip`)
+        :param offsets: line offsets on that chip
+        :param values: initial value per line
+        :param active_low: request the lines active-low
+        :param label: consumer label the kernel shows for the lines
+        :return: a handle with ``set_values``/``get_values``/``close``
+        :rtype: ChipLines
+        """
+        offsets = list(offsets)
+        if len(offsets) > GPIOHANDLES_MAX:
+            raise Exception(f"at most {GPIOHANDLES_MAX} lines per handle")
+        padding = GPIOHANDLES_MAX - len(offsets)
+        flags = GPIOHANDLE_REQUEST_OUTPUT | (GPIOHANDLE_REQUEST_ACTIVE_LOW if active_low else 0)
+        buffer = bytearray(HANDLE_REQUEST.pack(
+            *(offsets + [0] * padding),
+            flags,
+            *(list(values) + [0] * padding),
+            label.encode("utf-8")[:31],
+            len(offsets),
+            -1,
+        ))
+        self.ioctl(self.chip_fd(chip), GPIO_GET_LINEHANDLE_IOCTL, buffer)
+        fd = HANDLE_REQUEST.unpack(buffer)[-1]
+        return ChipLines(self, fd, len(offsets))
+
+
+class FakeChipBackend(ChipBackend):
+    """:class:`ChipBackend` against an in-memory chip.
+
+    The request/get/set structs are packed and unpacked exactly as for the
+    kernel, so this exercises the real code path minus the syscall.
+    ``lines`` maps ``(chip, offset)`` to the current value.
+    """
+    name = "fake"
+
+    def __init__(self):
+        super().__init__(dev_dir="")
+        self.lines = {}
+        self.handles = {}
+        self.next_fd = 1000
+        self.ioctl_count = 0
+
+    def open_chip(self, chip):
+        self.next_fd += 1
+        self.handles[self.next_fd] = ("chip", chip, [])
+        return self.next_fd
+
+    def close_fd(self, fd):
+        self.handles.pop(fd, None)
+
+    def ioctl(self, fd, request, buffer):
+        self.ioctl_count += 1
+        kind, chip, offsets = self.handles[fd]
+        if request == GPIO_GET_LINEHANDLE_IOCTL:
+            fields = HANDLE_REQUEST.unpack(buffer)
+            count = fields[GPIOHANDLES_MAX + 1 + GPIOHANDLES_MAX + 1]
+            offsets = list(fields[:count])
+            defaults = fields[GPIOHANDLES_MAX + 1:GPIOHANDLES_MAX + 1 + count]
+            for handle in self.handles.values():
+                if handle[1] == chip and set(handle[2]) & set(offsets):
+                    raise OSError(16, "Device or resource busy")
+            for offset, value in zip(offsets, defaults):
+                self.lines[(chip, offset)] = value
+            self.next_fd += 1
+            self.handles[self.next_fd] = ("lines", chip, offsets)
+            HANDLE_REQUEST.pack_into(buffer, 0, *(list(fields[:-1]) + [self.next_fd]))
+        elif request == GPIOHANDLE_SET_LINE_VALUES_IOCTL:
+            values = HANDLE_DATA.unpack(buffer)
+            for offset, value in zip(offsets, values):
+                self.lines[(chip, offset)] = 1 if value else 0
+        elif request == GPIOHANDLE_GET_LINE_VALUES_IOCTL:
+            values = [self.lines.get((chip, offset), 0) for offset in offsets]
+            HANDLE_DATA.pack_into(buffer, 0, *(values + [0] * (GPIOHANDLES_MAX - len(values))))
+        else:
+            raise OSError(22, "Invalid argument")
+
+
+_backend = None
+
+
+def make_backend(name="auto"):
+    """Build an output backend by name.
+
+    :param name: ``auto``, ``chardev``, ``shell`` or ``fake``
+    :type name: str, optional
+    """
+    if name == "auto":
+        name = "chardev" if os.access("/dev/gpiochip0", os.R_OK | os.W_OK) else "shell"
+    if name == "chardev":
+        return ChipBackend()
+    elif name == "shell":
+        return ShellBackend()
+    elif name == "fake":
+        return FakeChipBackend()
+    raise Exception(f"unknown gpio backend {name}")
+
+
+def set_backend(backend):
+    """Use ``backend`` for every OUT that hasn't requested its lines yet.
+
+    :param backend: a backend object or a name for :func:`make_backend`
+    """
+    global _backend
+    if isinstance(backend, str):
+        backend = make_backend(backend)
+    _backend = backend
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = make_backend()
+    return _backend
+
+
+# pin name -> the OUTGroup holding it, so cleanup() can reuse live handles
+_groups = {}
+
+
+class OUTGroup:
+    """Several output pins held through one line handle per gpio chip, so they can be set together.
+
+    Lines are requested from the backend on first use. Pins of one group are
+    written together, so every call holds the group's lock: otherwise a second
+    thread could write back a stale snapshot of the other pins.
+
+    :param pins: GPIO pin names (i.e. ``["GPIOX_17", "GPIOX_18"]``)
+    :type pins: list
+    :param initial: value every pin is driven to when the lines are requested, defaults to ``0``
+    :type initial: int, optional
+    """
+    def __init__(self, pins, active_low=False, label="libregpio", initial=0):
+        self.pins = list(pins)
+        self.chips = [set_chip(pin) for pin in self.pins]
+        self.offsets = [PIN_NAME[pin] for pin in self.pins]
+        self.values = [initial] * len(self.pins)
+        self.active_low = active_low
+        self.label = label
+        self.handles = None
+        # held from updating self.values through every set_values call
+        self.lock = Lock()
+        for pin in self.pins:
+            _groups[pin] = self
+
+    def request(self):
+        with self.lock:
+            return self._request()
+
+    def _request(self):
+        if self.handles is None:
+            backend = get_backend()
+            handles = {}
+            try:
+                for chip in sorted(set(self.chips)):
+                    indexes = [i for i, c in enumerate(self.chips) if c == chip]
+                    lines = backend.request_outputs(
+                        chip, [self.offsets[i] for i in indexes], [self.values[i] for i in indexes],
+                        self.active_low, self.label
+                    )
+                    handles[chip] = (indexes, lines)
+            except Exception:
+                for indexes, lines in handles.values():
+                    lines.close()
+                raise
+            self.handles = handles
+        return self.handles
+
+    def set(self, values):
+        """Set pins by index, one backend call per chip touched.
+
+        :param values: ``{index: value}``
+        :type values: dict
+        """
+        with self.lock:
+            chips = set()
+            for index, value in values.items():
+                if value in [0, 1]:
+                    self.values[index] = value
+                    chips.add(self.chips[index])
+            handles = self._request()
+            for chip in chips:
+                indexes, lines = handles[chip]
+                lines.set_values([self.values[i] for i in indexes])
+
+    def get(self, index):
+        """Read a pin's value back through the backend.
+
+        :param index: pin index in this group
+        :type index: int
+        """
+        with self.lock:
+            indexes, lines = self._request()[self.chips[index]]
+            return lines.get_values()[indexes.index(index)]
+
+    def line(self, index):
+        """An OUT that drives one pin of this group.
+
+        :param index: pin index in this group
+        :type index: int
+        """
+        return OUT(self.pins[index], group=self, index=index)
+
+    def close(self):
+        with self.lock:
+            if self.handles is not None:
+                for indexes, lines in self.handles.values():
+                    lines.close()
+                self.handles = None
 
 
 class OUT:
@@ -9,10 +375,21 @@ class OUT:
 
     :param pin: GPIO pin name (i.e. GPIOX_4)
     :type pin: str
+    :param group: the OUTGroup holding this pin. When not given the pin's existing group is reused, or it gets a group of its own
+    :type group: OUTGroup, optional
     """
-    def __init__(self, pin):
+    def __init__(self, pin, group=None, index=0):
         self.GPIOCHIP = set_chip(pin)
         self.pin = PIN_NAME[pin]
+        if group is None:
+            # a line can only be held once, so share whoever already has it
+            group = _groups.get(pin, None)
+            if group is not None:
+                index = group.pins.index(pin)
+            else:
+                group = OUTGroup([pin])
+        self.group = group
+        self.index = index
         self.state = 0
 
     def output(self, value):
@@ -23,29 +400,31 @@ class OUT:
         """
         self.value = value
         if self.value in [0, 1]:
-            system(f"gpioset {self.GPIOCHIP} {self.pin}={self.value}")
+            self.group.set({self.index: self.value})
+            self.state = self.value
 
     def low(self):
         """Set a value of ``0`` to a libregpio.OUT object"""
-        system(f"gpioset {self.GPIOCHIP} {self.pin}=0")
-        self.state = 0
+        self.output(0)
 
     def high(self):
         """Set a value of ``1`` to a libregpio.OUT object."""
-        system(f"gpioset {self.GPIOCHIP} {self.pin}=1")
-        self.state = 1
+        self.output(1)
 
     def active_low(self):
         """Set libregpio.OUT object to active_low."""
-        system(f"gpioset {self.GPIOCHIP} {self.pin} -l")
+        self.group.close()
+        self.group.active_low = True
+        self.group.set({self.index: self.state})
 
     def toggle(self):
         """Toggle output value of a GPIO pin"""
-        current_value = int(popen(f"gpioget -B disable {self.GPIOCHIP} {self.pin}").read())
+        current_value = self.group.get(self.index)
         self.output(int(not(current_value)))
 
     def get_state(self) -> int:
-        return self.state
+        """Value the pin is actually driven to, read back through the backend."""
+        return self.group.get(self.index)
 
 
 class IN:
@@ -102,10 +481,50 @@ class IN:
         return edge_val
 
 
+class MonotonicTimer:
+    """Sleeps until absolute CLOCK_MONOTONIC deadlines using a Linux timerfd.
+
+    Falls back to ``sleep()`` when timerfd isn't available. Deadlines are in
+    ``time.monotonic_ns()`` nanoseconds, which is the same clock.
+    """
+    def __init__(self):
+        self.fd = None
+        try:
+            self.libc = ctypes.CDLL(None, use_errno=True)
+            fd = self.libc.timerfd_create(CLOCK_MONOTONIC, TFD_CLOEXEC)
+            if fd >= 0:
+                self.fd = fd
+        except (OSError, AttributeError):
+            self.fd = None
+
+    def wait_until(self, deadline_ns):
+        if self.fd is None:
+            delay = deadline_ns - monotonic_ns()
+            if delay > 0:
+                sleep(delay / 1e9)
+            return
+        spec = _itimerspec()
+        spec.it_value.tv_sec = deadline_ns // 1000000000
+        spec.it_value.tv_nsec = deadline_ns % 1000000000
+        if self.libc.timerfd_settime(self.fd, TFD_TIMER_ABSTIME, ctypes.byref(spec), None) != 0:
+            raise OSError(ctypes.get_errno(), "timerfd_settime failed")
+        # blocks until the deadline, returns right away if it already passed
+        os.read(self.fd, 8)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
 class PWM(Thread):
     """This is a class representantion of a GPIO pin to be used as an PWM output.
 
-    Use only with pins compatible with PWM (pulse width modulation).
+    Pins listed in ``pin_mapping.PWM_CHANNEL`` use the sysfs hardware PWM
+    controller. That table is empty on the Le Potato, so in practice every pin
+    gets software PWM: a thread toggling the pin at timerfd deadlines through a
+    line handle of its own, so a toggle never rewrites another pin. A pin that
+    is already held by a multi-pin OUTGroup can't be used for software PWM.
 
     Creating the class instance does not automatically sends a PWM output.
 
@@ -115,30 +534,93 @@ class PWM(Thread):
     :type duty_cycle: int
     :param freq: frequency in Hertz
     :type freq: float
-    """ 
+    :param hardware: ``(pwmchip, channel)`` to force the hardware path, ``False`` to force software, defaults to ``pin_mapping.PWM_CHANNEL``
+    :type hardware: tuple, optional
+    """
 
-    def __init__(self, pin, duty_cycle, freq):
+    def __init__(self, pin, duty_cycle, freq, hardware=None, sysfs_dir="/sys/class/pwm"):
         self.GPIOCHIP = set_chip(pin)
         self.pin_name = pin
         self.pin = PIN_NAME[pin]
         self.duty_cycle = duty_cycle
         self.max_cycle = 100.0
-        self.pulse_time = 1.0/freq
-        self.slice = self.pulse_time / self.max_cycle
+        self.freq = freq
+        self.period_ns = int(1e9 / freq)
         self.to_stop = False
-        self.stopped = False
+        self.stopped = True
+        self.thread = None
+
+        if hardware is None:
+            hardware = PWM_CHANNEL.get(pin, False)
+        self.hw_path = None
+        if hardware:
+            chip, channel = hardware
+            self.hw_chip = os.path.join(sysfs_dir, f"pwmchip{chip}")
+            self.hw_channel = channel
+            if os.path.isdir(self.hw_chip):
+                self.hw_path = os.path.join(self.hw_chip, f"pwm{channel}")
+        self.mode = "hardware" if self.hw_path is not None else "software"
+
+        self.out = None
+        # rising edges as (scheduled, actual) monotonic ns, for the stats
+        self.edges = deque(maxlen=STATS_EDGES)
 
     def pulse_loop(self):
         """This method is called by ``start()`` to loop the pulse output on a different thread
 
         Do not call this method outside of this class.
         """
-        while self.to_stop == False:
-            system(f"gpioset {self.GPIOCHIP} {self.pin}=1")
-            sleep(self.duty_cycle * self.slice)
-            system(f"gpioset {self.GPIOCHIP} {self.pin}=0")
-            sleep((self.max_cycle - self.duty_cycle) * self.slice)
-        self.stopped = True
+        timer = MonotonicTimer()
+        level = None
+        next_edge = monotonic_ns()
+        try:
+            while self.to_stop == False:
+                period = self.period_ns
+                high_time = int(period * min(max(self.duty_cycle, 0), self.max_cycle) / self.max_cycle)
+
+                if high_time > 0 and level != 1:
+                    self.out.high()
+                    level = 1
+                elif high_time == 0 and level != 0:
+                    self.out.low()
+                    level = 0
+                self.edges.append((next_edge, monotonic_ns()))
+
+                if 0 < high_time < period:
+                    timer.wait_until(next_edge + high_time)
+                    self.out.low()
+                    level = 0
+
+                next_edge += period
+                now = monotonic_ns()
+                if now - next_edge > period:
+                    # fell more than a whole period behind, don't try to catch up
+                    next_edge = now
+                timer.wait_until(next_edge)
+        finally:
+            timer.close()
+            self.stopped = True
+
+    def hw_write(self, name, value):
+        with open(os.path.join(self.hw_path, name), "w") as file:
+            file.write(str(value))
+
+    def hw_configure(self):
+        duty_ns = int(self.period_ns * min(max(self.duty_cycle, 0), self.max_cycle) / self.max_cycle)
+        # the kernel rejects a duty cycle longer than the period, so order the writes
+        if duty_ns > int(self.hw_read("period") or 0):
+            self.hw_write("period", self.period_ns)
+            self.hw_write("duty_cycle", duty_ns)
+        else:
+            self.hw_write("duty_cycle", duty_ns)
+            self.hw_write("period", self.period_ns)
+
+    def hw_read(self, name):
+        try:
+            with open(os.path.join(self.hw_path, name), "r") as file:
+                return file.read().strip()
+        except OSError:
+            return None
 
     def start(self, duty_cycle=None):
         """Start the PWM output.
@@ -150,7 +632,25 @@ class PWM(Thread):
         """
         if duty_cycle:
             self.duty_cycle = duty_cycle
-        self.thread = Thread(None, target=self.pulse_loop)
+        if self.mode == "hardware":
+            if not os.path.isdir(self.hw_path):
+                with open(os.path.join(self.hw_chip, "export"), "w") as file:
+                    file.write(str(self.hw_channel))
+            self.hw_configure()
+            self.hw_write("enable", 1)
+            self.stopped = False
+            return
+
+        if self.out is None:
+            group = _groups.get(self.pin_name, None)
+            if group is not None and len(group.pins) > 1:
+                # every toggle would rewrite the group's other lines too
+                raise ValueError(f"{self.pin_name} is held by a group of {len(group.pins)} pins, software PWM needs its own line")
+            self.out = OUT(self.pin_name)
+        self.to_stop = False
+        self.stopped = False
+        self.edges.clear()
+        self.thread = Thread(None, target=self.pulse_loop, daemon=True)
         self.thread.start()
 
     def stop(self):
@@ -158,9 +658,13 @@ class PWM(Thread):
 
         It 'cleans up' the GPIO pin.
         """
-        while self.stopped == False:
-            self.to_stop = True
-            sleep(0.01)
+        if self.mode == "hardware":
+            self.hw_write("enable", 0)
+            self.stopped = True
+            return
+        self.to_stop = True
+        if self.thread is not None:
+            self.thread.join()
         cleanup([self.pin_name])
 
     def change_duty_cycle(self, duty_cycle):
@@ -170,15 +674,67 @@ class PWM(Thread):
         :type duty_cycle: int
         """
         self.duty_cycle = duty_cycle
-    
+        if self.mode == "hardware" and not self.stopped:
+            self.hw_configure()
+
     def change_freq(self, freq):
         """Modify the current frequency
 
         :param freq: frequency in Hertz
         :type freq: float
         """
-        self.pulse_time = 1.0/freq
-        self.slice = self.pulse_time / self.max_cycle
+        self.freq = freq
+        self.period_ns = int(1e9 / freq)
+        self.edges.clear()
+        if self.mode == "hardware" and not self.stopped:
+            self.hw_configure()
+
+    def stats(self):
+        """Measured output, over the last rising edges for software PWM.
+
+        :return: ``mode``, ``target_freq``, ``achieved_freq`` (Hz), ``jitter_us``
+            (standard deviation of the edge-to-edge period) and ``max_late_us``
+            (worst rising edge behind its deadline)
+        :rtype: dict
+        """
+        if self.mode == "hardware":
+            period = self.hw_read("period")
+            achieved = 1e9 / int(period) if period else 0.0
+            return {"mode": self.mode, "target_freq": self.freq, "achieved_freq": achieved,
+                    "jitter_us": 0.0, "max_late_us": 0.0}
+
+        edges = list(self.edges)
+        if len(edges) < 2:
+            return {"mode": self.mode, "target_freq": self.freq, "achieved_freq": 0.0,
+                    "jitter_us": 0.0, "max_late_us": 0.0}
+        actual = [a for s, a in edges]
+        periods = [b - a for a, b in zip(actual, actual[1:])]
+        mean = sum(periods) / len(periods)
+        variance = sum([(p - mean) ** 2 for p in periods]) / len(periods)
+        return {
+            "mode": self.mode,
+            "target_freq": self.freq,
+            "achieved_freq": 1e9 / mean if mean > 0 else 0.0,
+            "jitter_us": variance ** 0.5 / 1000,
+            "max_late_us": max([a - s for s, a in edges]) / 1000,
+        }
+
+
+def output_many(outputs):
+    """Set several libregpio.OUT objects in one go, a single backend call per group and gpio chip.
+
+    :param outputs: ``(libregpio.OUT, value)`` pairs, value ``0`` or ``1``
+    :type outputs: iterable
+    """
+    by_group = {}
+    for out, value in outputs:
+        if value in [0, 1]:
+            by_group.setdefault(id(out.group), (out.group, []))[1].append((out, value))
+    for group, pins in by_group.values():
+        group.set({out.index: value for out, value in pins})
+        for out, value in pins:
+            out.value = value
+            out.state = value
 
 
 def cleanup(pins=None):
@@ -189,12 +745,15 @@ def cleanup(pins=None):
     :param pins: list/tuple of pin or pins by name, defaults to ``None``
     :type pins: iterable, optional
     """
-    if pins:
-        for pin in pins:
-            system(f"gpioset {set_chip(pin)} {PIN_NAME[pin]}=0")
-    else:
-        for pin in PIN_NAME.values():
-            system(f"gpioset {set_chip(pin)} {pin}=0")
+    for pin in (pins if pins else list(PIN_NAME.keys())):
+        group = _groups.get(pin, None)
+        if group is not None:
+            group.set({group.pins.index(pin): 0})
+        else:
+            # nobody holds the line, grab it just long enough to drive it low
+            lines = get_backend().request_outputs(set_chip(pin), [PIN_NAME[pin]], [0])
+            lines.set_values([0])
+            lines.close()
 
 
 def set_chip(pin_name):
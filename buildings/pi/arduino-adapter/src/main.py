@@ -1,37 +1,43 @@
 import mqtt_client
 from pysm import State, StateMachine, Event
-from threading import Lock, Thread
-import netifaces as ni
+from threading import Event as ThreadEvent, Lock, Thread
+from collections import deque
 import serial
-from typing import Union, List
+from typing import Any, Dict, Union, List, Tuple
 import json
+import math
 import libregpio as GPIO
+import led_frames
+import serial_protocol
+import tracing
 import random
 import time
 from loguru import logger
 from queue import Queue
 import sys
 
+# only provisioning needs it (to show the IP), the bench rig runs without it
+try:
+    import netifaces as ni
+except ImportError:
+    ni = None
+
 
 class LePotatoRelayModule(object):
     def __init__(self):
-        self.channels: List[GPIO.OUT] = []
-        # channel 1
-        self.channels.append(GPIO.OUT("GPIOX_17"))
-        # channel 2
-        self.channels.append(GPIO.OUT("GPIOX_18"))
-        # channel 3
-        self.channels.append(GPIO.OUT("GPIOX_6"))
-        # channel 4
-        self.channels.append(GPIO.OUT("GPIOX_2"))
-        # channel 5
-        self.channels.append(GPIO.OUT("GPIOX_7"))
-        # channel 6
-        self.channels.append(GPIO.OUT("GPIOX_3"))
-        # channel 7
-        self.channels.append(GPIO.OUT("GPIOX_4"))
-        # channel 8
-        self.channels.append(GPIO.OUT("GPIOX_5"))
+        # all eight channels share one line handle, so a batch of relay changes
+        # is a single gpio operation. the board is active low, start them all open
+        self.group = GPIO.OUTGroup([
+            "GPIOX_17",  # channel 1
+            "GPIOX_18",  # channel 2
+            "GPIOX_6",  # channel 3
+            "GPIOX_2",  # channel 4
+            "GPIOX_7",  # channel 5
+            "GPIOX_3",  # channel 6
+            "GPIOX_4",  # channel 7
+            "GPIOX_5",  # channel 8
+        ], label="relays", initial=1)
+        self.channels: List[GPIO.OUT] = [self.group.line(i) for i in range(len(self.group.pins))]
 
     def open_relay(self, relay):
         if relay >= 0 and relay <= (len(self.channels) - 1):
@@ -41,6 +47,17 @@ class LePotatoRelayModule(object):
         if relay >= 0 and relay <= (len(self.channels) - 1):
             self.channels[relay].low()
 
+    def set_relays(self, closed: Dict[int, bool]):
+        '''
+        close (True) or open (False) several relays with one gpio operation
+        '''
+        outputs = []
+        for relay, close in closed.items():
+            if relay >= 0 and relay <= (len(self.channels) - 1):
+                outputs.append((self.channels[relay], 0 if close else 1))
+        if outputs:
+            GPIO.output_many(outputs)
+
     def get_relay_state(self, relay):
         """
         return 1 means closed
@@ -55,18 +72,28 @@ class LePotatoRelayModule(object):
 
 
 class ArduinoAdapter(object):
-    def __init__(self, config_file):
+    def __init__(self, config_file, client: Any = None):
 
         self.config_file = config_file
 
+        # client defaults to a real broker connection made in init,
+        # bench_adapter.py passes an in-process one
+        self.client = client
         self.mqtt_client: mqtt_client.MQTTClient
 
         self.ser_connection: serial.Serial
         self.serial_port = "/dev/ttyACM1"
         self.ser_lock = Lock()
+        # "ascii" is the original line protocol, "binary" the framed one in
+        # serial_protocol.py, which also moves the port up to serial_baud
+        self.serial_protocol = "ascii"
+        self.serial_baud = 115200
+        self.decoder = serial_protocol.FrameDecoder()
 
         self.id = ""
         self.interface = "eth0"
+        # set when one controller hosts several courts, e.g. "court2/"
+        self.topic_prefix = ""
 
         self.relays = LePotatoRelayModule()
 
@@ -76,11 +103,55 @@ class ArduinoAdapter(object):
         self.window_2_channel = 2
         self.hopper_channel = 3
 
-        self.prev_pixel_cmd = ""
+        self.prev_pixel_cmd = b""
         self.last_pixel_write = 0
+        # the writer has no timer of its own: an unchanged frame is only resent
+        # when the controller's safety refresh (every 5 s) posts it again, so
+        # that refresh bounds how long an Arduino that reset stays dark. Keep
+        # this below safety_refresh_interval or the refresh gets skipped too.
+        self.led_resend_interval = 2.5
+        # the controller only ever sends a handful of distinct frames, both
+        # caches hold them already encoded for the serial port
+        self.pixel_hex_cache = led_frames.LRUCache(64)
+        # fire_level/set frames rendered here, keyed by (level, initial)
+        self.frame_cache = led_frames.FrameCache(encode=self.encode_pixels)
+
+        # LED frames go through a one slot mailbox to led_writer, which only
+        # ever writes the newest one, so MQTT callbacks never wait on the port
+        self.pixel_slot: Union[Tuple[bytes, float, Union[dict, None]], None] = None
+        self.pixel_slot_lock = Lock()
+        self.pixel_ready = ThreadEvent()
+        self.led_thread = Thread(target=self.led_writer, args=(), daemon=True)
+        self.frames_written = 0
+        # frames replaced in the slot before the writer got to them
+        self.frames_dropped = 0
+        # post -> written time of recent LED frames, in seconds
+        self.write_latencies = deque(maxlen=1000)
 
         self.has_arduino = True
 
+        # lines from the arduino, each handled the moment readline returns it
+        self.line_handlers = {
+            "laser": self.handle_laser_hit,
+            "ball": self.handle_ball_hit,
+        }
+        # arrival -> publish time of recent hits, in seconds
+        self.hit_latencies = deque(maxlen=1000)
+        self.hits_published = 0
+
+        # hits carry a latency trace to the controller, it comes back on the
+        # LED and relay commands and ends here after the serial write / GPIO set
+        self.trace_hits = True
+        self.trace_stats = tracing.TraceStats()
+        # the controller pings us for clock sync and sends back our offset
+        # against it, which moves trace stamps onto the controller's timebase
+        self.apply_clock_offset = True
+        self.clock_estimate: Dict[str, float] = {}
+
+        # one worker flashes the light, hits during a flash just extend it
+        self.flash_request = ThreadEvent()
+        self.flash_thread = Thread(target=self.flash_worker, args=(), daemon=True)
+
         #################### S T A T E  M A C H I N E   S T U F F ####################
         self.sm_lock = Lock()
         self.event_queue = Queue()
@@ -96,7 +167,7 @@ class ArduinoAdapter(object):
         self.provisioning_state.handlers = {"enter": self.provision_state_enter}
 
         self.run_state = State("run_state")
-        self.run_state.handlers = {"enter": self.run_state_enter}
+        self.run_state.handlers = {"enter": self.run_state_enter, "exit": self.run_state_exit}
         self.run_state_thread: Thread
         self.run_state_stop: bool = False
 
@@ -144,9 +215,11 @@ class ArduinoAdapter(object):
         # see if the config file has an alternate config for the mqtt broker
         # if not use defaults
         logger.debug("Starting MQTT thread")
-        mqtt_broker = self.config.get("mqtt_broker", "192.168.1.100")
-        self.mqtt_client = mqtt_client.MQTTClient(mqtt_broker, 1883)
-        self.mqtt_client.start_threaded()
+        if self.client is None:
+            mqtt_broker = self.config.get("mqtt_broker", "192.168.1.100")
+            self.client = mqtt_client.MQTTClient(mqtt_broker, 1883)
+            self.client.start_threaded()
+        self.mqtt_client = self.client
         start_time = time.time()
 
         while not self.mqtt_client.is_connected():
@@ -155,16 +228,24 @@ class ArduinoAdapter(object):
                 logger.debug("Couldnt establish MQTT connection, quitting...")
                 sys.exit(1)
 
+        # "auto" uses the gpiochip character device when it's there, see libregpio
+        GPIO.set_backend(self.config.get("gpio_backend", "auto"))
+
         logger.debug("Setting relay channels according to the config file")
         self.heater_channel = self.config.get("heater_channel", self.heater_channel)
         self.light_channel = self.config.get("light_channel", self.light_channel)
 
         logger.debug("Setting up the serial port")
         self.serial_port = self.config.get("serial_port", self.serial_port)
+        self.led_resend_interval = self.config.get("led_resend_interval", self.led_resend_interval)
         try:
             self.ser_connection = serial.Serial(self.serial_port, 9600, timeout=1.0)
-            time.sleep(4)  # gives arduino time to setup and start sending
+            # gives arduino time to setup and start sending
+            time.sleep(self.config.get("serial_startup_delay", 4))
             self.ser_connection.reset_input_buffer()
+            if self.config.get("serial_protocol", "ascii") == "binary":
+                self.serial_baud = self.config.get("serial_baud", self.serial_baud)
+                self.negotiate_serial()
         except serial.SerialException as e:
             logger.warning(
                 f"*****THE DEFINED SERIAL PORT {self.serial_port} WAS NOT FOUND.. SETTING has_arduino TO FALSE*******"
@@ -172,6 +253,12 @@ class ArduinoAdapter(object):
             self.has_arduino = False
 
         self.interface = self.config.get("interface", self.interface)
+        self.trace_hits = self.config.get("trace_hits", self.trace_hits)
+        self.apply_clock_offset = self.config.get("apply_clock_offset", self.apply_clock_offset)
+
+        self.topic_prefix = self.config.get("topic_prefix", self.topic_prefix)
+        if self.topic_prefix != "" and not self.topic_prefix.endswith("/"):
+            self.topic_prefix += "/"
 
         # see if the config file has a configured identity already
         # if not, send off to provisioning
@@ -185,63 +272,150 @@ class ArduinoAdapter(object):
             logger.debug("ID found, going to run")
             self.event_queue.put(Event("ready_to_run_event"))
 
+    def topic(self, suffix: str) -> str:
+        return self.topic_prefix + suffix
+
     def run_state_enter(self, state, event):
         logger.debug("Entering RUN state!")
+        self.run_state_stop = False
+        if not self.flash_thread.is_alive():
+            self.flash_thread.start()
+        self.start_led_writer()
         self.run_state_thread = Thread(target=self.run_state_job, args=())
         self.run_state_thread.start()
 
     def run_state_job(self):
         logger.debug("Performing RUN job!")
-        self.run_state_stop = False
 
-        self.mqtt_client.register_callback(f"{self.id}/relay/set", self.relay_commands)
+        self.mqtt_client.register_callback(self.topic(f"{self.id}/relay/set"), self.relay_commands)
+        self.mqtt_client.register_callback(self.topic(f"{self.id}/clock/ping"), self.clock_ping)
+        self.mqtt_client.register_callback(self.topic(f"{self.id}/clock/offset"), self.clock_offset)
         if self.has_arduino:
             self.mqtt_client.register_callback(
-                f"{self.id}/progress_bar/set", self.led_commands
+                self.topic(f"{self.id}/progress_bar/set"), self.led_commands
+            )
+            self.mqtt_client.register_callback(
+                self.topic(f"{self.id}/fire_level/set"), self.fire_level_commands
             )
 
-        self.mqtt_client.publish(f"{self.id}/events/connected/", {"time": time.time()})
+        self.mqtt_client.publish(self.topic(f"{self.id}/events/connected/"), {"time": time.time()})
 
-        while True:
-            if self.has_arduino:
-                data = ""
-                # see if there are any incoming bytes
-                if self.ser_connection.in_waiting > 0:
-                    # and block until we get a terminating char
-                    # self.ser_lock.acquire()
-                    try:
-                        data = self.ser_connection.readline().decode("utf-8").rstrip()
-                        logger.debug(f"got message: {data} from arduino")
-                    except Exception as e:
-                        logger.debug(
-                            "There was an error when trying to read from the serial port"
-                        )
-                    # self.ser_lock.release()
-
-                # if there is a new message, handle it
-                if data == "laser":
-                    self.mqtt_client.publish(
-                        f"{self.id}/events/laser_detector/", {"event_type": "hit"}
-                    )
-                    # flash the LED
-                    Thread(target=self.flash_led, args=()).start()
-                elif data == "ball":
-                    self.mqtt_client.publish(
-                        f"{self.id}/events/ball_detector/", {"event_type": "hit"}
-                    )
-                    # flash the LED
-                    Thread(target=self.flash_led, args=()).start()
-            if self.run_state_stop == True:
-                break
-            time.sleep(0.01)
+        if self.has_arduino:
+            self.serial_reader()
+        else:
+            while not self.run_state_stop:
+                time.sleep(0.5)
+
+    def serial_reader(self):
+        # read blocks until at least a byte or the port timeout, so there's no
+        # polling and the timeout only bounds how long a stop takes
+        while not self.run_state_stop:
+            try:
+                raw = self.ser_connection.read(max(1, self.ser_connection.in_waiting))
+            except Exception as e:
+                logger.debug(
+                    "There was an error when trying to read from the serial port"
+                )
+                time.sleep(0.1)
+                continue
+            arrived = time.monotonic()
+            if not raw:
+                continue
+            # text lines and binary frames can both show up, the decoder splits them
+            for item in self.decoder.feed(raw):
+                if item[0] == "line":
+                    logger.debug(f"got message: {item[1]} from arduino")
+                    self.dispatch_line(item[1], arrived)  # type: ignore
+                elif item[1] == serial_protocol.HIT:
+                    kind, millis = serial_protocol.decode_hit(item[2])  # type: ignore
+                    logger.debug(f"got {kind} hit frame from arduino")
+                    self.dispatch_line(kind, arrived)
+
+    def serial_request(self, frame_type: int, payload: bytes, expect: int, timeout: float = 1.0) -> bool:
+        '''
+        send a frame and wait for a frame of type expect, only used before the reader starts
+        '''
+        with self.ser_lock:
+            self.ser_connection.write(serial_protocol.encode_frame(frame_type, payload))
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            raw = self.ser_connection.read(max(1, self.ser_connection.in_waiting))
+            for item in self.decoder.feed(raw):
+                if item[0] == "frame" and item[1] == expect:
+                    return True
+        return False
+
+    def negotiate_serial(self):
+        # firmware that doesn't know frames never answers, so stay on ASCII
+        if not self.serial_request(serial_protocol.PING, b"", serial_protocol.PONG):
+            logger.warning("Arduino didn't answer a binary PING, staying on the ASCII protocol")
+            # old firmware kept the unanswered PING in its line buffer, end that line
+            self.ser_connection.write(b"\n")
+            self.set_serial_protocol("ascii")
+            return
+        self.set_serial_protocol("binary")
+
+        old_baud = self.ser_connection.baudrate
+        if self.serial_baud == old_baud:
+            return
+        baud = serial_protocol.baud_payload(self.serial_baud)
+        if not self.serial_request(serial_protocol.SET_BAUD, baud, serial_protocol.ACK):
+            logger.warning(f"Arduino didn't accept {self.serial_baud} baud, staying at {old_baud}")
+            return
+        self.ser_connection.flush()
+        self.ser_connection.baudrate = self.serial_baud
+        time.sleep(0.05)
+        self.ser_connection.reset_input_buffer()
+        if not self.serial_request(serial_protocol.PING, b"", serial_protocol.PONG):
+            # the arduino drops back by itself when no PING follows the switch
+            logger.warning(f"No PONG at {self.serial_baud} baud, going back to {old_baud}")
+            self.ser_connection.baudrate = old_baud
+            time.sleep(1.1)
+            self.ser_connection.reset_input_buffer()
+        else:
+            logger.debug(f"Serial link running binary frames at {self.serial_baud} baud")
+
+    def set_serial_protocol(self, protocol: str):
+        self.serial_protocol = protocol
+        # cached frames were encoded for the old protocol
+        self.frame_cache.clear()
+        self.pixel_hex_cache.clear()
+
+    def dispatch_line(self, data: str, arrived: float):
+        handler = self.line_handlers.get(data, None)
+        if handler is not None:
+            handler(arrived)
+
+    def handle_laser_hit(self, arrived: float):
+        self.publish_hit("laser_detector", arrived)
+
+    def handle_ball_hit(self, arrived: float):
+        self.publish_hit("ball_detector", arrived)
+
+    def publish_hit(self, detector: str, arrived: float):
+        msg = {"event_type": "hit"}
+        if self.trace_hits:
+            trace = tracing.new_trace(self.id)
+            tracing.stamp(trace, "serial_read", arrived)
+            msg["trace"] = tracing.stamp(trace, "adapter_publish")  # type: ignore
+        self.mqtt_client.publish(
+            self.topic(f"{self.id}/events/{detector}/"), msg
+        )
+        self.hit_latencies.append(time.monotonic() - arrived)
+        self.hits_published += 1
+        # flash the LED
+        self.flash_request.set()
 
     def run_state_exit(self, state, event):
+        self.run_state_stop = True
         if self.run_state_thread.is_alive():
-            self.run_stop = True
             self.run_state_thread.join()
+        logger.debug(f"LED writer: {self.led_writer_stats()}")
 
     def provision_state_enter(self, state, event):
         logger.debug("Entering PROVISION state!")
+        # the identification pattern goes out through the LED writer too
+        self.start_led_writer()
 
         ip_addr = self.get_ip()
         pattern = []
@@ -286,12 +460,53 @@ class ArduinoAdapter(object):
                 )
         # tell mqtt what the pattern is
         self.mqtt_client.publish(
-            f"field/discovery/", {"pattern": pattern, "ip_addr": ip_addr}
+            self.topic("field/discovery/"), {"pattern": pattern, "ip_addr": ip_addr}
         )
 
     def relay_commands(self, topic: str, msg: dict):
-        channel = msg.get("channel", None)
-        state = msg.get("state", None)
+        # either {"channel": c, "state": s} or a batch {"channels": {c: s, ...}}
+        channels = msg.get("channels", None)
+        if channels is None:
+            channels = {msg.get("channel", None): msg.get("state", None)}
+
+        closed = {}
+        for channel, state in channels.items():
+            relay = self.resolve_relay(channel)
+            if state == "on" and relay is not None:
+                closed[relay] = True
+            elif state == "off" and relay is not None:
+                closed[relay] = False
+        self.relays.set_relays(closed)
+
+        trace = msg.get("trace", None)
+        if trace is not None:
+            self.finish_trace(tracing.stamp(trace, "gpio_set"))
+
+    def clock_ping(self, topic: str, msg: dict):
+        # t1/t2 on our own timebase, the controller works out the offset
+        t1 = tracing.local_now()
+        self.mqtt_client.publish(
+            self.topic(f"{self.id}/clock/pong"),
+            {"seq": msg.get("seq", None), "t0": msg.get("t0", None), "t1": t1, "t2": tracing.local_now()},
+        )
+
+    def clock_offset(self, topic: str, msg: dict):
+        offset = msg.get("offset", None)
+        if offset is None:
+            return
+        self.clock_estimate = msg
+        if self.apply_clock_offset:
+            tracing.set_reference(float(offset))
+
+    def finish_trace(self, trace: dict):
+        self.trace_stats.record(trace)
+        # the controller keeps the histograms for every building
+        self.mqtt_client.publish(self.topic(f"{self.id}/metrics/trace"), trace)
+
+    def resolve_relay(self, channel) -> Union[int, None]:
+        # json object keys are always strings, so batched numeric channels show up as "4"
+        if isinstance(channel, str) and channel.isdigit():
+            channel = int(channel)
 
         relay = None
         if channel == "heater":
@@ -307,11 +522,7 @@ class ArduinoAdapter(object):
         elif isinstance(channel, int):
             if channel > 0 and channel <= len(self.relays.channels):
                 relay = channel
-
-        if state == "on" and relay is not None:
-            self.relays.close_relay(relay)
-        elif state == "off" and relay is not None:
-            self.relays.open_relay(relay)
+        return relay
 
     def generate_pixel_string(self, pixel_data):
         pixel_cmd = ""
@@ -328,27 +539,101 @@ class ArduinoAdapter(object):
                 pixel_cmd += "/" + pixel_str
         return pixel_cmd
 
+    def encode_pixels(self, pixel_data) -> bytes:
+        if self.serial_protocol == "binary":
+            return serial_protocol.pixels_frame(pixel_data)
+        return self.generate_pixel_string(pixel_data=pixel_data).encode("utf-8") + b"\n"
+
+    def decode_pixel_hex(self, pixel_hex: str) -> bytes:
+        pixel_cmd = self.pixel_hex_cache.get(pixel_hex)
+        if pixel_cmd is None:
+            # 6 hex chars per pixel, rrggbb
+            pixel_cmd = self.encode_pixels(led_frames.decode_hex(pixel_hex))
+            self.pixel_hex_cache.put(pixel_hex, pixel_cmd)
+        return pixel_cmd
+
     def led_commands(self, topic: str, msg: dict):
         if self.has_arduino:
+            pixel_cmd = None
             pixel_data = msg.get("pixel_data", None)
+            pixel_hex = msg.get("pixel_hex", None)
             if pixel_data is not None:
-                pixel_cmd = self.generate_pixel_string(pixel_data=pixel_data)
-
-                now = time.time()
-                # if the pixel data has changed OR we havent sent an update in a couple seconds
-                if (pixel_cmd != self.prev_pixel_cmd) or (
-                    now - self.last_pixel_write > 2
-                ):
-                    self.ser_lock.acquire()
-                    # logger.debug(pixel_cmd)
-                    self.ser_connection.write(pixel_cmd.encode("utf-8") + b"\n")
-                    self.ser_lock.release()
-
-                    # update the prev values
-                    self.prev_pixel_cmd = pixel_cmd
-                    self.last_pixel_write = now
+                pixel_cmd = self.encode_pixels(pixel_data)
+            elif pixel_hex is not None:
+                pixel_cmd = self.decode_pixel_hex(pixel_hex)
+            if pixel_cmd is not None:
+                self.write_pixel_cmd(pixel_cmd, msg.get("trace", None))
+
+    def fire_level_commands(self, topic: str, msg: dict):
+        # {"level": n, "initial": n}, rendered here with the controller's window split
+        level = msg.get("level", None)
+        initial = msg.get("initial", None)
+        if self.has_arduino and level is not None and initial is not None:
+            self.write_pixel_cmd(self.frame_cache.frame(int(level), int(initial)), msg.get("trace", None))
+
+    def write_pixel_cmd(self, pixel_cmd: bytes, trace: dict = None):  # type: ignore
+        # latest wins, a frame still sitting in the slot is stale now
+        with self.pixel_slot_lock:
+            if self.pixel_slot is not None:
+                self.frames_dropped += 1
+                # the newer frame shows that hit too, keep timing the oldest one
+                if self.pixel_slot[2] is not None:
+                    trace = self.pixel_slot[2]
+            self.pixel_slot = (pixel_cmd, time.monotonic(), trace)
+        self.pixel_ready.set()
+
+    def start_led_writer(self):
+        if not self.led_thread.is_alive():
+            self.led_thread.start()
+
+    def led_writer(self):
+        while True:
+            self.pixel_ready.wait()
+            with self.pixel_slot_lock:
+                self.pixel_ready.clear()
+                slot, self.pixel_slot = self.pixel_slot, None
+            if slot is None:
+                continue
+            pixel_cmd, posted, trace = slot
+
+            now = time.time()
+            # if the pixel data has changed OR this is the controller's safety refresh
+            if (pixel_cmd != self.prev_pixel_cmd) or (
+                now - self.last_pixel_write > self.led_resend_interval
+            ):
+                try:
+                    with self.ser_lock:
+                        self.ser_connection.write(pixel_cmd)
+                except Exception as e:
+                    logger.debug(f"There was an error when writing LED data to the serial port: {e}")
+                    continue
+
+                # update the prev values
+                self.prev_pixel_cmd = pixel_cmd
+                self.last_pixel_write = now
+                self.frames_written += 1
+                self.write_latencies.append(time.monotonic() - posted)
+                if trace is not None:
+                    self.finish_trace(tracing.stamp(trace, "serial_write"))
+            elif trace is not None:
+                # the arduino already shows this frame, the hit is on screen as is
+                self.finish_trace(tracing.stamp(trace, "serial_skip"))
+
+    def led_writer_stats(self) -> dict:
+        latencies = sorted(self.write_latencies)
+        stats = {"written": self.frames_written, "dropped": self.frames_dropped}
+        if latencies:
+            stats["latency_ms"] = {
+                "mean": round(1000 * sum(latencies) / len(latencies), 3),
+                # ceiling rank, rounding down gives the median with few samples
+                "p99": round(1000 * latencies[min(len(latencies) - 1, math.ceil(0.99 * len(latencies)) - 1)], 3),
+                "max": round(1000 * latencies[-1], 3),
+            }
+        return stats
 
     def get_ip(self):
+        if ni is None:
+            return None
         interfaces = ni.interfaces()
         if self.interface in interfaces:
             ip = ni.ifaddresses(self.interface)[ni.AF_INET][0]["addr"]
@@ -356,10 +641,17 @@ class ArduinoAdapter(object):
         else:
             return None
 
-    def flash_led(self):
-        self.relays.close_relay(self.light_channel)
-        time.sleep(0.1)
-        self.relays.open_relay(self.light_channel)
+    def flash_worker(self):
+        while True:
+            self.flash_request.wait()
+            self.relays.close_relay(self.light_channel)
+            # keep the light on until 100 ms after the last hit
+            while True:
+                self.flash_request.clear()
+                time.sleep(0.1)
+                if not self.flash_request.is_set():
+                    break
+            self.relays.open_relay(self.light_channel)
 
     def publish_state(self):
         while True:
@@ -367,7 +659,7 @@ class ArduinoAdapter(object):
             if self.mqtt_client.is_connected() and self.id != "":
                 heater_state = self.relays.get_relay_state(self.heater_channel)
                 self.mqtt_client.publish(
-                    f"{self.id}/state/",
+                    self.topic(f"{self.id}/state/"),
                     {
                         "state": self.sm.state.name,  # type: ignore
                         "heater": "on" if heater_state == 1 else "off",
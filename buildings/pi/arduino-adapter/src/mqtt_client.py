@@ -1,5 +1,5 @@
 import paho.mqtt.client as mqtt
-from typing import Any, Union, List
+from typing import Any, Callable, Dict, Union, List
 from loguru import logger
 import json
 import re
@@ -7,6 +7,79 @@ import threading
 from colored import fore, back, style
 import traceback
 
+
+class TopicTrieNode(object):
+    __slots__ = ["children", "handlers"]
+
+    def __init__(self):
+        self.children: Dict[str, "TopicTrieNode"] = {}
+        self.handlers: List[Callable] = []
+
+
+class TopicTrie(object):
+    '''
+    Subscription index over topic levels. Filters are split on "/" once when
+    they're added, so matching a topic is a walk over its levels instead of a
+    regex per registered filter. Handles the MQTT "+" and "#" wildcards.
+    '''
+    def __init__(self, cache_size: int = 1024):
+        self.root = TopicTrieNode()
+        # topics repeat a lot (same buildings, same subsystems), so remember
+        # the handler list per concrete topic until the filters change.
+        # a cache_size of 0 turns this off
+        self.cache: Dict[str, List[Callable]] = {}
+        self.cache_size = cache_size
+
+    def add(self, topic_filter: str, handler: Callable):
+        node = self.root
+        for level in topic_filter.split("/"):
+            child = node.children.get(level, None)
+            if child is None:
+                child = TopicTrieNode()
+                node.children[level] = child
+            node = child
+        node.handlers.append(handler)
+        self.cache = {}
+
+    def match(self, topic: str) -> List[Callable]:
+        handlers = self.cache.get(topic, None)
+        if handlers is not None:
+            return handlers
+
+        handlers = []
+        levels = topic.split("/")
+        num_levels = len(levels)
+        # wildcards don't match topics starting with $ at the first level
+        system_topic = topic.startswith("$")
+
+        stack = [(self.root, 0)]
+        while stack:
+            node, index = stack.pop()
+            wildcard_ok = index > 0 or not system_topic
+
+            # "#" also matches the parent level, so check it before the end test
+            multi = node.children.get("#", None)
+            if multi is not None and wildcard_ok:
+                handlers.extend(multi.handlers)
+
+            if index == num_levels:
+                handlers.extend(node.handlers)
+                continue
+
+            child = node.children.get(levels[index], None)
+            if child is not None:
+                stack.append((child, index + 1))
+            single = node.children.get("+", None)
+            if single is not None and wildcard_ok:
+                stack.append((single, index + 1))
+
+        if self.cache_size > 0:
+            if len(self.cache) >= self.cache_size:
+                self.cache = {}
+            self.cache[topic] = handlers
+        return handlers
+
+
 class MQTTClient(object):
     def __init__(self, host="mqtt", port=1883):
         # mqtt
@@ -18,7 +91,9 @@ class MQTTClient(object):
         self.mqtt_client.on_connect = self.on_connect  # type:ignore
         self.mqtt_client.on_message = self.on_message
 
-        self.topic_map = {}
+        # topic filter -> handlers, used to (re)subscribe on connect
+        self.topic_map: Dict[str, List[Callable]] = {}
+        self.topic_trie = TopicTrie()
 
     def run(self):
         # allows for graceful shutdown of any child threads
@@ -30,9 +105,14 @@ class MQTTClient(object):
         mqtt_thread.start()
 
     def register_callback(self, topic, function):
-        if topic in self.topic_map.keys():
-            logger.warning(f"EP: *****WARNING***** a callback is already registered for topic: {topic}")
-        self.topic_map[topic] = function
+        handlers = self.topic_map.setdefault(topic, [])
+        if function in handlers:
+            logger.debug(f"MQTT: callback already registered for topic: {topic}")
+            return
+        if len(handlers) > 0:
+            logger.debug(f"MQTT: adding another callback for topic: {topic}")
+        handlers.append(function)
+        self.topic_trie.add(topic, function)
         if self.mqtt_client.is_connected():
             self.mqtt_client.subscribe(topic)
 
@@ -63,19 +143,14 @@ class MQTTClient(object):
             client.subscribe(topic=topic)
 
     def handle_message(self, topic: str, msg: dict):
-       #try the exact match way first
-        handler = self.topic_map.get(topic, None)
-        if handler is not None:
+        for handler in self.topic_trie.match(topic):
             handler(topic, msg)
-        else:
-            for map_topic, function in self.topic_map.items():
-                if self.is_topic_match(topic, map_topic):
-                    #we found a match!
-                    function(topic, msg)
 
     def is_topic_match(self, topic: str, subscribed_topic: str):
         '''
         thanks chatgpt
+
+        no longer used for routing, see TopicTrie
         '''
         # Escape special characters in the subscribed_topic
         escaped_subscribed_topic = re.escape(subscribed_topic)
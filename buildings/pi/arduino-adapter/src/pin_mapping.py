@@ -35,3 +35,16 @@ PIN_NAME = {
 }
 """Dictionary with GPIO pin names as keys and Linux pin number as values.
 """
+
+# Pins routed to a hardware PWM controller, as (pwmchip number, channel) under
+# /sys/class/pwm. Only fill these in for pins whose PWM function is enabled by
+# the device tree overlay on the board, e.g. "GPIOX_6": (0, 0). libregpio.PWM
+# falls back to software PWM for everything else.
+#
+# Empty on purpose: the stock Le Potato image enables no PWM overlay on the
+# header pins the buildings use, so no pin has hardware PWM and every
+# libregpio.PWM runs the software path.
+PWM_CHANNEL = {}
+"""Dictionary with GPIO pin names as keys and (pwmchip, channel) as values.
+Empty, no pin is mapped to hardware PWM.
+"""
@@ -0,0 +1,172 @@
+import struct
+from typing import List, Tuple, Union
+
+# Binary framed protocol between the adapter and the Arduino, the firmware side
+# lives in buildings/arduino/src/main.cpp (keep the two in step).
+#
+#   SYNC(0xA5) TYPE LEN PAYLOAD[LEN] CRC16_HI CRC16_LO
+#
+# CRC is CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF) over TYPE, LEN and the
+# payload. 0xA5 never shows up in the old ASCII traffic ("r,g,b/..." down,
+# "laser"/"ball" up), so the two can share the line and the firmware only
+# switches to frames once it has seen a valid one.
+#
+# A 30 pixel fire frame is 17 bytes here against 200-240 as ASCII.
+
+SYNC = 0xA5
+
+PIXELS = 0x01    # runs of [count, r, g, b]
+HIT = 0x02       # [kind, millis u32 little endian]
+SET_BAUD = 0x03  # [baud u32 little endian]
+ACK = 0x04       # echoes the payload of what it acknowledges
+PING = 0x05
+PONG = 0x06
+
+HIT_LASER = 1
+HIT_BALL = 2
+HIT_NAMES = {HIT_LASER: "laser", HIT_BALL: "ball"}
+
+MAX_PAYLOAD = 255
+MAX_RUN = 255
+
+
+def crc16(data: bytes, crc: int = 0xFFFF) -> int:
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return crc
+
+
+def encode_frame(frame_type: int, payload: bytes = b"") -> bytes:
+    if len(payload) > MAX_PAYLOAD:
+        raise Exception(f"payload too long: {len(payload)} bytes")
+    body = bytes([frame_type, len(payload)]) + payload
+    return bytes([SYNC]) + body + struct.pack(">H", crc16(body))
+
+
+def encode_pixels(pixel_data: List[List[int]]) -> bytes:
+    '''
+    run length encode [[r, g, b], ...] into a PIXELS payload
+    '''
+    payload = bytearray()
+    run_color = None
+    run_length = 0
+    for pixel in pixel_data:
+        color = (int(pixel[0]) & 0xFF, int(pixel[1]) & 0xFF, int(pixel[2]) & 0xFF)
+        if color == run_color and run_length < MAX_RUN:
+            run_length += 1
+            continue
+        if run_color is not None:
+            payload += bytes([run_length]) + bytes(run_color)
+        run_color = color
+        run_length = 1
+    if run_color is not None:
+        payload += bytes([run_length]) + bytes(run_color)
+    return bytes(payload)
+
+
+def decode_pixels(payload: bytes) -> List[List[int]]:
+    pixel_data = []
+    for i in range(0, len(payload) - 3, 4):
+        pixel_data += [[payload[i + 1], payload[i + 2], payload[i + 3]] for _ in range(payload[i])]
+    return pixel_data
+
+
+def pixels_frame(pixel_data: List[List[int]]) -> bytes:
+    return encode_frame(PIXELS, encode_pixels(pixel_data))
+
+
+def hit_frame(kind: int, millis: int = 0) -> bytes:
+    return encode_frame(HIT, struct.pack("<BI", kind, millis & 0xFFFFFFFF))
+
+
+def decode_hit(payload: bytes) -> Tuple[str, int]:
+    kind, millis = struct.unpack("<BI", payload[:5])
+    return HIT_NAMES.get(kind, "unknown"), millis
+
+
+def baud_payload(baud: int) -> bytes:
+    return struct.pack("<I", baud)
+
+
+def decode_baud(payload: bytes) -> int:
+    return struct.unpack("<I", payload[:4])[0]
+
+
+def baud_frame(baud: int) -> bytes:
+    return encode_frame(SET_BAUD, baud_payload(baud))
+
+
+class FrameDecoder(object):
+    '''
+    Incremental decoder for a byte stream carrying frames and plain text lines.
+    feed() returns what completed, as ("frame", type, payload) or ("line", text).
+    A bad CRC drops the frame and everything after it up to the next SYNC byte
+    or newline, so the rest of the corrupt frame never turns into a line. Lines
+    that aren't printable ASCII are dropped too.
+    '''
+    def __init__(self):
+        self.buffer = bytearray()
+        self.text = bytearray()
+        # set by a bad CRC, until the next SYNC or newline
+        self.skipping = False
+        self.crc_errors = 0
+        self.dropped_lines = 0
+        self.frames = 0
+
+    def feed(self, data: bytes) -> List[Tuple[Union[str, int, bytes], ...]]:
+        self.buffer += data
+        out: List[Tuple[Union[str, int, bytes], ...]] = []
+        while self.buffer:
+            if self.buffer[0] != SYNC:
+                # everything up to the next SYNC is text
+                end = self.buffer.find(SYNC)
+                chunk = self.buffer if end < 0 else self.buffer[:end]
+                if self.skipping:
+                    newline = chunk.find(b"\n")
+                    if newline >= 0:
+                        chunk = chunk[:newline + 1]
+                        self.skipping = False
+                    del self.buffer[:len(chunk)]
+                    continue
+                self.take_text(bytes(chunk), out)
+                del self.buffer[:len(chunk)]
+                continue
+            self.skipping = False
+            if len(self.buffer) < 3:
+                break
+            length = self.buffer[2]
+            total = 3 + length + 2
+            if len(self.buffer) < total:
+                break
+            body = bytes(self.buffer[1:3 + length])
+            (crc,) = struct.unpack(">H", self.buffer[3 + length:total])
+            if crc != crc16(body):
+                self.crc_errors += 1
+                # skip this SYNC and the corrupt bytes behind it
+                del self.buffer[:1]
+                self.skipping = True
+                continue
+            del self.buffer[:total]
+            self.frames += 1
+            out.append(("frame", body[0], body[2:]))
+        return out
+
+    def take_text(self, chunk: bytes, out: list):
+        self.text += chunk
+        while True:
+            end = self.text.find(b"\n")
+            if end < 0:
+                break
+            raw = bytes(self.text[:end])
+            del self.text[:end + 1]
+            if any((b < 0x20 and b not in b"\r\t") or b > 0x7E for b in raw):
+                self.dropped_lines += 1
+                continue
+            line = raw.decode("ascii").rstrip()
+            if line:
+                out.append(("line", line))
@@ -0,0 +1,76 @@
+import random
+import time
+from loguru import logger
+import match as match_model
+
+# fires a 50 hit burst spread over the six fire buildings at a phase 3 match,
+# once with every hit dispatched on its own and once with hits coalesced per
+# building. run with: python bench_hits.py
+
+BURST_SIZE = 50
+REPEAT = 20
+CONFIG = {"phase_1_duration": 600, "phase_2_duration": 600, "phase_3_duration": 600}
+
+
+def make_match(hit_window):
+    config = dict(CONFIG, hit_coalesce_window=hit_window)
+    match = match_model.MatchModel(["2", "6", "5"], ["1", "4", "3"], ["7", "8", "9"], config=config)
+    for event in ["new_match_event", "match_start_event", "phase_i_timeout_event", "phase_ii_timeout_event"]:
+        match.dispatch(event).result()
+    return match
+
+
+def reignite(match):
+    for building in match.fire_buildings.values():
+        building.reset()
+        building.ignite()
+    match.loop.call(lambda: None)
+
+
+def run_burst(match, burst, batched):
+    start = time.perf_counter()
+    for source in burst:
+        match.douse_fire(source)
+    if batched:
+        # don't count the coalescing window itself, only the work
+        match.flush_hits()
+    match.loop.call(lambda: None)
+    return time.perf_counter() - start
+
+
+def building_state(match):
+    return {
+        name: (b.sm.state.name, b.current_fire_level, b.partial_score)
+        for name, b in match.fire_buildings.items()
+    }
+
+
+def main():
+    # keep the per hit debug lines, they're part of the cost, but send them nowhere
+    logger.remove()
+    logger.add(lambda message: None, level="DEBUG")
+
+    random.seed(0)
+    sequential = make_match(0)
+    batched = make_match(0.01)
+    names = list(sequential.fire_buildings.keys())
+
+    results = {"sequential": [], "batched": []}
+    for _ in range(REPEAT):
+        burst = [random.choice(names) for _ in range(BURST_SIZE)]
+        reignite(sequential)
+        reignite(batched)
+        results["sequential"].append(run_burst(sequential, burst, False))
+        results["batched"].append(run_burst(batched, burst, True))
+        if building_state(sequential) != building_state(batched):
+            raise Exception(f"mismatch: {building_state(sequential)} vs {building_state(batched)}")
+
+    print(f"{BURST_SIZE} hits across {len(names)} buildings, best of {REPEAT}")
+    for name, times in results.items():
+        best = min(times)
+        print(f"{name:>11} {best * 1000:8.3f} ms  {BURST_SIZE / best:10.0f} hits/s")
+    print(f"    speedup {min(results['sequential']) / min(results['batched']):8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import random
+import timeit
+from mqtt_client import MQTTClient, TopicTrie
+
+# compares the old per-message regex matcher against the TopicTrie index for
+# a growing number of subscriptions. run with: python bench_topic_match.py
+
+SUBSCRIPTION_COUNTS = [10, 100, 1000]
+NUM_TOPICS = 2000
+REPEAT = 5
+
+
+def noop(topic, msg):
+    pass
+
+
+def make_filters(count):
+    # roughly the shape of what the field uses: a couple of wide wildcards plus
+    # lots of per building / per subsystem filters
+    filters = ["+/events/#", "ui/events/#"]
+    i = 0
+    while len(filters) < count:
+        building = str(i)
+        filters.append(f"{building}/relay/set")
+        filters.append(f"{building}/progress_bar/set")
+        filters.append(f"{building}/+/laser_detector/#")
+        filters.append(f"court{i % 4}/{building}/events/#")
+        i += 1
+    return filters[:count]
+
+
+def make_topics(count, num_buildings):
+    subsystems = ["laser_detector", "ball_detector", "relay", "led_bar"]
+    topics = []
+    for _ in range(count):
+        building = str(random.randint(0, num_buildings))
+        kind = random.random()
+        if kind < 0.6:
+            topics.append(f"{building}/events/{random.choice(subsystems)}/")
+        elif kind < 0.8:
+            topics.append(f"{building}/relay/set")
+        else:
+            topics.append(f"ui/state/{building}")
+    return topics
+
+
+def legacy_handle(client, topic_map, topic):
+    # the handle_message that used to live in MQTTClient
+    handler = topic_map.get(topic, None)
+    if handler is not None:
+        handler(topic, None)
+    else:
+        for map_topic, function in topic_map.items():
+            if client.is_topic_match(topic, map_topic):
+                function(topic, None)
+
+
+def trie_handle(trie, topic):
+    for handler in trie.match(topic):
+        handler(topic, None)
+
+
+def main():
+    random.seed(0)
+    client = MQTTClient()
+
+    print(f"{'subs':>6} {'regex us/msg':>14} {'trie us/msg':>13} {'cached us/msg':>15} {'speedup':>9}")
+    for count in SUBSCRIPTION_COUNTS:
+        filters = make_filters(count)
+        topics = make_topics(NUM_TOPICS, count // 4)
+
+        topic_map = {}
+        trie = TopicTrie(cache_size=0)
+        cached_trie = TopicTrie()
+        for topic_filter in filters:
+            topic_map[topic_filter] = noop
+            trie.add(topic_filter, noop)
+            cached_trie.add(topic_filter, noop)
+
+        # sanity check that both agree before timing anything
+        for topic in topics[:200]:
+            expected = sum(1 for f in filters if client.is_topic_match(topic, f))
+            if topic in topic_map:
+                expected = 1
+            found = len(trie.match(topic))
+            if topic not in topic_map and found != expected:
+                raise Exception(f"mismatch on {topic}: regex {expected} trie {found}")
+
+        # the regex path is slow enough at 1000 subs that a smaller sample will do
+        sample = topics if count < 1000 else topics[:200]
+        regex_time = min(timeit.repeat(
+            lambda: [legacy_handle(client, topic_map, t) for t in sample], number=1, repeat=REPEAT
+        )) / len(sample)
+
+        trie_time = min(timeit.repeat(
+            lambda: [trie_handle(trie, t) for t in topics], number=1, repeat=REPEAT
+        )) / len(topics)
+        cached_time = min(timeit.repeat(
+            lambda: [trie_handle(cached_trie, t) for t in topics], number=1, repeat=REPEAT
+        )) / len(topics)
+
+        print(
+            f"{count:>6} {regex_time * 1e6:>14.2f} {trie_time * 1e6:>13.2f} "
+            f"{cached_time * 1e6:>15.2f} {regex_time / trie_time:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
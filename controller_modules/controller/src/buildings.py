@@ -1,13 +1,20 @@
 from pysm import State, StateMachine, Event
 from loguru import logger
-from threading import Lock, Thread
-import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, List
 import timer
+import tracing
+import scheduler as sched
+import event_loop
 
 
 class FireBuildingModel(object):
-    def __init__(self, name: str, initial_fire_level=16, points_per_window = 4, b_type="unknown"):
+    def __init__(self, name: str, initial_fire_level=16, points_per_window = 4, b_type="unknown", scheduler: sched.Scheduler = None, loop: event_loop.EventLoop = None):  # type: ignore
         self.name = name
+        self.scheduler = scheduler if scheduler is not None else sched.get_scheduler()
+        # normally the match's loop, so match and buildings share one thread
+        self.loop = loop if loop is not None else event_loop.EventLoop(name, inline=self.scheduler.clock.virtual)
         self.fire_douse_amount = 1
         self.initial_fire_level = initial_fire_level
         self.current_fire_level = 0
@@ -15,10 +22,14 @@ class FireBuildingModel(object):
         self.partial_score = 0
         self.points_per_window = points_per_window
         self.b_type: str = b_type
+        # latency traces of hits that landed, waiting for the controller to
+        # publish the LED/relay change they caused
+        self.traces: deque = deque(maxlen=100)
 
-        #################### S T A T E  M A C H I N E   S T U F F ####################
-        self.sm_lock = Lock()
+        # called as listener(building_name, kind) whenever something visible changes
+        self.listeners: List[Callable] = []
 
+        #################### S T A T E  M A C H I N E   S T U F F ####################
         self.sm = StateMachine("building")
 
         self.idle_state = State("idle_state")
@@ -59,9 +70,13 @@ class FireBuildingModel(object):
 
         self.sm.initialize()
 
-    def dispatch(self, event):
-        self.sm_lock.acquire()
+    def dispatch(self, event) -> Future:
+        return self.loop.post(self.process_event, event)
+
+    def process_event(self, event):
         prev_state = self.sm.state.name  # type: ignore
+        prev_fire_level = self.current_fire_level
+        prev_partial_score = self.partial_score
         if isinstance(event, str):
             event = Event(event)
         self.sm.dispatch(event)
@@ -71,7 +86,20 @@ class FireBuildingModel(object):
             logger.debug(
                 f"BUILDING {self.name}: State changed to {new_state} from {prev_state} on {event.name}"
             )
-        self.sm_lock.release()
+
+        if new_state != prev_state:
+            self.notify("building_state")
+        if self.current_fire_level != prev_fire_level:
+            self.notify("fire_level")
+        if self.partial_score != prev_partial_score:
+            self.notify("score")
+
+    def add_listener(self, listener: Callable):
+        self.listeners.append(listener)
+
+    def notify(self, kind: str):
+        for listener in self.listeners:
+            listener(self.name, kind)
 
     def idle_enter(self, state, event):
         self.partial_score = 0
@@ -82,34 +110,43 @@ class FireBuildingModel(object):
         # logger.debug(f"BUILDING {self.name}: Catching fire!!!!")
 
     def timer(self, timeout, event):
-        time.sleep(timeout)
         # logger.debug("dispatching timeout event")
-        self.dispatch(Event(event))
+        self.scheduler.call_later(timeout, self.dispatch, Event(event))
 
     def extinguished_enter(self, state, event):
         if self.auto_ignite:
-            thread = Thread(target=self.timer, args=(1, "ignition_event"))
-            thread.start()
+            self.timer(1, "ignition_event")
 
     def fire_doused_action(self, state, event):
-        if (
-            self.sm.state == self.on_fire_state
-            and self.current_fire_level >= self.fire_douse_amount
-        ):
-            self.current_fire_level -= self.fire_douse_amount
-            self.partial_score += self.fire_douse_amount
+        # a batch of hits lands exactly like that many single hits would:
+        # each one needs a full douse amount left, and the fire going out ends it
+        count = event.cargo.get("count", 1)
+        if self.sm.state == self.on_fire_state and self.fire_douse_amount > 0:
+            hits = min(count, self.current_fire_level // self.fire_douse_amount)
+            if hits <= 0:
+                return
+            for trace in event.cargo.get("traces", []):
+                self.traces.append(tracing.stamp(trace, "douse_action"))
+            self.current_fire_level -= hits * self.fire_douse_amount
+            self.partial_score += hits * self.fire_douse_amount
             logger.debug(
-                f"BUILDING {self.name}: dousing fire! New partial score: {self.partial_score} New fire level: {self.current_fire_level}"
+                f"BUILDING {self.name}: dousing fire x{hits}! New partial score: {self.partial_score} New fire level: {self.current_fire_level}"
             )
             if self.current_fire_level <= 0:
                 self.sm.dispatch(Event("fire_extinguished_event"))
 
     ##############################################################################
 
-    def douse_fire(self):
-        logger.debug("Got a doused event, dispatching now")
+    def douse_fire(self, count=1, traces: List[dict] = None):  # type: ignore
+        logger.debug(f"Got {count} doused event(s), dispatching now")
+
+        self.dispatch(Event("fire_doused_event", count=count, traces=traces if traces is not None else []))
 
-        self.dispatch(Event("fire_doused_event"))
+    def take_traces(self) -> List[dict]:
+        traces = []
+        while self.traces:
+            traces.append(self.traces.popleft())
+        return traces
 
     def ignite(self):
         self.dispatch(Event("ignition_event"))
@@ -131,14 +168,17 @@ class FireBuildingModel(object):
 
 
 class HeaterBuildingModel(object):
-    def __init__(self, name: str):
+    def __init__(self, name: str, scheduler: sched.Scheduler = None, loop: event_loop.EventLoop = None):  # type: ignore
         self.name = name
-        self.heater_timer = timer.Timer()
+        scheduler = scheduler if scheduler is not None else sched.get_scheduler()
+        self.heater_timer = timer.Timer(scheduler)
+        self.loop = loop if loop is not None else event_loop.EventLoop(name, inline=scheduler.clock.virtual)
         self.on_fire_duration = 120
 
-        #################### S T A T E  M A C H I N E   S T U F F ####################
-        self.sm_lock = Lock()
+        # called as listener(building_name, kind) whenever something visible changes
+        self.listeners: List[Callable] = []
 
+        #################### S T A T E  M A C H I N E   S T U F F ####################
         self.sm = StateMachine("heater_building")
 
         self.idle_state = State("idle_state")
@@ -162,8 +202,10 @@ class HeaterBuildingModel(object):
 
         self.sm.initialize()
 
-    def dispatch(self, event):
-        self.sm_lock.acquire()
+    def dispatch(self, event) -> Future:
+        return self.loop.post(self.process_event, event)
+
+    def process_event(self, event):
         prev_state = self.sm.state.name  # type: ignore
         if isinstance(event, str):
             event = Event(event)
@@ -174,7 +216,16 @@ class HeaterBuildingModel(object):
             logger.debug(
                 f"BUILDING {self.name}: State changed to {new_state} from {prev_state} on {event.name}"
             )
-        self.sm_lock.release()
+
+        if new_state != prev_state:
+            self.notify("heater_state")
+
+    def add_listener(self, listener: Callable):
+        self.listeners.append(listener)
+
+    def notify(self, kind: str):
+        for listener in self.listeners:
+            listener(self.name, kind)
 
     def on_fire_enter(self, state, event):
         logger.debug("starting heater timer thread!")
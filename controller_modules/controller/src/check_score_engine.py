@@ -0,0 +1,206 @@
+import argparse
+import random
+from loguru import logger
+import clock as clk
+import match as match_model
+import scheduler as sched
+
+# Parity check for MatchModel's incremental score engine. Drives a phase 3
+# match on a virtual clock through a seeded random sequence of ui toggles,
+# building hits, resets and clock steps, and after each step compares
+# score_snapshot() (which only recalculates invalidated phases) against a full
+# recalculation with the calculate_phase_* reference calculators and against
+# the hand written calculators the rule table replaced. Raises on the first
+# mismatch:
+#
+#   python check_score_engine.py --steps 3000 --seed 0
+#
+# The old phase III returned a float (get_score divides by a float), the rule
+# table returns an int, so the comparison is by value.
+
+CONFIG = {"phase_1_duration": 10 ** 6, "phase_2_duration": 10 ** 6, "phase_3_duration": 10 ** 6, "hit_coalesce_window": 0}
+
+
+def baseline_phase_i(t: dict) -> int:
+    score = 0
+    if t["sphero_recon_autonomous"] > 0:
+        score += t["sphero_recon_autonomous"] * 2
+    if t["sphero_recon"] > 0:
+        score += t["sphero_recon"]
+
+    if t["rvr_recon_autonomous"] is True:
+        score += 5
+    elif t["rvr_recon"] is True:
+        score += 2
+
+    if t["tello_recon_autonomous"] is True:
+        score += 4
+    elif t["tello_recon"] is True:
+        score += 2
+
+    if t["tello_recon_autonomous"] is True:
+        if t["smoke_jumper_launch"]:
+            score += 3
+        if t["smoke_jumper_parachute"]:
+            score += 2
+        if t["smoke_jumper_landed_in"]:
+            score += 5
+        elif t["smoke_jumper_landed_on_touch"]:
+            score += 3
+    else:
+        if t["smoke_jumper_launch"]:
+            score += 1
+        if t["smoke_jumper_parachute"]:
+            score += 1
+        if t["smoke_jumper_landed_in"]:
+            score += 3
+        elif t["smoke_jumper_landed_on_touch"]:
+            score += 1
+
+    if t["avr_autonomous"] is True:
+        if t["avr_takeoff_recon"] is True:
+            score += 10
+        if t["avr_apriltag"] is True:
+            score += 3
+        if t["avr_landing"] is True:
+            score += 7
+    else:
+        if t["avr_takeoff_recon"] is True:
+            score += 2
+        if t["avr_apriltag"] is True:
+            score += 2
+        if t["avr_landing"] is True:
+            score += 1
+    return score
+
+
+def baseline_phase_ii(t: dict) -> int:
+    score = 0
+    if t["first_responders_loaded"] > 0:
+        score += t["first_responders_loaded"]
+    if t["avr_ided_hotspot_and_dropped_fr"] is True:
+        score += 5
+    if t["avr_flashed_led"] is True:
+        score += 5
+    if t["first_responders_unloaded"] > 0:
+        score += t["first_responders_unloaded"]
+    if t["stranded_launched_from_fire_escape"] > 0:
+        score += t["stranded_launched_from_fire_escape"]
+    if t["stranded_in_rvr"] > 0:
+        score += t["stranded_in_rvr"] * 2
+    if t["avr_delivered_first_responders"] > 0:
+        score += t["avr_delivered_first_responders"] * 2
+    if t["stranded_delivered_to_safe_zone"] > 0:
+        score += t["stranded_delivered_to_safe_zone"]
+    if t["tello_identified_safe_zone"] is True:
+        score += t["stranded_delivered_to_safe_zone"]
+    if t["rvr_handsfree_unloaded"] is True:
+        score += 5
+    return score
+
+
+def baseline_phase_iii(t: dict, fire_buildings) -> float:
+    score = 0
+    for building in fire_buildings:
+        score += building.get_score()
+    if t["buildings_autonomously_cleared"] > 0:
+        score += 4 * t["buildings_autonomously_cleared"]
+    if t["rvr_parked"] is True:
+        score += 3
+    if t["first_responders_parked"] > 0:
+        score += t["first_responders_parked"]
+    if t["tello_parked"] is True:
+        score += 3
+    if t["avr_parked"] is True:
+        score += 3
+    return score
+
+
+def make_match() -> match_model.MatchModel:
+    scheduler = sched.Scheduler(clk.VirtualClock())
+    match = match_model.MatchModel(["2", "6", "5"], ["1", "4", "3"], ["7", "8", "9"], scheduler=scheduler, config=dict(CONFIG))
+    for event in ["new_match_event", "match_start_event", "phase_i_timeout_event", "phase_ii_timeout_event"]:
+        match.dispatch(event).result()
+    return match
+
+
+def random_step(match: match_model.MatchModel, rng: random.Random) -> str:
+    roll = rng.random()
+    if roll < 0.6:
+        toggle = rng.choice([name for name in match.ui_toggles if name != "match_id"])
+        if isinstance(match.ui_toggles[toggle], bool):
+            payload = rng.choice([True, False])
+        else:
+            payload = rng.randint(0, 4)
+        match.handle_ui_toggles({"toggle": toggle, "payload": payload}).result()
+        return f"toggle {toggle}={payload}"
+    if roll < 0.9:
+        name = rng.choice(list(match.fire_buildings.keys()))
+        count = rng.randint(1, 3)
+        match.douse_fire(name, count).result()
+        return f"hit {name} x{count}"
+    if roll < 0.95:
+        seconds = rng.uniform(0.5, 6)
+        match.scheduler.advance(seconds)
+        return f"advance {seconds:.2f}s"
+    if roll < 0.98:
+        name = rng.choice(list(match.fire_buildings.keys()))
+        building = match.fire_buildings[name]
+        building.reset()
+        building.ignite()
+        match.loop.call(lambda: None)
+        return f"reignite {name}"
+    match.loop.call(match.reset_ui_toggles)
+    return "reset toggles"
+
+
+def check(steps: int, seed: int) -> int:
+    rng = random.Random(seed)
+    match = make_match()
+    compared = 0
+    history = []
+    for step in range(steps):
+        history.append(random_step(match, rng))
+        # skip some snapshots so several invalidations pile up between reads
+        if rng.random() < 0.3:
+            continue
+
+        snapshot = match.score_snapshot()
+        toggles = match.ui_toggles
+        buildings = list(match.fire_buildings.values())
+        reference = {
+            "phase_i": match.calculate_phase_i(),
+            "phase_ii": match.calculate_phase_ii(),
+            "phase_iii": match.calculate_phase_iii(),
+        }
+        baseline = {
+            "phase_i": baseline_phase_i(toggles),
+            "phase_ii": baseline_phase_ii(toggles),
+            "phase_iii": baseline_phase_iii(toggles, buildings),
+        }
+        reference["total"] = sum(reference.values())
+        baseline["total"] = sum(baseline.values())
+        for phase in ["phase_i", "phase_ii", "phase_iii", "total"]:
+            if not (snapshot[phase] == reference[phase] == baseline[phase]):
+                raise Exception(
+                    f"step {step} ({history[-1]}), {phase}: engine {snapshot[phase]}, "
+                    f"reference {reference[phase]}, baseline {baseline[phase]}\n"
+                    f"last steps: {history[-10:]}"
+                )
+        compared += 1
+    return compared
+
+
+def main():
+    parser = argparse.ArgumentParser(description="score engine parity check against the reference calculators")
+    parser.add_argument("--steps", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logger.remove()
+    compared = check(args.steps, args.seed)
+    print(f"{args.steps} random steps (seed {args.seed}), {compared} snapshots match the reference calculators")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import time
+
+
+class RealClock(object):
+    '''
+    Monotonic wall time, what everything runs on outside of tests/simulation.
+    '''
+    virtual = False
+
+    def now(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+
+class VirtualClock(object):
+    '''
+    A clock that only moves when told to. Paired with a Scheduler, calling
+    scheduler.advance(seconds) steps through every deadline in between in
+    order, so a whole match can run in milliseconds with the same sequence of
+    state transitions as in real time.
+    '''
+    virtual = True
+
+    def __init__(self, start: float = 0.0):
+        self.current = start
+
+    def now(self) -> float:
+        return self.current
+
+    def set(self, now: float):
+        # never goes backwards
+        if now > self.current:
+            self.current = now
+
+    def sleep(self, seconds: float):
+        self.set(self.current + seconds)
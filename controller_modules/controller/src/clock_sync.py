@@ -0,0 +1,131 @@
+import time
+from collections import deque
+from threading import Lock
+from typing import Any, Callable, Deque, Dict, List, Tuple
+from loguru import logger
+import tracing
+
+# NTP-style clock offset estimation over MQTT, with the controller as the
+# reference clock. Every interval the controller sends each building
+#
+#   {b}/clock/ping  {"seq": n, "t0": controller send time}
+#
+# and the adapter answers on {b}/clock/pong with t1 (ping received) and t2
+# (pong sent) on its own local timebase. With t3 the controller's receive time:
+#
+#   offset = ((t1 - t0) + (t2 - t3)) / 2      building clock minus controller clock
+#   rtt    = (t3 - t0) - (t2 - t1)
+#
+# A sample's error is at most rtt / 2, and the MQTT round trip sometimes sits
+# behind other traffic, so only the lowest-rtt sample of each filter window is
+# kept (NTP's clock filter). A least squares line through the kept samples
+# gives the offset and the drift. The estimate goes out on {b}/clock/offset for
+# the adapter to move its timestamps onto the controller's timebase, and all of
+# them on metrics/clock.
+
+
+class OffsetEstimator(object):
+    '''
+    min-rtt filtered offset and drift for one building
+    '''
+    def __init__(self, filter_size: int = 8, history: int = 32):
+        # raw (controller time, offset, rtt) samples, the filter picks from these
+        self.samples: Deque[Tuple[float, float, float]] = deque(maxlen=filter_size)
+        # the min-rtt pick after each sample, what offset and drift come from
+        self.filtered: Deque[Tuple[float, float, float]] = deque(maxlen=history)
+        self.count = 0
+
+    def add(self, t0: float, t1: float, t2: float, t3: float):
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        rtt = (t3 - t0) - (t2 - t1)
+        self.samples.append(((t0 + t3) / 2, offset, rtt))
+        self.count += 1
+        best = min(self.samples, key=lambda sample: sample[2])
+        if not self.filtered or self.filtered[-1] != best:
+            self.filtered.append(best)
+
+    def fit(self) -> Tuple[float, float, float]:
+        '''
+        (time, offset, drift): a least squares line through the filtered
+        samples, drift in seconds of offset gained per second. with too short
+        a span to tell drift from noise it's the latest pick and no drift
+        '''
+        points = list(self.filtered)
+        if len(points) < 3 or points[-1][0] - points[0][0] < 10:
+            t, offset, rtt = points[-1]
+            return t, offset, 0.0
+        t_mean = sum([p[0] for p in points]) / len(points)
+        o_mean = sum([p[1] for p in points]) / len(points)
+        var = sum([(p[0] - t_mean) ** 2 for p in points])
+        drift = sum([(p[0] - t_mean) * (p[1] - o_mean) for p in points]) / var
+        return t_mean, o_mean, drift
+
+    def estimate(self, at: float = None) -> Dict[str, Any]:  # type: ignore
+        if not self.filtered:
+            return {}
+        at = tracing.now() if at is None else at
+        t, offset, drift = self.fit()
+        rtt = self.filtered[-1][2]
+        return {
+            "offset": offset + drift * (at - t),
+            "drift_ppm": round(drift * 1e6, 3),
+            "rtt_ms": round(rtt * 1000, 3),
+            "samples": self.count,
+            "at": round(at, 6),
+        }
+
+
+class ClockSync(object):
+    def __init__(self, client: Any, topic: Callable[[str], str], buildings: List[str], interval: float = 2.0):
+        self.client = client
+        self.topic = topic
+        self.buildings = buildings
+        self.interval = interval
+        self.seq = 0
+        self.last_ping = 0.0
+        self.estimators: Dict[str, OffsetEstimator] = {}
+        self.lock = Lock()
+        self.client.register_callback(self.topic("+/clock/pong"), self.handle_pong)
+
+    def poll(self):
+        '''
+        ping every building if the interval is up, called from the publish loop
+        '''
+        now = time.monotonic()
+        if self.interval > 0 and now - self.last_ping >= self.interval:
+            self.last_ping = now
+            self.ping_all()
+
+    def ping_all(self):
+        self.seq += 1
+        for building in self.buildings:
+            self.client.publish(
+                self.topic(f"{building}/clock/ping"), {"seq": self.seq, "t0": tracing.now()}
+            )
+
+    def handle_pong(self, topic: str, msg: dict):
+        t3 = tracing.now()
+        building = topic[len(self.topic("")):].split("/")[0]
+        try:
+            t0, t1, t2 = float(msg["t0"]), float(msg["t1"]), float(msg["t2"])
+        except (KeyError, TypeError, ValueError):
+            logger.debug(f"Bad clock pong from {building}: {msg}")
+            return
+        with self.lock:
+            estimator = self.estimators.setdefault(building, OffsetEstimator())
+            estimator.add(t0, t1, t2, t3)
+            estimate = estimator.estimate(t3)
+        self.client.publish(self.topic(f"{building}/clock/offset"), estimate)
+
+    def estimates(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            return {building: e.estimate() for building, e in sorted(self.estimators.items())}
+
+    def to_controller_time(self, building: str, t: float) -> float:
+        '''
+        move a time from building's local timebase onto the controller's
+        '''
+        with self.lock:
+            estimator = self.estimators.get(building, None)
+            estimate = estimator.estimate(t) if estimator is not None else {}
+        return t - estimate.get("offset", 0.0)
@@ -1,32 +1,122 @@
+import clock_sync
+import json
+import led_frames
 import match
+import math
 import mqtt_client
+import os
+import state_publisher
 import time
+import tracing
+from threading import Event, Lock
+from typing import Any, Dict, Set, Tuple
 from loguru import logger
 
 
+def load_config(path="/configs/config.json") -> dict:
+    with open(path, "r") as file:
+        return json.load(file)
+
+
 def mapRange(value, inMin, inMax, outMin, outMax):
     return outMin + (((value - inMin) / (inMax - inMin)) * (outMax - outMin))
 
 
 class Controller(object):
-    def __init__(self):
+    def __init__(self, client: Any = None, config: dict = None, scheduler: Any = None):  # type: ignore
+        # client/config/scheduler default to the real thing, the simulator
+        # and the multi court host pass in their own
+        if config is None:
+            config = load_config()
+
+        self.ball_buildings = config.get("ball_buildings", ["2", "6", "5"])
+        self.laser_buildings = config.get("laser_buildings", ["1", "4", "3"])
 
-        self.ball_buildings = ["2", "6", "5"]
-        self.laser_buildings = ["1", "4", "3"]
+        self.heater_buildings = config.get("heater_buildings", ["7", "8", "9"])
 
-        self.heater_buildings = ["7", "8", "9"]
+        # every topic in and out is namespaced under this, e.g. "court2/" gives
+        # court2/5/events/ball_detector and court2/ui/state/score
+        self.topic_prefix = config.get("topic_prefix", "")
+        if self.topic_prefix != "" and not self.topic_prefix.endswith("/"):
+            self.topic_prefix += "/"
 
         # create an MQTT client
-        self.mqtt_client = mqtt_client.MQTTClient("mqtt", 1883)
-        self.mqtt_client.register_callback("+/events/#", self.handle_events)
+        if client is None:
+            client = mqtt_client.MQTTClient("mqtt", 1883)
+        self.mqtt_client = client
+        self.mqtt_client.register_callback(self.topic("+/events/#"), self.handle_events)
+        self.mqtt_client.register_callback(self.topic("+/metrics/trace"), self.handle_trace)
 
         # create a match
         self.match = match.MatchModel(
-            self.ball_buildings, self.laser_buildings, self.heater_buildings
+            self.ball_buildings, self.laser_buildings, self.heater_buildings,
+            scheduler=scheduler, config=config
+        )
+        self.running = False
+
+        # "topics" publishes one retained topic per value, "snapshot" publishes
+        # a single versioned snapshot plus patches, "both" does both
+        self.ui_state_mode = self.match.config.get("ui_state_mode", "topics")
+        state_refresh_interval = self.match.config.get("state_refresh_interval", 10)
+
+        # ui state only goes out when it changes, with a slow full refresh
+        self.state_publisher = state_publisher.StatePublisher(
+            self.mqtt_client, refresh_interval=state_refresh_interval
+        )
+        self.snapshot_publisher = state_publisher.SnapshotPublisher(
+            self.mqtt_client,
+            snapshot_topic=self.topic("ui/state/snapshot"),
+            patch_topic=self.topic("ui/state/patch"),
+            refresh_interval=state_refresh_interval,
+        )
+
+        # progress bar frames come pre-serialized from led_frames, "json" sends the
+        # pixel_data list every adapter understands, "hex" the compact pixel_hex
+        # string, "fire_level" just the level and lets the adapter render it
+        self.led_wire_format = self.match.config.get("led_wire_format", "json")
+
+        # last relay state sent per building and channel, only changes go out.
+        # with relay_batch they go as one relay/set {"channels": {...}} per building
+        self.relay_batch = self.match.config.get("relay_batch", False)
+        self.relay_states: Dict[str, Dict[str, str]] = {}
+        self.relay_lock = Lock()
+
+        # the match and buildings tell us what changed, the run loop publishes
+        # just those outputs. polling is only kept as a slow safety net
+        self.coalesce_window = self.match.config.get("coalesce_window", 0.02)
+        self.timer_interval = 0.5
+        self.safety_refresh_interval = self.match.config.get("safety_refresh_interval", 5)
+        self.changes: Set[Tuple[str, str]] = set()
+        self.changes_lock = Lock()
+        self.changed = Event()
+        self.match.add_listener(self.handle_change)
+
+        # hit -> LED/relay latency, from the traces the adapters send back when
+        # they finish one (see tracing.py). published on metrics/latency and
+        # dumped to latency_dump_dir when a match ends
+        self.trace_stats = tracing.TraceStats()
+        self.metrics_interval = self.match.config.get("metrics_interval", 10)
+        self.latency_dump_dir = self.match.config.get("latency_dump_dir", "/logs")
+
+        # per building clock offset and drift against this controller, so
+        # timestamps from different Pis can be compared (see clock_sync.py)
+        self.clock_sync = clock_sync.ClockSync(
+            self.mqtt_client, self.topic,
+            self.ball_buildings + self.laser_buildings + self.heater_buildings,
+            interval=self.match.config.get("clock_sync_interval", 2),
         )
 
+    def handle_change(self, source: str, kind: str):
+        # runs on whatever thread changed the model, so keep it cheap
+        with self.changes_lock:
+            self.changes.add((source, kind))
+        self.changed.set()
+
+    def topic(self, suffix: str) -> str:
+        return self.topic_prefix + suffix
+
     def handle_events(self, topic: str, msg: dict):
-        parts = topic.split("/")
+        parts = topic[len(self.topic_prefix):].split("/")
         source = parts[0]
         channel = parts[1]
         subsystem = parts[2]
@@ -38,7 +128,19 @@ class Controller(object):
             if subsystem in ["laser_detector", "ball_detector"]:
                 event_type = msg.get("event_type", None)
                 if event_type == "hit":
-                    self.match.douse_fire(source)
+                    trace = msg.get("trace", None)
+                    if trace is not None:
+                        if not trace.get("ref", True):
+                            # the adapter hasn't had its clock offset yet, convert its stamps here
+                            for entry in trace.get("stamps", []):
+                                entry[1] = self.clock_sync.to_controller_time(source, entry[1])
+                            trace["ref"] = source in self.clock_sync.estimators
+                        tracing.stamp(trace, "controller_receive")
+                    self.match.douse_fire(source, trace=trace)
+            elif subsystem == "connected":
+                # a (re)started adapter doesn't know its relay states yet
+                self.invalidate_relays(source)
+                self.handle_change(source, "relays")
 
         elif source == "ui":
             event_type = msg.get("event_type", None)
@@ -46,23 +148,51 @@ class Controller(object):
                 if event_type == "ui_toggle":
                     # logger.debug("got a toggle event")
                     self.match.handle_ui_toggles(msg.get("data"))
+                elif event_type == "state_resync":
+                    self.snapshot_publisher.request_resync()
                 else:
                     logger.debug("Got a normal event")
                     self.match.dispatch(event_type)
 
+    def handle_trace(self, topic: str, msg: dict):
+        self.trace_stats.record(msg)
+
+    def publish_latency_metrics(self):
+        self.mqtt_client.publish(self.topic("metrics/latency"), self.trace_stats.snapshot())
+
+    def publish_clock_metrics(self):
+        self.mqtt_client.publish(self.topic("metrics/clock"), self.clock_sync.estimates())
+
+    def dump_latency_metrics(self):
+        if self.trace_stats.traces == 0:
+            return
+        match_id = self.match.ui_toggles.get("match_id", "")
+        name = "".join([c for c in str(match_id) if c.isalnum() or c == "_"]) or time.strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(self.latency_dump_dir, f"latency_{name}.json")
+        try:
+            self.trace_stats.dump(path)
+        except OSError as e:
+            logger.debug(f"Couldn't write latency dump to {path}: {e}")
+        self.publish_latency_metrics()
+        logger.debug(f"Hit latency over {self.trace_stats.traces} traces:")
+        for line in self.trace_stats.summary():
+            logger.debug(line)
+        # the next match starts from empty histograms
+        self.trace_stats.reset()
+
+    def publish_ui_state(self, key: str, message):
+        if self.ui_state_mode in ["topics", "both"]:
+            self.state_publisher.publish(self.topic(f"ui/state/{key}"), message)
+        if self.ui_state_mode in ["snapshot", "both"]:
+            self.snapshot_publisher.update(key, message)
+
     def publish_score(self):
         # publish score
-        current_score = self.match.calculate_score()
-        self.mqtt_client.publish("ui/state/score", {"current_score": current_score})
-
-        phase_i = self.match.calculate_phase_i()
-        self.mqtt_client.publish("ui/state/phase_i_score", {"current_score": phase_i})
-
-        phase_ii = self.match.calculate_phase_ii()
-        self.mqtt_client.publish("ui/state/phase_ii_score", {"current_score": phase_ii})
-
-        phase_iii = self.match.calculate_phase_iii()
-        self.mqtt_client.publish("ui/state/phase_iii_score", {"current_score": phase_iii})
+        score = self.match.score_snapshot()
+        self.publish_ui_state("score", {"current_score": score["total"]})
+        self.publish_ui_state("phase_i_score", {"current_score": score["phase_i"]})
+        self.publish_ui_state("phase_ii_score", {"current_score": score["phase_ii"]})
+        self.publish_ui_state("phase_iii_score", {"current_score": score["phase_iii"]})
 
     def publish_building_table(self):
         table_data = []
@@ -86,12 +216,12 @@ class Controller(object):
             row_data["score"] = building.get_score()
             table_data.append(row_data)
 
-        self.mqtt_client.publish("ui/state/table_data", table_data)
+        self.publish_ui_state("table_data", table_data)
 
     def publish_toggles(self):
         for key, value in self.match.ui_toggles.items():
-            self.mqtt_client.publish(
-                f"ui/state/{key}",
+            self.publish_ui_state(
+                key,
                 {"data": value}
             )
 
@@ -110,140 +240,222 @@ class Controller(object):
             state = "Staging/Preheat"
         elif state == "post_match_state":
             state = "End Game"
-        self.mqtt_client.publish("ui/state/match_state", {"state": state})
+        self.publish_ui_state("match_state", {"state": state})
 
     def publish_timers(self):
-        # publish time remainings
+        # publish time remainings, rounded up so a fresh 10s timer shows 00:10
         time_left = time.strftime(
-            "%M:%S", time.gmtime(self.match.phase_timer.time_remaining)
+            "%M:%S", time.gmtime(math.ceil(self.match.phase_timer.time_remaining))
         )
-        self.mqtt_client.publish("ui/state/phase_remaining", {"time": time_left})
+        self.publish_ui_state("phase_remaining", {"time": time_left})
 
         time_left = time.strftime(
-            "%M:%S", time.gmtime(self.match.match_timer.time_remaining)
+            "%M:%S", time.gmtime(math.ceil(self.match.match_timer.time_remaining))
         )
-        self.mqtt_client.publish("ui/state/match_remaining", {"time": time_left})
+        self.publish_ui_state("match_remaining", {"time": time_left})
 
         time_left = 0
         for building_name, building in self.match.heater_buildings.items():
             if building.sm.state.name == "on_fire_state":
-                time_left = building.heater_timer.time_remaining
+                time_left = math.ceil(building.heater_timer.time_remaining)
 
-        self.mqtt_client.publish("ui/state/heater_countdown", {"time": time_left})
+        self.publish_ui_state("heater_countdown", {"time": time_left})
 
     def publish_hotspot_building(self):
         # publish the hot spot building
-        self.mqtt_client.publish(
-            "ui/state/hotspot_building",
+        self.publish_ui_state(
+            "hotspot_building",
             {"building": self.match.random_hotspot_building},
         )
 
     def publish_safezone(self):
         # publish the hot spot building
-        self.mqtt_client.publish(
-            "ui/state/safezone",
+        self.publish_ui_state(
+            "safezone",
             {"zone": self.match.safezone},
         )
 
     def generate_LED_dict(self, building):
-        strip_len = 30
-        data = {}
-        data["pixel_data"] = []
-        for i in range(0, strip_len):
-            data["pixel_data"].append([0, 0, 0])
-
-        fire_level = building.current_fire_level
-        init = building.initial_fire_level
-        pixels_per_fs = 2 if init <= 8 else 1
-
-        if fire_level > (init // 2):
-            left = (init // 2) * pixels_per_fs
-            right = (fire_level - (init // 2)) * pixels_per_fs
-        elif fire_level <= (init // 2):
-            left = fire_level * pixels_per_fs
-            right = 0
-        else:
-            left = 0
-            right = 0
-
-        # do the first window's portion of the led strip
-        if left > 0:
-            for i in range(0, left):
-                data["pixel_data"][i] = [0, 0, 255]
-        # do the second window's portion of the led strip
-        if right > 0:
-            for i in range(strip_len - 1, strip_len - 1 - right, -1):
-                data["pixel_data"][i] = [0, 0, 255]
-
-        return data
+        return {"pixel_data": led_frames.render_frame(building.current_fire_level, building.initial_fire_level)}
 
     def publish_building_LED_commands(self):
         for building_name, building in self.match.fire_buildings.items():
+            self.publish_building_LED_command(building_name, building)
+
+    def publish_building_LED_command(self, building_name, building):
+        # hits waiting on this change. one trace rides along to the adapter,
+        # the rest of a coalesced batch ends here
+        trace = None
+        traces = building.take_traces()
+        if traces:
+            trace = traces[0]
+            for other in traces[1:]:
+                self.trace_stats.record(tracing.stamp(other, "led_publish"))
+
+        frames = led_frames.frame_table(building.initial_fire_level, self.led_wire_format)
+        payload = frames.payload(building.current_fire_level)
+        if trace is not None:
+            payload = tracing.attach(payload, tracing.branch(trace, "led_publish"))
+        self.mqtt_client.publish_raw(
+            self.topic(f"{building_name}/{led_frames.LED_TOPICS[self.led_wire_format]}"),
+            payload,
+        )
 
-            data = self.generate_LED_dict(building=building)
-            self.mqtt_client.publish(f"{building_name}/progress_bar/set", data)
-
-            # handle window portion
-            if building.current_fire_level > (building.initial_fire_level / 2):
-                self.mqtt_client.publish(
-                    f"{building_name}/relay/set", {"channel": "window1", "state": "on"}
-                )
-                self.mqtt_client.publish(
-                    f"{building_name}/relay/set", {"channel": "window2", "state": "on"}
-                )
-            elif building.current_fire_level > 0:
-                self.mqtt_client.publish(
-                    f"{building_name}/relay/set", {"channel": "window1", "state": "on"}
-                )
-                self.mqtt_client.publish(
-                    f"{building_name}/relay/set", {"channel": "window2", "state": "off"}
-                )
-            else:
-                self.mqtt_client.publish(
-                    f"{building_name}/relay/set", {"channel": "window1", "state": "off"}
-                )
-                self.mqtt_client.publish(
-                    f"{building_name}/relay/set", {"channel": "window2", "state": "off"}
-                )
-
-            # handle the hopper portion
-            relay_channel = "hopper"
-
-            state = "on" if self.match.sm.state.name in ["phase_1_state","phase_2_state","phase_3_state","post_match_state"] else "off"
-            self.mqtt_client.publish(
-                f"{building_name}/relay/set", {"channel": relay_channel, "state": state}
-            )
+        relays = {}
+        # handle window portion
+        if building.current_fire_level > (building.initial_fire_level / 2):
+            relays["window1"] = "on"
+            relays["window2"] = "on"
+        elif building.current_fire_level > 0:
+            relays["window1"] = "on"
+            relays["window2"] = "off"
+        else:
+            relays["window1"] = "off"
+            relays["window2"] = "off"
+
+        # handle the hopper portion
+        state = "on" if self.match.sm.state.name in ["phase_1_state","phase_2_state","phase_3_state","post_match_state"] else "off"
+        relays["hopper"] = state
+
+        self.publish_relays(building_name, relays, trace)
 
     def publish_building_heater_commands(self):
-        relay_channel = "heater"
         for building_name, building in self.match.heater_buildings.items():
-            state = "off"
-            if building.sm.state.name == "on_fire_state":
-                state = "on"
-            self.mqtt_client.publish(
-                f"{building_name}/relay/set", {"channel": relay_channel, "state": state}
-            )
+            self.publish_building_heater_command(building_name, building)
+
+    def publish_building_heater_command(self, building_name, building):
+        relay_channel = "heater"
+        state = "off"
+        if building.sm.state.name == "on_fire_state":
+            state = "on"
+        self.publish_relays(building_name, {relay_channel: state})
+
+    def publish_relays(self, building_name: str, relays: Dict[str, str], trace: dict = None):  # type: ignore
+        with self.relay_lock:
+            last = self.relay_states.setdefault(building_name, {})
+            changed = {channel: state for channel, state in relays.items() if last.get(channel) != state}
+            last.update(changed)
+        if not changed:
+            return
+
+        topic = self.topic(f"{building_name}/relay/set")
+        messages = []
+        if self.relay_batch:
+            messages.append({"channels": changed})
+        else:
+            for channel, state in changed.items():
+                messages.append({"channel": channel, "state": state})
+        if trace is not None:
+            messages[0]["trace"] = tracing.branch(trace, "relay_publish")
+        for message in messages:
+            self.mqtt_client.publish(topic, message)
+
+    def invalidate_relays(self, building_name: str = None):  # type: ignore
+        '''
+        forget what was sent so the next publish resends every channel
+        '''
+        with self.relay_lock:
+            if building_name is None:
+                self.relay_states.clear()
+            else:
+                self.relay_states.pop(building_name, None)
+
+    def publish_all(self):
+        # publish UI data
+        self.publish_score()
+        self.publish_game_state()
+        self.publish_hotspot_building()
+        self.publish_safezone()
+        self.publish_timers()
+        self.publish_building_table()
+        self.publish_toggles()
+        # publish building commands
+        self.publish_building_LED_commands()
+        self.publish_building_heater_commands()
+
+    def publish_changes(self, changes: Set[Tuple[str, str]]):
+        kinds = set([kind for source, kind in changes])
+
+        if "match_state" in kinds:
+            # phase changes touch nearly everything (hopper relays, timers, scores)
+            self.publish_all()
+            if self.match.sm.state.name == "post_match_state":  # type: ignore
+                self.dump_latency_metrics()
+            return
+
+        if "toggles" in kinds:
+            self.publish_toggles()
+        if "hotspot" in kinds:
+            self.publish_hotspot_building()
+        if "safezone" in kinds:
+            self.publish_safezone()
+        if kinds & set(["toggles", "score"]):
+            self.publish_score()
+        if kinds & set(["fire_level", "building_state", "score"]):
+            self.publish_building_table()
+        if "heater_state" in kinds:
+            self.publish_timers()
+
+        for source, kind in changes:
+            if kind in ["fire_level", "building_state", "relays"] and source in self.match.fire_buildings:
+                self.publish_building_LED_command(source, self.match.fire_buildings[source])
+            if kind in ["heater_state", "relays"] and source in self.match.heater_buildings:
+                self.publish_building_heater_command(source, self.match.heater_buildings[source])
+
+    def stop(self):
+        self.running = False
+        self.changed.set()
 
     def run(self):
         self.mqtt_client.start_threaded()
-        last_update_time = time.time()
-        while True:
-            if time.time() - last_update_time > .5:
-                # publish UI data
-                self.publish_score()
-                self.publish_game_state()
-                self.publish_hotspot_building()
-                self.publish_safezone()
+        self.publish_loop()
+
+    def publish_loop(self):
+        self.running = True
+        last_timer_time = 0.0
+        last_refresh_time = 0.0
+        last_metrics_time = time.time()
+        while self.running:
+            # sleep until something changes or the timers need a redraw
+            wait_time = max(0, self.timer_interval - (time.time() - last_timer_time))
+            if self.changed.wait(timeout=wait_time):
+                # give a burst of hits a moment to land so they go out together
+                time.sleep(self.coalesce_window)
+                self.changed.clear()
+                with self.changes_lock:
+                    changes = self.changes
+                    self.changes = set()
+                self.publish_changes(changes)
+
+            now = time.time()
+            if now - last_refresh_time > self.safety_refresh_interval:
+                # resend relays too, in case a command got lost
+                self.invalidate_relays()
+                self.publish_all()
+                last_refresh_time = now
+                last_timer_time = now
+            elif now - last_timer_time > self.timer_interval:
                 self.publish_timers()
-                self.publish_building_table()
-                # publish building commands
-                self.publish_building_LED_commands()
-                self.publish_building_heater_commands()
-                last_update_time = time.time()
-            self.publish_toggles()
-            time.sleep(0.1)
+                last_timer_time = now
+
+            if self.metrics_interval > 0 and now - last_metrics_time > self.metrics_interval:
+                if self.trace_stats.traces > 0:
+                    self.publish_latency_metrics()
+                if self.clock_sync.estimators:
+                    self.publish_clock_metrics()
+                last_metrics_time = now
+            self.clock_sync.poll()
+
+            self.state_publisher.refresh_if_due()
+            if self.ui_state_mode in ["snapshot", "both"]:
+                self.snapshot_publisher.flush()
 
 
 if __name__ == "__main__":
-    controller = Controller()
-    controller.run()
+    config = load_config()
+    if "courts" in config:
+        import multi_court
+        multi_court.MultiCourtController(config).run()
+    else:
+        controller = Controller(config=config)
+        controller.run()
@@ -0,0 +1,79 @@
+import time
+import traceback
+from concurrent.futures import Future
+from queue import Queue
+from threading import RLock, Thread, get_ident
+from typing import Any, Callable, List
+from loguru import logger
+
+
+class EventLoop(object):
+    '''
+    A mailbox with one worker thread. Everything that touches a match or its
+    buildings is posted here and runs in order on that one thread, so the
+    state machines need no locks and the MQTT network thread never waits on
+    them. post() returns a Future for callers that care about the result.
+
+    With inline=True there is no worker: post() runs the call right away on
+    the calling thread (serialized by a lock). That's what the virtual clock
+    uses so a simulated match stays deterministic.
+    '''
+    def __init__(self, name: str = "loop", inline: bool = False):
+        self.name = name
+        self.inline = inline
+        self.inline_lock = RLock()
+
+        self.mailbox: Queue = Queue()
+        self.thread_id: Any = None
+
+        self.processed = 0
+        self.max_depth = 0
+        # set record_waits to collect how long each call sat in the mailbox
+        self.record_waits = False
+        self.waits: List[float] = []
+
+        if not self.inline:
+            thread = Thread(target=self.run, args=(), daemon=True, name=f"{name}-loop")
+            thread.start()
+
+    def in_loop(self) -> bool:
+        return get_ident() == self.thread_id
+
+    def post(self, function: Callable, *args: Any) -> Future:
+        future: Future = Future()
+        if self.inline:
+            with self.inline_lock:
+                self.execute(function, args, future)
+        elif self.in_loop():
+            # already on the worker (a handler dispatching into a building, say),
+            # run it now like the nested call it is
+            self.execute(function, args, future)
+        else:
+            self.mailbox.put((function, args, future, time.perf_counter()))
+            depth = self.mailbox.qsize()
+            if depth > self.max_depth:
+                self.max_depth = depth
+        return future
+
+    def call(self, function: Callable, *args: Any, timeout: float = None) -> Any:  # type: ignore
+        '''
+        post and wait for the result
+        '''
+        return self.post(function, *args).result(timeout=timeout)
+
+    def execute(self, function: Callable, args: tuple, future: Future):
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            logger.debug(f"LOOP {self.name}: error running {function}")
+            logger.debug(traceback.format_exc())
+            future.set_exception(e)
+        self.processed += 1
+
+    def run(self):
+        self.thread_id = get_ident()
+        while True:
+            function, args, future, posted_at = self.mailbox.get()
+            if self.record_waits:
+                self.waits.append(time.perf_counter() - posted_at)
+            self.execute(function, args, future)
@@ -0,0 +1,99 @@
+import json
+from functools import lru_cache
+from typing import Dict, List
+
+# A fire building's LED strip only ever shows one frame per
+# (initial_fire_level, current_fire_level) pair, so every frame is rendered and
+# serialized once per building type and an update is just a dict lookup.
+#
+# wire formats:
+#   "json"       - progress_bar/set {"pixel_data": [[r, g, b], ...]}, what the
+#                  adapter always took
+#   "hex"        - progress_bar/set {"pixel_hex": "rrggbbrrggbb..."}, 6 hex
+#                  chars per pixel
+#   "fire_level" - fire_level/set {"level": n, "initial": n}, the adapter
+#                  renders the frame itself (its led_frames.py has the same
+#                  render_frame, the adapter's fake_arduino.py self-check
+#                  fails if they drift apart)
+
+STRIP_LEN = 30
+FIRE_COLOR = [0, 0, 255]
+WIRE_FORMATS = ["json", "hex", "fire_level"]
+# topic suffix under {building}/ for each format
+LED_TOPICS = {"json": "progress_bar/set", "hex": "progress_bar/set", "fire_level": "fire_level/set"}
+
+
+def render_frame(fire_level: int, initial_fire_level: int, strip_len: int = STRIP_LEN) -> List[List[int]]:
+    frame = [[0, 0, 0] for _ in range(strip_len)]
+
+    init = initial_fire_level
+    pixels_per_fs = 2 if init <= 8 else 1
+
+    if fire_level > (init // 2):
+        left = (init // 2) * pixels_per_fs
+        right = (fire_level - (init // 2)) * pixels_per_fs
+    elif fire_level <= (init // 2):
+        left = fire_level * pixels_per_fs
+        right = 0
+    else:
+        left = 0
+        right = 0
+
+    # do the first window's portion of the led strip
+    if left > 0:
+        for i in range(0, left):
+            frame[i] = list(FIRE_COLOR)
+    # do the second window's portion of the led strip
+    if right > 0:
+        for i in range(strip_len - 1, strip_len - 1 - right, -1):
+            frame[i] = list(FIRE_COLOR)
+
+    return frame
+
+
+def encode_hex(frame: List[List[int]]) -> str:
+    return "".join([f"{r:02x}{g:02x}{b:02x}" for r, g, b in frame])
+
+
+def decode_hex(pixel_hex: str) -> List[List[int]]:
+    return [
+        [int(pixel_hex[i:i + 2], 16), int(pixel_hex[i + 2:i + 4], 16), int(pixel_hex[i + 4:i + 6], 16)]
+        for i in range(0, len(pixel_hex) - 5, 6)
+    ]
+
+
+def serialize(frame: List[List[int]], wire_format: str = "json") -> str:
+    if wire_format == "hex":
+        return json.dumps({"pixel_hex": encode_hex(frame)})
+    return json.dumps({"pixel_data": frame})
+
+
+class FrameTable(object):
+    '''
+    every frame for one initial fire level, already serialized for the wire
+    '''
+    def __init__(self, initial_fire_level: int, wire_format: str = "json"):
+        if wire_format not in WIRE_FORMATS:
+            raise Exception(f"unknown LED wire format {wire_format}")
+        self.initial_fire_level = initial_fire_level
+        self.wire_format = wire_format
+        self.payloads: Dict[int, str] = {}
+        for level in range(0, initial_fire_level + 1):
+            self.payloads[level] = self.render(level)
+
+    def render(self, fire_level: int) -> str:
+        if self.wire_format == "fire_level":
+            return json.dumps({"level": fire_level, "initial": self.initial_fire_level})
+        return serialize(render_frame(fire_level, self.initial_fire_level), self.wire_format)
+
+    def payload(self, fire_level: int) -> str:
+        payload = self.payloads.get(fire_level, None)
+        if payload is None:
+            # not a level the building can normally reach, render it anyway
+            payload = self.render(fire_level)
+        return payload
+
+
+@lru_cache(maxsize=None)
+def frame_table(initial_fire_level: int, wire_format: str = "json") -> FrameTable:
+    return FrameTable(initial_fire_level, wire_format)
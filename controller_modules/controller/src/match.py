@@ -1,9 +1,13 @@
 from pysm import State, StateMachine, Event
 import buildings
-from threading import Thread, Lock
-from typing import Dict, List, Union, Any
-import time
+from typing import Callable, Dict, List, Union, Any
+from concurrent.futures import Future
+from threading import Lock
 import timer
+import scheduler as sched
+import event_loop
+import score_engine
+import scoring_rules
 from loguru import logger
 import random
 import json
@@ -11,23 +15,50 @@ import re
 import copy
 
 
+def copy_result(source: Future, target: Future):
+    if source.exception() is not None:
+        target.set_exception(source.exception())  # type: ignore
+    else:
+        target.set_result(source.result())
+
+
 class MatchModel(object):
-    def __init__(self, ball_buildings: List[str], laser_buildings: List[str], heater_buildings: List[str]):
+    def __init__(self, ball_buildings: List[str], laser_buildings: List[str], heater_buildings: List[str], scheduler: sched.Scheduler = None, config: dict = None, loop: event_loop.EventLoop = None):  # type: ignore
 
         self.score = 0
 
+        # every timer in the match shares one scheduler thread
+        self.scheduler = scheduler if scheduler is not None else sched.get_scheduler()
+
+        # the match and all of its buildings run on one event loop, on virtual
+        # time everything runs inline so a simulated match stays deterministic
+        if loop is None:
+            loop = event_loop.EventLoop("match", inline=self.scheduler.clock.virtual)
+        self.loop = loop
+
         self.fire_buildings:Dict[str,buildings.FireBuildingModel] = {}
         for building in ball_buildings:
-            self.fire_buildings[building] = buildings.FireBuildingModel(building, initial_fire_level=16, points_per_window=4, b_type="ball")
+            self.fire_buildings[building] = buildings.FireBuildingModel(building, initial_fire_level=16, points_per_window=4, b_type="ball", scheduler=self.scheduler, loop=self.loop)
         for building in laser_buildings:
-            self.fire_buildings[building] = buildings.FireBuildingModel(building, initial_fire_level=8, points_per_window=3, b_type="laser")
+            self.fire_buildings[building] = buildings.FireBuildingModel(building, initial_fire_level=8, points_per_window=3, b_type="laser", scheduler=self.scheduler, loop=self.loop)
 
         self.heater_buildings: Dict[str, buildings.HeaterBuildingModel] = {}
         for building in heater_buildings:
-            self.heater_buildings[building] = buildings.HeaterBuildingModel(building)
+            self.heater_buildings[building] = buildings.HeaterBuildingModel(building, scheduler=self.scheduler, loop=self.loop)
 
-        with open('/configs/config.json', 'r') as file:
-            self.config = json.load(file)
+        # called as listener(source, kind) whenever something visible changes,
+        # source is "match" or the name of the building that changed
+        self.listeners: List[Callable] = []
+        for building in list(self.fire_buildings.values()) + list(self.heater_buildings.values()):
+            building.add_listener(self.building_changed)
+
+        self.extinguished: Dict[str, bool] = {name: False for name in self.fire_buildings}
+        self.extinguished_count = 0
+
+        if config is None:
+            with open('/configs/config.json', 'r') as file:
+                config = json.load(file)
+        self.config = config
 
         self.phase_i_duration = self.config.get("phase_1_duration", 10)
         self.phase_ii_duration = self.config.get("phase_2_duration", 10)
@@ -36,10 +67,23 @@ class MatchModel(object):
         self.random_hotspot_building = None
         self.safezone = None
 
-        self.phase_timer = timer.Timer()
-        self.match_timer = timer.Timer()
+        self.phase_timer = timer.Timer(self.scheduler)
+        self.match_timer = timer.Timer(self.scheduler)
+
+        # phase 3 re-ignition: buildings report their transitions, and once every
+        # fire building is out a single delayed reignite task is scheduled
+        self.phase_three_task: Any = None
+        self.reignite_delay = 5
 
-        self.phase_three_job_should_exit = False
+        # hits on one building that land within hit_window seconds of each other
+        # are applied as a single fire_doused_event carrying a count
+        self.hit_window = self.config.get("hit_coalesce_window", 0.01)
+        self.pending_hits: Dict[str, int] = {}
+        # latency traces that came with those hits, see tracing.py
+        self.pending_traces: Dict[str, List[dict]] = {}
+        # what douse_fire returned for each pending batch, resolved once it's applied
+        self.pending_futures: Dict[str, Future] = {}
+        self.pending_hits_lock = Lock()
 
         self.ui_toggles = {
             "sphero_recon": 0,
@@ -84,10 +128,21 @@ class MatchModel(object):
             "match_id": ""
         }
 
+        # point rules live in scoring_rules.py, config.json can swap out a phase
+        self.scoring_rules = scoring_rules.load_rules(self.config.get("scoring_rules", None))
+        # which score phases each ui toggle feeds, so a toggle only recomputes those
+        self.toggle_phases = scoring_rules.toggle_phases(self.scoring_rules)
+
+        # per phase subtotals, recomputed only when their inputs change
+        self.score_engine = score_engine.ScoreEngine({
+            "phase_i": self.calculate_phase_i,
+            "phase_ii": self.calculate_phase_ii,
+            "phase_iii": self.calculate_phase_iii,
+        })
+
         ###############################################################################
 
         ################### S T A T E  -  M A C H I N E   S T U F F ###################
-        self.sm_lock = Lock()
         self.sm: StateMachine = StateMachine('match')
 
         self.idle_state = State('idle_state')
@@ -144,10 +199,16 @@ class MatchModel(object):
 
         self.sm.initialize()
 
-    def dispatch(self, event):
-        self.sm_lock.acquire()
+    def dispatch(self, event) -> Future:
+        '''
+        queue an event for the match, returns a future that resolves once it's handled
+        '''
+        return self.loop.post(self.process_event, event)
 
+    def process_event(self, event):
         prev_state = self.sm.state.name #type: ignore
+        prev_hotspot = self.random_hotspot_building
+        prev_safezone = self.safezone
         if isinstance(event, str):
             event = Event(event)
         self.sm.dispatch(event)
@@ -156,7 +217,42 @@ class MatchModel(object):
         if new_state != prev_state:
             logger.debug(f"MATCH: State changed to {new_state}")
 
-        self.sm_lock.release()
+        if new_state != prev_state:
+            self.notify("match", "match_state")
+        if self.random_hotspot_building != prev_hotspot:
+            self.notify("match", "hotspot")
+        if self.safezone != prev_safezone:
+            self.notify("match", "safezone")
+
+    def add_listener(self, listener: Callable):
+        self.listeners.append(listener)
+
+    def notify(self, source: str, kind: str):
+        for listener in self.listeners:
+            listener(source, kind)
+
+    def building_changed(self, source: str, kind: str):
+        if kind == "score":
+            self.score_engine.invalidate("phase_iii")
+        if kind == "building_state" and source in self.fire_buildings:
+            self.fire_building_transition(source)
+        self.notify(source, kind)
+
+    def fire_building_transition(self, name: str):
+        extinguished = self.fire_buildings[name].sm.state == self.fire_buildings[name].extinguished_state
+        if extinguished == self.extinguished[name]:
+            return
+        self.extinguished[name] = extinguished
+        self.extinguished_count += 1 if extinguished else -1
+
+        # all out in phase 3, light them all again after a breather
+        if (
+            extinguished
+            and self.extinguished_count == len(self.fire_buildings)
+            and self.sm.state == self.phase_3_state
+            and self.phase_three_task is None
+        ):
+            self.phase_three_task = self.scheduler.call_later(self.reignite_delay, self.loop.post, self.phase_three_reignite)
 
     def idle_enter(self, state, enter):
         self.random_hotspot_building = ""
@@ -191,38 +287,67 @@ class MatchModel(object):
         self.phase_timer.set_timeout(self.phase_iii_duration)
         self.phase_timer.start()
 
-        self.phase_three_job_thread = Thread(target=self.phase_three_job, args=())
-        self.phase_three_job_thread.start()
-
         for building in self.fire_buildings.values():
             building.ignite()
             # building.auto_ignite = True
 
     def phase_three_exit(self, state, event):
-        self.phase_three_job_should_exit = True
-        self.phase_three_job_thread.join()
-        self.phase_three_job_should_exit = False
-
-    def phase_three_job(self):
-        while True:
-            if self.phase_three_job_should_exit:
-                break
-            # if any building's state isn't extinguished
-            if any([building.sm.state.name != "extinguished_state" for building in self.fire_buildings.values()]):
-                #we're still waiting for the buildings to be extinguished
-                pass
-            # otherwise if they've all been extinguished
-            else:
-                #ignite them all
-                time.sleep(5)
-                for building in self.fire_buildings.values():
-                    building.ignite()
-            time.sleep(.1)
+        # hits that came in before the phase ended still count
+        pending, traces, futures = self.take_pending_hits()
+        self.apply_hits(pending, traces)
+        for future in futures.values():
+            future.set_result(None)
+        if self.phase_three_task is not None:
+            self.phase_three_task.cancel()
+            self.phase_three_task = None
+
+    def phase_three_reignite(self):
+        self.phase_three_task = None
+        if self.sm.state != self.phase_3_state:
+            return
+        for building in self.fire_buildings.values():
+            building.ignite()
 
     def douse_fire_handler(self, state, event: Event):
-        building = event.cargo["source"]
-        if building in self.fire_buildings.keys():
-            self.fire_buildings[building].douse_fire()
+        source = event.cargo["source"]
+        self.apply_hits({source: event.cargo.get("count", 1)}, {source: event.cargo.get("traces", [])})
+
+    def apply_hits(self, hits: Dict[str, int], traces: Dict[str, List[dict]] = None):  # type: ignore
+        traces = traces if traces is not None else {}
+        for building, count in hits.items():
+            if building in self.fire_buildings.keys():
+                self.fire_buildings[building].douse_fire(count, traces.get(building, []))
+
+    def take_pending_hits(self, source: str = None):  # type: ignore
+        '''
+        returns (hits, traces, futures) collected for source, or for every building
+        '''
+        with self.pending_hits_lock:
+            if source is None:
+                pending = self.pending_hits
+                traces = self.pending_traces
+                futures = self.pending_futures
+                self.pending_hits = {}
+                self.pending_traces = {}
+                self.pending_futures = {}
+            elif source in self.pending_hits:
+                pending = {source: self.pending_hits.pop(source)}
+                traces = {source: self.pending_traces.pop(source, [])}
+                futures = {source: self.pending_futures.pop(source)}
+            else:
+                pending = {}
+                traces = {}
+                futures = {}
+        return pending, traces, futures
+
+    def flush_hits(self, source: str = None):  # type: ignore
+        '''
+        dispatch the hits collected for source (or every building) right away
+        '''
+        pending, traces, futures = self.take_pending_hits(source)
+        for building, count in pending.items():
+            done = self.dispatch(Event("fire_doused_event", source=building, count=count, traces=traces.get(building, [])))
+            done.add_done_callback(lambda done, future=futures[building]: copy_result(done, future))
 
     def post_match_enter(self, state, event):
         self.match_timer.reset()
@@ -230,7 +355,8 @@ class MatchModel(object):
 
     def post_match_exit(self, state, event):
         match_id = self.ui_toggles["match_id"]
-        if match_id != "" and self.calculate_score() > 0:
+        score = self.score_snapshot()
+        if match_id != "" and score["total"] > 0:
 
                 score_json = copy.deepcopy(self.ui_toggles)
                 score_json["buildings"] = {}
@@ -242,10 +368,10 @@ class MatchModel(object):
                 score_json["safezone"] = str(self.safezone)
                 score_json["hotspot"] = str(self.random_hotspot_building)
 
-                score_json["phase_i_score"] = self.calculate_phase_i()
-                score_json["phase_ii_score"] = self.calculate_phase_ii()
-                score_json["phase_iii_score"] = self.calculate_phase_iii()
-                score_json["total_score"] = self.calculate_score()
+                score_json["phase_i_score"] = score["phase_i"]
+                score_json["phase_ii_score"] = score["phase_ii"]
+                score_json["phase_iii_score"] = score["phase_iii"]
+                score_json["total_score"] = score["total"]
 
                 filename = match_id
                 filename = filename.replace("-", "_")
@@ -275,112 +401,20 @@ class MatchModel(object):
 
     ########################################################
     def calculate_phase_i(self):
-        score = 0
-
-        #phase I
-        if self.ui_toggles["sphero_recon_autonomous"] > 0:
-            score += self.ui_toggles["sphero_recon_autonomous"] * 2
-        if self.ui_toggles["sphero_recon"] > 0:
-            score += self.ui_toggles["sphero_recon"]
-
-
-        if self.ui_toggles["rvr_recon_autonomous"] is True:
-            score += 5
-        else:
-            if self.ui_toggles["rvr_recon"] is True:
-                score += 2
-
-        if self.ui_toggles["tello_recon_autonomous"] is True:
-            score += 4
-        elif self.ui_toggles["tello_recon"] is True:
-            score +=2
-
-        if self.ui_toggles["tello_recon_autonomous"] is True:
-            if self.ui_toggles["smoke_jumper_launch"]:
-                score += 3
-            if self.ui_toggles["smoke_jumper_parachute"]:
-                score += 2
-            if self.ui_toggles["smoke_jumper_landed_in"]:
-                score += 5
-            elif self.ui_toggles["smoke_jumper_landed_on_touch"]:
-                score += 3
-        else:
-            if self.ui_toggles["smoke_jumper_launch"]:
-                score += 1
-            if self.ui_toggles["smoke_jumper_parachute"]:
-                score += 1
-            if self.ui_toggles["smoke_jumper_landed_in"]:
-                score += 3
-            elif self.ui_toggles["smoke_jumper_landed_on_touch"]:
-                score += 1
-
-        if self.ui_toggles["avr_autonomous"] is True:
-            if self.ui_toggles["avr_takeoff_recon"] is True:
-                score += 10
-            if self.ui_toggles["avr_apriltag"] is True:
-                score += 3
-            if self.ui_toggles["avr_landing"] is True:
-                score += 7
-        else:
-            if self.ui_toggles["avr_takeoff_recon"] is True:
-                score += 2
-            if self.ui_toggles["avr_apriltag"] is True:
-                score += 2
-            if self.ui_toggles["avr_landing"] is True:
-                score += 1
-
-        return score
+        return scoring_rules.score_phase(
+            self.scoring_rules["phase_i"], self.ui_toggles, self.fire_buildings.values()
+        )
 
     def calculate_phase_ii(self):
-        score = 0
-         #phase 2 vars
-        if self.ui_toggles["first_responders_loaded"] > 0:
-            score += self.ui_toggles["first_responders_loaded"]
-
-        if self.ui_toggles["avr_ided_hotspot_and_dropped_fr"] is True:
-            score += 5
-        if self.ui_toggles["avr_flashed_led"] is True:
-            score += 5
-
-        if self.ui_toggles["first_responders_unloaded"] > 0:
-            score += self.ui_toggles["first_responders_unloaded"]
-        if self.ui_toggles["stranded_launched_from_fire_escape"] > 0:
-            score += self.ui_toggles["stranded_launched_from_fire_escape"]
-        if self.ui_toggles["stranded_in_rvr"] > 0:
-            score += self.ui_toggles["stranded_in_rvr"] * 2
-        if self.ui_toggles["avr_delivered_first_responders"] > 0:
-            score += self.ui_toggles["avr_delivered_first_responders"] * 2
-
-        if self.ui_toggles["stranded_delivered_to_safe_zone"] > 0:
-            score += self.ui_toggles["stranded_delivered_to_safe_zone"]
-        if self.ui_toggles["tello_identified_safe_zone"] is True:
-            score += self.ui_toggles["stranded_delivered_to_safe_zone"]
-
-
-        if self.ui_toggles["rvr_handsfree_unloaded"] is True:
-            score += 5
-        return score
+        return scoring_rules.score_phase(
+            self.scoring_rules["phase_ii"], self.ui_toggles, self.fire_buildings.values()
+        )
 
     def calculate_phase_iii(self):
-        score = 0
-        for building in self.fire_buildings.values():
-            if building.b_type == "ball":
-                score += building.get_score()
-                # if self.ui_toggles["avr_water_drop_autonomous"]:
-                #     score += ((building.get_score()/4) * 2)
-            elif building.b_type == "laser":
-                score += building.get_score()
-        if self.ui_toggles["buildings_autonomously_cleared"] > 0:
-                    score += (4 * self.ui_toggles["buildings_autonomously_cleared"]) #2 pts per window * 2 windows per building
-        if self.ui_toggles["rvr_parked"] is True:
-            score += 3
-        if self.ui_toggles["first_responders_parked"] > 0:
-            score += self.ui_toggles["first_responders_parked"]
-        if self.ui_toggles["tello_parked"] is True:
-            score += 3
-        if self.ui_toggles["avr_parked"] is True:
-            score += 3
-        return score
+        # an int, the old per-building get_score() sum came out as a float
+        return scoring_rules.score_phase(
+            self.scoring_rules["phase_iii"], self.ui_toggles, self.fire_buildings.values()
+        )
 
     def calculate_score(self):
         #phase I
@@ -396,6 +430,12 @@ class MatchModel(object):
 
         return cumulative
 
+    def score_snapshot(self) -> dict:
+        '''
+        phase subtotals and total, only recalculating phases whose inputs changed
+        '''
+        return self.score_engine.score_snapshot()
+
     def randomize_hotspot(self):
         name, object = random.choice(list(self.heater_buildings.items()))
         self.random_hotspot_building = name
@@ -405,8 +445,26 @@ class MatchModel(object):
         self.safezone = zone
 
 
-    def douse_fire(self, source):
-        self.dispatch(Event("fire_doused_event", source=source))
+    def douse_fire(self, source, count=1, trace: dict = None) -> Future:  # type: ignore
+        '''
+        returns a future that resolves once the hits are applied. only phase 3
+        coalesces, there that's when the building's batch is flushed, hits in
+        any other phase are dispatched straight away
+        '''
+        traces = [trace] if trace is not None else []
+        if self.hit_window <= 0 or self.sm.state != self.phase_3_state:
+            return self.dispatch(Event("fire_doused_event", source=source, count=count, traces=traces))
+        with self.pending_hits_lock:
+            first = source not in self.pending_hits
+            self.pending_hits[source] = self.pending_hits.get(source, 0) + count
+            if traces:
+                self.pending_traces.setdefault(source, []).extend(traces)
+            if first:
+                self.pending_futures[source] = Future()
+            future = self.pending_futures[source]
+        if first:
+            self.scheduler.call_later(self.hit_window, self.flush_hits, source)
+        return future
 
     def reset_ui_toggles(self):
             self.ui_toggles["sphero_recon"] = 0
@@ -440,8 +498,13 @@ class MatchModel(object):
             self.ui_toggles["tello_parked"] = False
             self.ui_toggles["avr_parked"] = False
             self.ui_toggles["match_id"] = ""
+            self.score_engine.invalidate()
+            self.notify("match", "toggles")
+
+    def handle_ui_toggles(self, data) -> Future:
+        return self.loop.post(self.apply_ui_toggle, data)
 
-    def handle_ui_toggles(self, data):
+    def apply_ui_toggle(self, data):
         toggle = data.get("toggle", None)
         payload = data.get("payload", None)
         if toggle in self.ui_toggles.keys():
@@ -463,5 +526,8 @@ class MatchModel(object):
                 self.ui_toggles[toggle] = payload
             elif isinstance(payload, bool) or isinstance(payload, int):
                 self.ui_toggles[toggle] = payload
+            if toggle in self.toggle_phases:
+                self.score_engine.invalidate(self.toggle_phases[toggle])
+            self.notify("match", "toggles")
         else:
             logger.debug(f"{toggle} not in toggles dict")
\ No newline at end of file
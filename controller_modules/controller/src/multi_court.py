@@ -0,0 +1,77 @@
+import copy
+import time
+from threading import Thread
+from typing import List
+from loguru import logger
+
+import controller
+import mqtt_client
+import scheduler as sched
+
+# Hosts several courts in one process. config.json gets a "courts" list, each
+# entry overriding the top level settings for that court:
+#
+#   {
+#       "phase_1_duration": 30, "phase_2_duration": 60, "phase_3_duration": 210,
+#       "courts": [
+#           {"topic_prefix": "court1"},
+#           {"topic_prefix": "court2", "ball_buildings": ["12", "16", "15"], ...}
+#       ]
+#   }
+#
+# Courts share the MQTT connection and the timer scheduler. Incoming messages
+# are routed by topic prefix on the network thread, and each court publishes
+# from its own worker thread.
+
+
+def court_configs(config: dict) -> List[dict]:
+    base = copy.deepcopy(config)
+    courts = base.pop("courts", [])
+    configs = []
+    for court in courts:
+        court_config = copy.deepcopy(base)
+        court_config.update(court)
+        if court_config.get("topic_prefix", "") == "":
+            raise Exception("every court needs its own topic_prefix")
+        configs.append(court_config)
+    return configs
+
+
+class MultiCourtController(object):
+    def __init__(self, config: dict, client=None, scheduler=None):
+        if client is None:
+            client = mqtt_client.MQTTClient(config.get("mqtt_broker", "mqtt"), 1883)
+        if scheduler is None:
+            scheduler = sched.get_scheduler()
+        self.mqtt_client = client
+        self.scheduler = scheduler
+
+        self.courts: List[controller.Controller] = []
+        prefixes = set()
+        for court_config in court_configs(config):
+            court = controller.Controller(client=client, config=court_config, scheduler=scheduler)
+            if court.topic_prefix in prefixes:
+                raise Exception(f"duplicate court topic_prefix {court.topic_prefix}")
+            prefixes.add(court.topic_prefix)
+            self.courts.append(court)
+            logger.debug(f"MULTI COURT: hosting court {court.topic_prefix}")
+
+        self.threads: List[Thread] = []
+
+    def start(self):
+        # callbacks for every court are registered by now, so one connect
+        # subscribes them all
+        self.mqtt_client.start_threaded()
+        for court in self.courts:
+            thread = Thread(target=court.publish_loop, args=(), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        for court in self.courts:
+            court.stop()
+
+    def run(self):
+        self.start()
+        while True:
+            time.sleep(1)
@@ -0,0 +1,183 @@
+import argparse
+import glob
+import json
+import time
+from typing import Dict, List
+
+import numpy as np
+
+import scoring_rules
+
+# Re-scores archived match logs (the /logs/*.json files written by
+# MatchModel.post_match_exit) against a set of scoring rules, evaluating every
+# rule as a column operation over all matches at once.
+#
+#   python rescore.py /logs/*.json
+#   python rescore.py --rules new_rules.json /logs/*.json
+
+BALL_BUILDINGS = ["2", "6", "5"]
+LASER_BUILDINGS = ["1", "4", "3"]
+
+
+def load_archive(paths: List[str]) -> List[dict]:
+    records = []
+    for path in paths:
+        with open(path, "r") as file:
+            record = json.load(file)
+        record["_file"] = path
+        records.append(record)
+    return records
+
+
+class ToggleColumns(object):
+    '''
+    Lazily built per-toggle columns over all records. Each toggle gets the
+    three views the rules need: strictly True, truthy, and numeric.
+    '''
+    def __init__(self, records: List[dict]):
+        self.records = records
+        self.raw: Dict[str, list] = {}
+        self.cache: Dict[tuple, np.ndarray] = {}
+
+    def values(self, toggle: str) -> list:
+        if toggle not in self.raw:
+            self.raw[toggle] = [record.get(toggle, None) for record in self.records]
+        return self.raw[toggle]
+
+    def is_set(self, toggle: str, truthy: bool = False) -> np.ndarray:
+        key = (toggle, "truthy" if truthy else "true")
+        if key not in self.cache:
+            if truthy:
+                column = [bool(v) for v in self.values(toggle)]
+            else:
+                column = [v is True for v in self.values(toggle)]
+            self.cache[key] = np.array(column, dtype=bool)
+        return self.cache[key]
+
+    def numeric(self, toggle: str) -> np.ndarray:
+        key = (toggle, "numeric")
+        if key not in self.cache:
+            column = [
+                float(v) if isinstance(v, (int, float)) else 0.0 for v in self.values(toggle)
+            ]
+            self.cache[key] = np.array(column, dtype=np.float64)
+        return self.cache[key]
+
+
+def windows_columns(records: List[dict], building_types: Dict[str, str]) -> Dict[str, np.ndarray]:
+    '''
+    building type -> total extinguished windows per record
+    '''
+    columns = {}
+    for b_type in set(building_types.values()):
+        columns[b_type] = np.zeros(len(records), dtype=np.float64)
+    for index, record in enumerate(records):
+        for building_id, building in record.get("buildings", {}).items():
+            b_type = building_types.get(str(building_id), None)
+            if b_type is not None:
+                columns[b_type][index] += building.get("windows", 0)
+    return columns
+
+
+def score_rule_batch(rule: dict, columns: ToggleColumns, windows: Dict[str, np.ndarray], n: int) -> np.ndarray:
+    rule_type = rule["type"]
+    if "autonomous" in rule:
+        autonomous = columns.is_set(rule["autonomous"])
+    else:
+        autonomous = np.zeros(n, dtype=bool)
+
+    if rule_type == "count":
+        value = columns.numeric(rule["toggle"])
+        if "cap" in rule:
+            value = np.minimum(value, rule["cap"])
+        score = np.where(value > 0, value * rule["points"], 0.0)
+        if "requires" in rule:
+            score = np.where(columns.is_set(rule["requires"]), score, 0.0)
+        return score
+
+    elif rule_type == "flag":
+        points = np.where(autonomous, rule.get("autonomous_points", rule["points"]), rule["points"])
+        return np.where(columns.is_set(rule["toggle"], rule.get("truthy", False)), points, 0.0)
+
+    elif rule_type == "first_of":
+        conditions = []
+        choices = []
+        for option in rule["options"]:
+            conditions.append(columns.is_set(option[0], rule.get("truthy", False)))
+            auto_points = option[2] if len(option) > 2 else option[1]
+            choices.append(np.where(autonomous, auto_points, option[1]))
+        return np.select(conditions, choices, default=0.0)
+
+    elif rule_type == "windows":
+        score = np.zeros(n, dtype=np.float64)
+        for b_type, points in rule["points"].items():
+            if b_type in windows:
+                score += windows[b_type] * points
+        return score
+
+    raise Exception(f"unknown scoring rule type {rule_type}")
+
+
+def rescore(records: List[dict], rules: Dict[str, List[dict]], building_types: Dict[str, str]) -> Dict[str, np.ndarray]:
+    n = len(records)
+    columns = ToggleColumns(records)
+    windows = windows_columns(records, building_types)
+
+    scores = {}
+    total = np.zeros(n, dtype=np.float64)
+    for phase, phase_rules in rules.items():
+        phase_score = np.zeros(n, dtype=np.float64)
+        for rule in phase_rules:
+            phase_score += score_rule_batch(rule, columns, windows, n)
+        scores[phase] = phase_score
+        total += phase_score
+    scores["total"] = total
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="re-score archived match logs")
+    parser.add_argument("paths", nargs="*", default=None, help="match log files (default /logs/*.json)")
+    parser.add_argument("--rules", default=None, help="json file of per phase rule overrides")
+    parser.add_argument("--ball", default=",".join(BALL_BUILDINGS), help="ball building ids")
+    parser.add_argument("--laser", default=",".join(LASER_BUILDINGS), help="laser building ids")
+    args = parser.parse_args()
+
+    paths = args.paths if args.paths else sorted(glob.glob("/logs/*.json"))
+
+    overrides = None
+    if args.rules is not None:
+        with open(args.rules, "r") as file:
+            overrides = json.load(file)
+    rules = scoring_rules.load_rules(overrides)
+
+    building_types = {}
+    for building in args.ball.split(","):
+        building_types[building] = "ball"
+    for building in args.laser.split(","):
+        building_types[building] = "laser"
+
+    start = time.perf_counter()
+    records = load_archive(paths)
+    loaded = time.perf_counter()
+    scores = rescore(records, rules, building_types)
+    scored = time.perf_counter()
+
+    stored = np.array([float(r.get("total_score", 0)) for r in records], dtype=np.float64)
+    diffs = scores["total"] - stored
+    changed = np.nonzero(diffs)[0]
+
+    for index in changed:
+        record = records[index]
+        print(
+            f"{record.get('match_id', record['_file'])}: stored {stored[index]:g} "
+            f"new {scores['total'][index]:g} ({diffs[index]:+g})"
+        )
+    print(
+        f"re-scored {len(records)} matches in {(scored - loaded) * 1000:.1f} ms "
+        f"(loading took {(loaded - start) * 1000:.1f} ms), {len(changed)} changed"
+    )
+
+
+if __name__ == "__main__":
+    main()
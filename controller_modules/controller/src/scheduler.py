@@ -0,0 +1,169 @@
+import heapq
+import itertools
+import traceback
+from threading import Condition, Thread
+from typing import Any, Callable, List, Optional
+from loguru import logger
+import clock as clk
+
+
+class ScheduledTask(object):
+    '''
+    Handle for a callback sitting in a Scheduler. Can be cancelled or moved to
+    a new deadline.
+    '''
+    def __init__(self, scheduler: "Scheduler", deadline: float, function: Callable, args: tuple):
+        self.scheduler = scheduler
+        self.deadline = deadline
+        self.function = function
+        self.args = args
+        self.cancelled = False
+        self.done = False
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+    def reschedule(self, delay: float):
+        self.scheduler.reschedule(self, delay)
+
+    def time_remaining(self) -> float:
+        if self.cancelled or self.done:
+            return 0
+        return max(0, self.deadline - self.scheduler.now())
+
+
+class Scheduler(object):
+    '''
+    One worker thread running callbacks off a heap of monotonic deadlines.
+    Replaces a thread per timer, so the thread count no longer grows with the
+    number of buildings and deadlines aren't rounded to whole seconds.
+    '''
+    def __init__(self, clock: Any = None):
+        # a VirtualClock makes this a manually driven scheduler, see advance()
+        self.clock = clock if clock is not None else clk.RealClock()
+        self.condition = Condition()
+        self.queue: List[tuple] = []
+        self.counter = itertools.count()
+        self.thread: Optional[Thread] = None
+
+    def now(self) -> float:
+        return self.clock.now()
+
+    def start(self):
+        if self.clock.virtual:
+            # nothing to wait on, time only moves through advance()
+            return
+        if self.thread is None:
+            self.thread = Thread(target=self.run, args=(), daemon=True)
+            self.thread.start()
+
+    def advance(self, seconds: float):
+        '''
+        Move a virtual clock forward, running every callback that comes due on
+        the way in deadline order, on the calling thread.
+        '''
+        if not self.clock.virtual:
+            raise Exception("advance() only works with a VirtualClock")
+        target = self.clock.now() + seconds
+        while True:
+            with self.condition:
+                deadline = self.next_live_deadline()
+                if deadline is None or deadline > target:
+                    break
+                self.clock.set(deadline)
+                due = self.pop_due()
+            for task in due:
+                self.run_task(task)
+        self.clock.set(target)
+
+    def run_pending(self):
+        '''
+        run whatever is already due without moving the clock
+        '''
+        self.advance(0)
+
+    def call_at(self, deadline: float, function: Callable, *args: Any) -> ScheduledTask:
+        task = ScheduledTask(self, deadline, function, args)
+        with self.condition:
+            self.push(task)
+        return task
+
+    def call_later(self, delay: float, function: Callable, *args: Any) -> ScheduledTask:
+        return self.call_at(self.now() + delay, function, *args)
+
+    def cancel(self, task: ScheduledTask):
+        # the heap entry is left where it is and skipped when it comes due
+        with self.condition:
+            task.cancelled = True
+
+    def reschedule(self, task: ScheduledTask, delay: float):
+        with self.condition:
+            task.cancelled = False
+            task.done = False
+            task.deadline = self.now() + delay
+            self.push(task)
+
+    def push(self, task: ScheduledTask):
+        # caller holds the condition. the deadline is stored alongside the task
+        # so stale entries left behind by reschedule() can be told apart
+        heapq.heappush(self.queue, (task.deadline, next(self.counter), task))
+        self.condition.notify()
+
+    def pop_due(self) -> List[ScheduledTask]:
+        # caller holds the condition
+        due = []
+        now = self.now()
+        while self.queue and self.queue[0][0] <= now:
+            deadline, _, task = heapq.heappop(self.queue)
+            if task.cancelled or task.done or deadline != task.deadline:
+                continue
+            task.done = True
+            due.append(task)
+        return due
+
+    def next_deadline(self) -> Optional[float]:
+        # caller holds the condition
+        return self.queue[0][0] if self.queue else None
+
+    def next_live_deadline(self) -> Optional[float]:
+        # caller holds the condition. drops cancelled/stale entries off the top
+        while self.queue:
+            deadline, _, task = self.queue[0]
+            if task.cancelled or task.done or deadline != task.deadline:
+                heapq.heappop(self.queue)
+                continue
+            return deadline
+        return None
+
+    def run_task(self, task: ScheduledTask):
+        try:
+            task.function(*task.args)
+        except Exception:
+            logger.debug(f"SCHEDULER: error in scheduled callback {task.function}")
+            logger.debug(traceback.format_exc())
+
+    def run(self):
+        while True:
+            with self.condition:
+                due = self.pop_due()
+                if not due:
+                    deadline = self.next_deadline()
+                    timeout = None if deadline is None else max(0, deadline - self.now())
+                    self.condition.wait(timeout=timeout)
+                    continue
+            for task in due:
+                self.run_task(task)
+
+
+default_scheduler: Optional[Scheduler] = None
+
+
+def get_scheduler() -> Scheduler:
+    '''
+    the process wide scheduler, started on first use
+    '''
+    global default_scheduler
+    if default_scheduler is None:
+        default_scheduler = Scheduler()
+        default_scheduler.start()
+    return default_scheduler
@@ -0,0 +1,40 @@
+from threading import Lock
+from typing import Callable, Dict, List, Union
+
+
+class ScoreEngine(object):
+    '''
+    Keeps a subtotal per match phase and only re-runs a phase's calculator
+    after something it depends on was invalidated (a toggle or a building hit).
+    score_snapshot() is cheap enough to call on every publish.
+    '''
+    def __init__(self, calculators: Dict[str, Callable]):
+        # phase name -> function returning that phase's score
+        self.calculators = calculators
+
+        self.lock = Lock()
+        self.subtotals: Dict[str, Union[int, float]] = dict.fromkeys(calculators.keys(), 0)
+        self.dirty = set(calculators.keys())
+
+    def invalidate(self, phases: Union[str, List[str], None] = None):
+        with self.lock:
+            if phases is None:
+                self.dirty = set(self.calculators.keys())
+            elif isinstance(phases, str):
+                self.dirty.add(phases)
+            else:
+                self.dirty.update(phases)
+
+    def score_snapshot(self) -> dict:
+        with self.lock:
+            # clear the flags before recomputing so an invalidate that lands
+            # while we calculate isn't lost, it just gets picked up next time
+            dirty = self.dirty
+            self.dirty = set()
+
+        for phase in dirty:
+            self.subtotals[phase] = self.calculators[phase]()
+
+        snapshot = dict(self.subtotals)
+        snapshot["total"] = sum(self.subtotals.values())
+        return snapshot
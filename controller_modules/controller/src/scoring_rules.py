@@ -0,0 +1,157 @@
+import copy
+from typing import Any, Dict, Iterable, List
+
+# The point rules for each phase, as data. Each rule is a dict with a "type":
+#
+#   count    - toggle value * points when it's > 0, optionally capped at "cap"
+#              and only counted when the "requires" toggle is True
+#   flag     - points when the toggle is True ("truthy": true accepts any
+#              truthy value instead of only True)
+#   first_of - "options" is a list of [toggle, points], the first option whose
+#              toggle is set scores and the rest are skipped
+#   windows  - every extinguished window on a fire building, "points" maps the
+#              building type (ball/laser) to points per window
+#
+# flag and first_of rules can also name an "autonomous" toggle. When that
+# toggle is True the rule scores "autonomous_points" (for first_of, the third
+# entry of each option) instead of the normal points.
+SCORING_RULES: Dict[str, List[dict]] = {
+    "phase_i": [
+        {"type": "count", "toggle": "sphero_recon_autonomous", "points": 2},
+        {"type": "count", "toggle": "sphero_recon", "points": 1},
+        {"type": "first_of", "options": [["rvr_recon_autonomous", 5], ["rvr_recon", 2]]},
+        {"type": "first_of", "options": [["tello_recon_autonomous", 4], ["tello_recon", 2]]},
+        {
+            "type": "flag", "toggle": "smoke_jumper_launch", "truthy": True,
+            "points": 1, "autonomous": "tello_recon_autonomous", "autonomous_points": 3,
+        },
+        {
+            "type": "flag", "toggle": "smoke_jumper_parachute", "truthy": True,
+            "points": 1, "autonomous": "tello_recon_autonomous", "autonomous_points": 2,
+        },
+        {
+            "type": "first_of", "truthy": True, "autonomous": "tello_recon_autonomous",
+            "options": [["smoke_jumper_landed_in", 3, 5], ["smoke_jumper_landed_on_touch", 1, 3]],
+        },
+        {
+            "type": "flag", "toggle": "avr_takeoff_recon",
+            "points": 2, "autonomous": "avr_autonomous", "autonomous_points": 10,
+        },
+        {
+            "type": "flag", "toggle": "avr_apriltag",
+            "points": 2, "autonomous": "avr_autonomous", "autonomous_points": 3,
+        },
+        {
+            "type": "flag", "toggle": "avr_landing",
+            "points": 1, "autonomous": "avr_autonomous", "autonomous_points": 7,
+        },
+    ],
+    "phase_ii": [
+        {"type": "count", "toggle": "first_responders_loaded", "points": 1},
+        {"type": "flag", "toggle": "avr_ided_hotspot_and_dropped_fr", "points": 5},
+        {"type": "flag", "toggle": "avr_flashed_led", "points": 5},
+        {"type": "count", "toggle": "first_responders_unloaded", "points": 1},
+        {"type": "count", "toggle": "stranded_launched_from_fire_escape", "points": 1},
+        {"type": "count", "toggle": "stranded_in_rvr", "points": 2},
+        {"type": "count", "toggle": "avr_delivered_first_responders", "points": 2},
+        {"type": "count", "toggle": "stranded_delivered_to_safe_zone", "points": 1},
+        # the safe zone delivery counts twice if the tello found the zone
+        {
+            "type": "count", "toggle": "stranded_delivered_to_safe_zone",
+            "points": 1, "requires": "tello_identified_safe_zone",
+        },
+        {"type": "flag", "toggle": "rvr_handsfree_unloaded", "points": 5},
+    ],
+    "phase_iii": [
+        {"type": "windows", "points": {"ball": 4, "laser": 3}},
+        # 2 pts per window * 2 windows per building
+        {"type": "count", "toggle": "buildings_autonomously_cleared", "points": 4},
+        {"type": "flag", "toggle": "rvr_parked", "points": 3},
+        {"type": "count", "toggle": "first_responders_parked", "points": 1},
+        {"type": "flag", "toggle": "tello_parked", "points": 3},
+        {"type": "flag", "toggle": "avr_parked", "points": 3},
+    ],
+}
+
+
+def load_rules(overrides: Dict[str, List[dict]] = None) -> Dict[str, List[dict]]:  # type: ignore
+    '''
+    The default rules with any phases from overrides (e.g. the "scoring_rules"
+    entry of config.json) swapped in.
+    '''
+    rules = copy.deepcopy(SCORING_RULES)
+    if overrides:
+        for phase, phase_rules in overrides.items():
+            rules[phase] = phase_rules
+    return rules
+
+
+def rule_toggles(rule: dict) -> List[str]:
+    toggles = []
+    for key in ["toggle", "requires", "autonomous"]:
+        if key in rule:
+            toggles.append(rule[key])
+    for option in rule.get("options", []):
+        toggles.append(option[0])
+    return toggles
+
+
+def toggle_phases(rules: Dict[str, List[dict]]) -> Dict[str, List[str]]:
+    '''
+    toggle name -> the phases whose score depends on it
+    '''
+    phases: Dict[str, List[str]] = {}
+    for phase, phase_rules in rules.items():
+        for rule in phase_rules:
+            for toggle in rule_toggles(rule):
+                if phase not in phases.setdefault(toggle, []):
+                    phases[toggle].append(phase)
+    return phases
+
+
+def is_set(value: Any, truthy: bool = False) -> bool:
+    if truthy:
+        return bool(value)
+    return value is True
+
+
+def score_rule(rule: dict, toggles: dict, fire_buildings: Iterable) -> int:
+    rule_type = rule["type"]
+    autonomous = is_set(toggles.get(rule["autonomous"])) if "autonomous" in rule else False
+
+    if rule_type == "count":
+        value = toggles.get(rule["toggle"], 0)
+        if "requires" in rule and not is_set(toggles.get(rule["requires"])):
+            return 0
+        if value > 0:
+            if "cap" in rule:
+                value = min(value, rule["cap"])
+            return value * rule["points"]
+
+    elif rule_type == "flag":
+        if is_set(toggles.get(rule["toggle"]), rule.get("truthy", False)):
+            return rule["autonomous_points"] if autonomous else rule["points"]
+
+    elif rule_type == "first_of":
+        for option in rule["options"]:
+            if is_set(toggles.get(option[0]), rule.get("truthy", False)):
+                return option[2] if autonomous else option[1]
+
+    elif rule_type == "windows":
+        score = 0
+        for building in fire_buildings:
+            score += building.get_windows() * rule["points"].get(building.b_type, 0)
+        return score
+
+    else:
+        raise Exception(f"unknown scoring rule type {rule_type}")
+
+    return 0
+
+
+def score_phase(phase_rules: List[dict], toggles: dict, fire_buildings: Iterable) -> int:
+    score = 0
+    fire_buildings = list(fire_buildings)
+    for rule in phase_rules:
+        score += score_rule(rule, toggles, fire_buildings)
+    return score
@@ -0,0 +1,342 @@
+import argparse
+import json
+import random
+import time
+from collections import Counter
+from queue import Queue
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, List, Union
+
+from loguru import logger
+
+import controller
+from mqtt_client import TopicTrie
+
+# Headless match simulator. Runs a Controller + MatchModel against an
+# in-process broker, fires synthetic hits at the fire buildings and scripted
+# ui toggles, then reports throughput, dispatch latency, event loop mailbox
+# wait and published message counts. Use it as the baseline for perf changes:
+#
+#   python simulator.py --rate 5 --teams 2 --burst-rate 0.5 --burst-size 20
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class FakeBroker(object):
+    '''
+    Minimal in-process broker. Counts every publish per topic and hands
+    matching messages to each connected client's inbox.
+    '''
+    def __init__(self):
+        self.clients: List["FakeMQTTClient"] = []
+        self.counts: Counter = Counter()
+        self.counts_lock = Lock()
+
+    def connect(self, name: str) -> "FakeMQTTClient":
+        client = FakeMQTTClient(self, name)
+        self.clients.append(client)
+        return client
+
+    def publish(self, topic: str, payload: Union[str, bytes], retain: bool = False):
+        with self.counts_lock:
+            self.counts[topic] += 1
+        sent_at = time.perf_counter()
+        for client in self.clients:
+            if client.topic_trie.match(topic):
+                client.deliver(topic, payload, sent_at)
+
+
+class FakeMQTTClient(object):
+    '''
+    Same surface as mqtt_client.MQTTClient. Messages are handled on one
+    "network" thread per client, like paho's loop thread, so the timings
+    include queueing behind slow handlers.
+    '''
+    def __init__(self, broker: FakeBroker, name: str):
+        self.broker = broker
+        self.name = name
+        self.topic_map: Dict[str, List[Callable]] = {}
+        self.topic_trie = TopicTrie()
+        self.inbox: Queue = Queue()
+        self.thread: Any = None
+
+        self.delivered = 0
+        self.latencies: List[float] = []
+        self.max_backlog = 0
+
+    def register_callback(self, topic: str, function: Callable):
+        handlers = self.topic_map.setdefault(topic, [])
+        if function not in handlers:
+            handlers.append(function)
+            self.topic_trie.add(topic, function)
+
+    def publish(self, topic: str, message: Any, retain: bool = False):
+        self.broker.publish(topic, json.dumps(message), retain)
+
+    def publish_raw(self, topic: str, payload: Union[str, bytes], retain: bool = False):
+        self.broker.publish(topic, payload, retain)
+
+    def is_connected(self) -> bool:
+        return True
+
+    def start_threaded(self):
+        if self.thread is None:
+            self.thread = Thread(target=self.run, args=(), daemon=True)
+            self.thread.start()
+
+    def deliver(self, topic: str, payload: Union[str, bytes], sent_at: float):
+        self.inbox.put((topic, payload, sent_at))
+        backlog = self.inbox.qsize()
+        if backlog > self.max_backlog:
+            self.max_backlog = backlog
+
+    def run(self):
+        while True:
+            topic, payload, sent_at = self.inbox.get()
+            msg = json.loads(payload)
+            for handler in self.topic_trie.match(topic):
+                handler(topic, msg)
+            self.latencies.append(time.perf_counter() - sent_at)
+            self.delivered += 1
+            self.inbox.task_done()
+
+
+class HitGenerator(Thread):
+    '''
+    One team's shots. Hits follow a Poisson process per building (rate in hits
+    per second), with occasional bursts of burst_size hits on one building, as
+    when a whole volley of balls goes in at once.
+    '''
+    def __init__(self, client: FakeMQTTClient, buildings: Dict[str, str], rate: float,
+                 burst_rate: float, burst_size: int, stop: Event, seed: int):
+        super().__init__(daemon=True)
+        self.client = client
+        # building name -> detector subsystem
+        self.buildings = buildings
+        self.rate = rate
+        self.burst_rate = burst_rate
+        self.burst_size = burst_size
+        self.stop_event = stop
+        self.random = random.Random(seed)
+        self.sent = 0
+
+    def hit(self, building: str):
+        self.client.publish(f"{building}/events/{self.buildings[building]}/", {"event_type": "hit"})
+        self.sent += 1
+
+    def run(self):
+        names = list(self.buildings.keys())
+        total_rate = self.rate * len(names) + self.burst_rate
+        if total_rate <= 0:
+            return
+        while not self.stop_event.is_set():
+            self.stop_event.wait(self.random.expovariate(total_rate))
+            if self.stop_event.is_set():
+                break
+            if self.random.random() < self.burst_rate / total_rate:
+                building = self.random.choice(names)
+                for _ in range(self.burst_size):
+                    self.hit(building)
+            else:
+                self.hit(self.random.choice(names))
+
+
+class ToggleScript(Thread):
+    '''
+    Plays a list of {"t": seconds, "toggle": name, "payload": value} steps (or
+    {"t": seconds, "event": name} for plain ui events). Without a script it
+    flips a random toggle `rate` times a second.
+    '''
+    def __init__(self, client: FakeMQTTClient, toggles: Dict[str, Any], script: List[dict],
+                 rate: float, stop: Event, seed: int):
+        super().__init__(daemon=True)
+        self.client = client
+        self.toggles = toggles
+        self.script = script
+        self.rate = rate
+        self.stop_event = stop
+        self.random = random.Random(seed)
+        self.sent = 0
+
+    def send(self, step: dict):
+        if "event" in step:
+            self.client.publish("ui/events/sim", {"event_type": step["event"]})
+        else:
+            data = {"toggle": step["toggle"], "payload": step["payload"]}
+            self.client.publish("ui/events/sim", {"event_type": "ui_toggle", "data": data})
+        self.sent += 1
+
+    def random_step(self) -> dict:
+        names = [name for name in self.toggles.keys() if name != "match_id"]
+        toggle = self.random.choice(names)
+        if isinstance(self.toggles[toggle], bool):
+            payload = self.random.choice([True, False])
+        else:
+            payload = self.random.randint(0, 3)
+        return {"toggle": toggle, "payload": payload}
+
+    def run(self):
+        start = time.time()
+        if self.script:
+            for step in sorted(self.script, key=lambda s: s.get("t", 0)):
+                delay = step.get("t", 0) - (time.time() - start)
+                if self.stop_event.wait(max(0, delay)):
+                    return
+                self.send(step)
+        elif self.rate > 0:
+            while not self.stop_event.wait(self.random.expovariate(self.rate)):
+                self.send(self.random_step())
+
+
+class Simulation(object):
+    def __init__(self, args):
+        self.args = args
+        self.broker = FakeBroker()
+
+        config = {
+            "phase_1_duration": args.phase_durations[0],
+            "phase_2_duration": args.phase_durations[1],
+            "phase_3_duration": args.phase_durations[2],
+            "ui_state_mode": args.ui_state_mode,
+        }
+        self.controller_client = self.broker.connect("controller")
+        self.controller = controller.Controller(client=self.controller_client, config=config)
+        self.field_client = self.broker.connect("field")
+
+        # the match and its buildings share one event loop, time how long work waits in it
+        self.controller.match.loop.record_waits = True
+
+        self.stop = Event()
+        self.generators: List[HitGenerator] = []
+        self.toggle_script: Any = None
+
+    def ui_event(self, event_type: str):
+        self.field_client.publish("ui/events/sim", {"event_type": event_type})
+
+    def wait_for_state(self, state: str, timeout: float) -> bool:
+        end = time.time() + timeout
+        while time.time() < end:
+            if self.controller.match.sm.state.name == state:  # type: ignore
+                return True
+            time.sleep(0.01)
+        return False
+
+    def run(self):
+        args = self.args
+        Thread(target=self.controller.run, args=(), daemon=True).start()
+
+        self.ui_event("new_match_event")
+        self.ui_event("randomize_hotspot_event")
+        self.ui_event("randomize_safezone_event")
+        self.ui_event("start_preheat_event")
+        self.ui_event("match_start_event")
+
+        script = []
+        if args.toggles is not None:
+            with open(args.toggles, "r") as file:
+                script = json.load(file)
+        self.toggle_script = ToggleScript(
+            self.field_client, self.controller.match.ui_toggles, script,
+            args.toggle_rate, self.stop, args.seed
+        )
+        self.toggle_script.start()
+
+        # buildings only take hits while they burn in phase 3
+        total_duration = sum(args.phase_durations)
+        if not self.wait_for_state("phase_3_state", timeout=total_duration + 5):
+            raise Exception("match never reached phase 3")
+
+        buildings = {}
+        for name, building in self.controller.match.fire_buildings.items():
+            buildings[name] = "ball_detector" if building.b_type == "ball" else "laser_detector"
+        for team in range(args.teams):
+            generator = HitGenerator(
+                self.field_client, buildings, args.rate, args.burst_rate,
+                args.burst_size, self.stop, args.seed + team + 1
+            )
+            self.generators.append(generator)
+            generator.start()
+
+        hits_start = time.time()
+        self.wait_for_state("post_match_state", timeout=args.phase_durations[2] + 5)
+        self.stop.set()
+        hits_end = time.time()
+
+        # let the controller work through whatever is still queued
+        self.controller_client.inbox.join()
+        self.controller.match.loop.call(lambda: None)
+        drained = time.time()
+        self.controller.stop()
+
+        self.report(hits_end - hits_start, drained - hits_end)
+
+    def report(self, hit_window: float, drain_time: float):
+        client = self.controller_client
+        hits_sent = sum([g.sent for g in self.generators])
+        score = self.controller.match.score_snapshot()
+
+        print("=== match ===")
+        print(f"final state        {self.controller.match.sm.state.name}")  # type: ignore
+        print(f"score              {score}")
+        print("=== throughput ===")
+        print(f"teams              {len(self.generators)}")
+        print(f"hits sent          {hits_sent} over {hit_window:.2f}s ({hits_sent / max(hit_window, 1e-9):.1f}/s)")
+        print(f"toggles sent       {self.toggle_script.sent}")
+        print(f"events handled     {client.delivered} ({client.delivered / max(hit_window + drain_time, 1e-9):.1f}/s)")
+        print(f"max inbox backlog  {client.max_backlog}")
+        print(f"drain after stop   {drain_time * 1000:.1f} ms")
+
+        print("=== network thread latency (publish -> handler returned) ===")
+        latencies = [l * 1000 for l in client.latencies]
+        for pct in [50, 90, 99, 99.9]:
+            print(f"p{pct:<5}             {percentile(latencies, pct):.3f} ms")
+        print(f"max                {max(latencies) if latencies else 0:.3f} ms")
+
+        loop = self.controller.match.loop
+        print("=== event loop mailbox ===")
+        waits = [w * 1000 for w in loop.waits]
+        print(f"calls processed    {loop.processed}")
+        print(f"max mailbox depth  {loop.max_depth}")
+        for pct in [50, 99]:
+            print(f"wait p{pct:<5}        {percentile(waits, pct):.3f} ms")
+        print(f"wait max           {max(waits) if waits else 0:.3f} ms")
+
+        print("=== published messages per topic ===")
+        counts = self.broker.counts
+        total = sum(counts.values())
+        for topic, count in counts.most_common(self.args.top_topics):
+            print(f"{count:>8}  {topic}")
+        print(f"{total:>8}  total over {len(counts)} topics")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="headless match simulator")
+    parser.add_argument("--rate", type=float, default=2.0, help="hits/s per building per team")
+    parser.add_argument("--teams", type=int, default=1, help="concurrent hit generators")
+    parser.add_argument("--burst-rate", type=float, default=0.2, help="bursts/s per team")
+    parser.add_argument("--burst-size", type=int, default=10, help="hits per burst")
+    parser.add_argument("--toggles", default=None, help="json toggle script")
+    parser.add_argument("--toggle-rate", type=float, default=2.0, help="random toggles/s without a script")
+    parser.add_argument("--phase-durations", type=float, nargs=3, default=[2, 2, 10], metavar=("P1", "P2", "P3"))
+    parser.add_argument("--ui-state-mode", default="topics", choices=["topics", "snapshot", "both"])
+    parser.add_argument("--top-topics", type=int, default=15)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="keep the model's debug logging")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logger.remove()
+        logger.add(lambda m: None, level="WARNING")
+
+    random.seed(args.seed)
+    Simulation(args).run()
+
+
+if __name__ == "__main__":
+    main()
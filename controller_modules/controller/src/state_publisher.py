@@ -0,0 +1,185 @@
+import copy
+import json
+import time
+from typing import Any, Dict
+
+
+class StatePublisher(object):
+    '''
+    Publishes retained state topics, but only when the payload for a topic has
+    changed since the last time it was sent. Every refresh_interval seconds the
+    cache is dropped so the next round re-sends everything, which covers any
+    message the broker or a client may have missed.
+    '''
+    def __init__(self, mqtt_client, refresh_interval: float = 10.0):
+        self.mqtt_client = mqtt_client
+        self.refresh_interval = refresh_interval
+
+        self.last_payloads: Dict[str, str] = {}
+        self.last_refresh = time.time()
+
+        self.sent_count = 0
+        self.skipped_count = 0
+
+    def publish(self, topic: str, message: Any) -> bool:
+        payload = json.dumps(message)
+        if self.last_payloads.get(topic) == payload:
+            self.skipped_count += 1
+            return False
+
+        self.last_payloads[topic] = payload
+        # retained so a freshly opened dashboard gets the full state right away
+        self.mqtt_client.publish_raw(topic, payload, retain=True)
+        self.sent_count += 1
+        return True
+
+    def invalidate(self, topic: str = None):  # type: ignore
+        if topic is None:
+            self.last_payloads.clear()
+        else:
+            self.last_payloads.pop(topic, None)
+
+    def refresh_if_due(self):
+        now = time.time()
+        if now - self.last_refresh > self.refresh_interval:
+            self.invalidate()
+            self.last_refresh = now
+
+
+def diff_state(old: Any, new: Any, path: str = "", ops: list = None) -> list:  # type: ignore
+    '''
+    Build a list of JSON patch (RFC 6902) operations that turn old into new.
+    Dicts and same-length lists are walked so a single changed table cell only
+    costs one small op, anything else is replaced whole.
+    '''
+    if ops is None:
+        ops = []
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, value in new.items():
+            child = f"{path}/{escape_pointer(str(key))}"
+            if key not in old:
+                ops.append({"op": "add", "path": child, "value": value})
+            else:
+                diff_state(old[key], value, child, ops)
+        for key in old.keys():
+            if key not in new:
+                ops.append({"op": "remove", "path": f"{path}/{escape_pointer(str(key))}"})
+    elif isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        for index, (old_item, new_item) in enumerate(zip(old, new)):
+            diff_state(old_item, new_item, f"{path}/{index}", ops)
+    elif type(old) != type(new) or old != new:
+        ops.append({"op": "replace", "path": path, "value": new})
+
+    return ops
+
+
+def escape_pointer(key: str) -> str:
+    return key.replace("~", "~0").replace("/", "~1")
+
+
+def apply_patch(state: dict, ops: list):
+    '''
+    Apply the ops produced by diff_state to a state dict in place.
+    '''
+    for op in ops:
+        parts = [p.replace("~1", "/").replace("~0", "~") for p in op["path"].split("/")[1:]]
+        target = state
+        for part in parts[:-1]:
+            target = target[int(part)] if isinstance(target, list) else target[part]
+        last = parts[-1]
+        if isinstance(target, list):
+            last = int(last)
+
+        if op["op"] == "remove":
+            del target[last]
+        else:
+            target[last] = copy.deepcopy(op["value"])
+
+
+class SnapshotPublisher(object):
+    '''
+    Publishes the whole UI state as one retained, versioned snapshot, then
+    streams sequence numbered patches against it. Consumers start from the
+    snapshot, apply patches whose seq is exactly one past their version, and
+    ask for a resync on any gap.
+    '''
+    def __init__(
+        self,
+        mqtt_client,
+        snapshot_topic: str = "ui/state/snapshot",
+        patch_topic: str = "ui/state/patch",
+        refresh_interval: float = 10.0,
+    ):
+        self.mqtt_client = mqtt_client
+        self.snapshot_topic = snapshot_topic
+        self.patch_topic = patch_topic
+        self.refresh_interval = refresh_interval
+
+        self.state: Dict[str, Any] = {}
+        self.published_state: Dict[str, Any] = {}
+        self.version = 0
+
+        self.resync_requested = True
+        self.last_snapshot_time = 0.0
+
+    def update(self, key: str, value: Any):
+        self.state[key] = value
+
+    def request_resync(self):
+        self.resync_requested = True
+
+    def flush(self):
+        now = time.time()
+        ops = diff_state(self.published_state, self.state)
+
+        if ops:
+            self.version += 1
+            self.published_state = copy.deepcopy(self.state)
+            if not self.resync_requested:
+                self.mqtt_client.publish(self.patch_topic, {"seq": self.version, "ops": ops})
+
+        if self.resync_requested or now - self.last_snapshot_time > self.refresh_interval:
+            self.publish_snapshot()
+
+    def publish_snapshot(self):
+        self.resync_requested = False
+        self.last_snapshot_time = time.time()
+        self.mqtt_client.publish(
+            self.snapshot_topic,
+            {"version": self.version, "state": self.published_state},
+            retain=True,
+        )
+
+
+class SnapshotFollower(object):
+    '''
+    Reference consumer for SnapshotPublisher. Feed it the snapshot and patch
+    messages and it keeps `state` current, calling resync() whenever it sees a
+    patch it can't apply in order.
+    '''
+    def __init__(self, resync=None):
+        self.resync = resync
+        self.state: Dict[str, Any] = {}
+        self.version = None
+
+    def handle_snapshot(self, topic: str, msg: dict):
+        # an older retained snapshot can show up after a newer patch, ignore it
+        if self.version is not None and msg["version"] < self.version:
+            return
+        self.state = msg["state"]
+        self.version = msg["version"]
+
+    def handle_patch(self, topic: str, msg: dict):
+        seq = msg["seq"]
+        if self.version is not None and seq <= self.version:
+            # already covered by the snapshot we have
+            return
+        if self.version is None or seq != self.version + 1:
+            # missed something (or never got a snapshot), start over
+            self.version = None
+            if self.resync is not None:
+                self.resync()
+            return
+        apply_patch(self.state, msg["ops"])
+        self.version = seq
@@ -1,33 +1,72 @@
-from threading import Thread
+from threading import Lock
 from typing import Any
-import time
+import scheduler as sched
+
 
 class Timer(object):
-    def __init__(self):
-        self.time_remaining = 0
+    '''
+    A countdown that calls `function` when it runs out. The countdown lives in
+    the shared scheduler as a deadline, so time_remaining is worked out from
+    that deadline instead of being decremented once a second.
+    '''
+    def __init__(self, scheduler: sched.Scheduler = None):  # type: ignore
+        self.scheduler = scheduler if scheduler is not None else sched.get_scheduler()
         self.enabled = False
         self.function: Any = None
-        thread = Thread(target=self.run, args=tuple())
-        thread.start()
+
+        self.lock = Lock()
+        # seconds left while the timer isn't running
+        self.remaining = 0
+        self.task: Any = None
+        # bumped every time the timer is stopped, so a callback that was
+        # already on its way out of the scheduler can tell it's stale
+        self.generation = 0
+
+    @property
+    def time_remaining(self) -> float:
+        task = self.task
+        if self.enabled and task is not None:
+            return task.time_remaining()
+        return self.remaining
 
     def start(self):
-        self.enabled = True
+        with self.lock:
+            if self.enabled:
+                return
+            self.enabled = True
+            self.task = self.scheduler.call_later(self.remaining, self.expire, self.generation)
+
     def pause(self):
-        self.enabled = False
+        with self.lock:
+            if self.enabled:
+                self.remaining = self.time_remaining
+            self.stop()
+
     def reset(self):
-        self.enabled = False
-        self.time_remaining = 0
+        with self.lock:
+            self.stop()
+            self.remaining = 0
+
     def set_timeout(self, time):
+        with self.lock:
+            self.stop()
+            self.remaining = time
+
+    def stop(self):
+        # caller holds the lock
         self.enabled = False
-        self.time_remaining = time
+        self.generation += 1
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
 
-    def run(self):
-        while True:
-            if self.enabled:
-                if self.time_remaining >= 1:
-                    self.time_remaining -=1
-                if self.time_remaining == 0:
-                    if self.function is not None:
-                        self.enabled = False
-                        self.function()
-            time.sleep(1)
\ No newline at end of file
+    def expire(self, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.enabled = False
+            self.task = None
+            self.remaining = 0
+            function = self.function
+        if function is not None:
+            function()
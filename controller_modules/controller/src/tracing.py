@@ -0,0 +1,198 @@
+import bisect
+import copy
+import itertools
+import json
+import os
+import random
+import time
+from threading import Lock
+from typing import Dict, List, Union
+
+# Hit-to-light latency tracing. A trace starts when the adapter reads a hit off
+# the serial line and travels inside the MQTT messages that follow from it:
+#
+#   {"id": "3-1f2e-42", "stamps": [["serial_read", t], ["adapter_publish", t], ...]}
+#
+# Every stage appends a stamp, so whoever ends the trace (the adapter, after the
+# serial write or the relay GPIO set) has the whole path. TraceStats turns each
+# pair of consecutive stamps into a "<from>-><to>" duration, plus one for the
+# first to the last stamp, and keeps a histogram per name.
+#
+# Stamps are time.monotonic() moved onto a shared timebase by `offset`. It starts
+# as the wall clock offset, so hops between Pis are only as good as their clocks
+# until clock sync (clock_sync.py in the controller) measures this host against
+# the controller and set_reference() moves the adapter onto the controller's
+# timebase. Durations inside one process are exact either way. This file is
+# kept identical in the controller and the arduino adapter.
+
+# this host's own timebase, what clock sync measures
+local_offset = time.time() - time.monotonic()
+# seconds added to time.monotonic() to get the shared timebase
+offset = local_offset
+# whether offset came from clock sync, new traces say so in "ref"
+referenced = False
+
+_counter = itertools.count()
+# tells ids from before and after a restart apart
+_boot = f"{random.getrandbits(16):04x}"
+
+
+def now() -> float:
+    return time.monotonic() + offset
+
+
+def local_now() -> float:
+    return time.monotonic() + local_offset
+
+
+def set_reference(clock_offset: float):
+    '''
+    clock_offset is this host's local timebase minus the reference's, as
+    estimated by clock sync. stamps from now on are on the reference timebase
+    '''
+    global offset, referenced
+    offset = local_offset - clock_offset
+    referenced = True
+
+
+def new_trace(origin: str) -> dict:
+    return {"id": f"{origin}-{_boot}-{next(_counter)}", "ref": referenced, "stamps": []}
+
+
+def stamp(trace: dict, stage: str, at: float = None) -> dict:  # type: ignore
+    '''
+    record stage on trace, at is a time.monotonic() value and defaults to now
+    '''
+    when = now() if at is None else at + offset
+    trace["stamps"].append([stage, round(when, 6)])
+    return trace
+
+
+def branch(trace: dict, stage: str) -> dict:
+    '''
+    a copy of trace with stage stamped on it, for when one hit fans out into
+    several messages (LED frame and relays)
+    '''
+    return stamp(copy.deepcopy(trace), stage)
+
+
+def attach(payload: Union[str, bytes], trace: dict) -> bytes:
+    '''
+    add "trace" to a pre-serialized JSON object without parsing it again
+    '''
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    body = payload.rstrip()
+    if not body.endswith(b"}"):
+        return payload
+    separator = b"" if body == b"{}" else b", "
+    return body[:-1] + separator + b'"trace": ' + json.dumps(trace).encode("utf-8") + b"}"
+
+
+def durations(trace: dict) -> Dict[str, float]:
+    '''
+    "<from>-><to>": seconds for each pair of consecutive stamps and for the whole trace
+    '''
+    stamps = trace.get("stamps", [])
+    out: Dict[str, float] = {}
+    for (a, ta), (b, tb) in zip(stamps, stamps[1:]):
+        out[f"{a}->{b}"] = tb - ta
+    if len(stamps) > 2:
+        out[f"{stamps[0][0]}->{stamps[-1][0]}"] = stamps[-1][1] - stamps[0][1]
+    return out
+
+
+class LatencyHistogram(object):
+    '''
+    Fixed log-spaced buckets in milliseconds, cheap to update and to publish.
+    Percentiles are read off the bucket upper bounds.
+    '''
+    BOUNDS_MS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, seconds: float):
+        # a hop between hosts can come out slightly negative while the clocks
+        # disagree, count it as instant rather than throwing it away
+        ms = max(0.0, seconds * 1000)
+        self.counts[bisect.bisect_left(self.BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, pct: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = pct / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return self.BOUNDS_MS[index] if index < len(self.BOUNDS_MS) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self) -> dict:
+        labels = [str(b) for b in self.BOUNDS_MS] + ["inf"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": {label: count for label, count in zip(labels, self.counts) if count},
+        }
+
+
+class TraceStats(object):
+    '''
+    Per-stage latency histograms over finished traces.
+    '''
+    def __init__(self):
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.traces = 0
+        self.lock = Lock()
+
+    def record(self, trace: dict):
+        with self.lock:
+            self.traces += 1
+            for name, seconds in durations(trace).items():
+                histogram = self.histograms.get(name, None)
+                if histogram is None:
+                    histogram = LatencyHistogram()
+                    self.histograms[name] = histogram
+                histogram.add(seconds)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "traces": self.traces,
+                "stages": {name: h.snapshot() for name, h in sorted(self.histograms.items())},
+            }
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.traces = 0
+
+    def dump(self, path: str) -> dict:
+        snapshot = self.snapshot()
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as file:
+            file.write(json.dumps(snapshot, indent=2))
+        return snapshot
+
+    def summary(self) -> List[str]:
+        lines = []
+        for name, stats in self.snapshot()["stages"].items():
+            lines.append(
+                f"{name:<40} n={stats['count']:<6} mean {stats['mean_ms']:>9.3f} ms"
+                f"  p50 <={stats['p50_ms']:>7} ms  p99 <={stats['p99_ms']:>7} ms  max {stats['max_ms']:>9.3f} ms"
+            )
+        return lines
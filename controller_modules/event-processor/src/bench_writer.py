@@ -0,0 +1,223 @@
+import argparse
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue
+from threading import Lock, Thread
+from typing import Any, List
+
+from loguru import logger
+
+import line_writer
+
+# Sustained events/s into InfluxDB's write endpoint, against a local HTTP
+# stand-in so no database is needed. Compares the old flush loop (drain the
+# queue once a second, build Points, open a new batching write_api per flush)
+# with line_writer.BatchWriter, feeding both the same events from one thread
+# like the MQTT callback does:
+#
+#   python bench_writer.py --events 200000
+#
+# The new writer sends through InfluxClientTransport on a SYNCHRONOUS
+# write_api, as main.py ships it. --transport http measures HTTPTransport
+# instead. --fail-every n answers every n'th write with a 503 to exercise the
+# retries. Both the old path and the shipped transport need influxdb-client
+# installed, without it only the new writer over HTTPTransport runs.
+
+
+class StandIn(object):
+    '''
+    Accepts POST /api/v2/write (and /write), counts lines and requests.
+    '''
+    def __init__(self, fail_every: int = 0, delay: float = 0.0):
+        self.lines = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_write = 0.0
+        self.lock = Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, like a real influx
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stand_in.lock:
+                    stand_in.requests += 1
+                    fail = fail_every > 0 and stand_in.requests % fail_every == 0
+                    if fail:
+                        stand_in.failures += 1
+                    else:
+                        # the influx client leaves off the last newline
+                        stand_in.lines += len(body.splitlines())
+                        stand_in.last_write = time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self.send_response(503 if fail else 204)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        Thread(target=self.server.serve_forever, args=(), daemon=True).start()
+
+    def reset(self):
+        with self.lock:
+            self.lines = 0
+            self.requests = 0
+            self.failures = 0
+
+    def wait_for(self, lines: int, timeout: float) -> bool:
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            if self.lines >= lines:
+                return True
+            time.sleep(0.005)
+        return False
+
+
+def event(i: int):
+    received = time.time_ns()
+    tags = {"entity": "ABCDEFGHI"[i % 9], "subsystem": "laser_detector" if i % 2 else "ball_detector", "type": "hit"}
+    fields = {"timestamp": received, "received": received, "id": i}
+    return tags, fields, received
+
+
+def run_old(url: str, events: int, rate: float) -> float:
+    '''
+    the previous EventProcessor.handle_event + run_influx, returns the time
+    taken to produce the events
+    '''
+    from influxdb_client import InfluxDBClient, Point, WriteOptions
+    from influxdb_client.client.write_api import WriteType
+
+    client = InfluxDBClient(url=url, token="bench", org="avr")
+    shared_queue: Queue = Queue()
+    done = [False]
+
+    def run_influx():
+        while True:
+            finished = done[0]
+            if not shared_queue.empty():
+                updates = []
+                while not shared_queue.empty():
+                    updates.append(shared_queue.get())
+                with client.write_api(write_options=WriteOptions(write_type=WriteType.batching, batch_size=len(updates))) as write_api:
+                    write_api.write(bucket='avr', org="bell-avr", record=updates)
+            if finished:
+                return
+            time.sleep(1)
+
+    flusher = Thread(target=run_influx, args=(), daemon=True)
+    flusher.start()
+    start = time.monotonic()
+    for i in range(events):
+        tags, fields, received = event(i)
+        point = (
+            Point("events")
+            .tag("entity", tags["entity"])
+            .tag("subsystem", tags["subsystem"])
+            .tag("type", tags["type"])
+            .field("timestamp", fields["timestamp"])
+            .field("id", fields["id"])
+            .time(received)  # type: ignore
+        )
+        shared_queue.put(point)
+        pace(start, i, rate)
+    produced = time.monotonic() - start
+    done[0] = True
+    return produced
+
+
+def make_transport(url: str, kind: str) -> Any:
+    if kind == "http":
+        return line_writer.HTTPTransport(url, org="bell-avr", bucket="avr", token="bench")
+    # the same client and write_api EventProcessor builds, with a token instead of the login
+    from influxdb_client import InfluxDBClient
+    from influxdb_client.client.write_api import SYNCHRONOUS
+
+    client = InfluxDBClient(url=url, token="bench", org="avr")
+    return line_writer.InfluxClientTransport(client.write_api(write_options=SYNCHRONOUS), bucket="avr", org="bell-avr")
+
+
+def run_new(url: str, events: int, rate: float, args) -> Any:
+    transport = make_transport(url, args.transport)
+    writer = line_writer.BatchWriter(
+        transport, batch_size=args.batch_size, flush_interval=args.flush_interval,
+        queue_size=args.queue_size, backoff=0.05,
+    ).start()
+    start = time.monotonic()
+    for i in range(events):
+        tags, fields, received = event(i)
+        writer.write("events", tags, fields, received)
+        pace(start, i, rate)
+    produced = time.monotonic() - start
+    return writer, produced
+
+
+def pace(start: float, i: int, rate: float):
+    if rate > 0:
+        delay = start + (i + 1) / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def report(name: str, stand_in: StandIn, events: int, produced: float, start: float, landed: bool):
+    # up to the last line that made it, not the time spent waiting for the rest
+    elapsed = stand_in.last_write - start
+    print(f"=== {name} ===")
+    print(f"events             {events} produced in {produced:.2f}s ({events / max(produced, 1e-9):.0f}/s offered)")
+    print(f"lines at influx    {stand_in.lines}{'' if landed else f' ({events - stand_in.lines} never arrived)'}")
+    print(f"write requests     {stand_in.requests} ({stand_in.failures} answered 503)")
+    print(f"sustained          {stand_in.lines / max(elapsed, 1e-9):.0f} events/s (first event -> last line written)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="event processor influx writer benchmark")
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--rate", type=float, default=0, help="events/s offered, 0 for as fast as possible")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--fail-every", type=int, default=0, help="503 every n'th write request")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds the stand-in takes per request")
+    parser.add_argument("--skip-old", action="store_true")
+    parser.add_argument("--transport", choices=["influx", "http"], default="influx",
+                        help="how the new writer sends, influx is what main.py ships")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    stand_in = StandIn(args.fail_every, args.delay)
+
+    if not args.skip_old:
+        try:
+            import influxdb_client  # noqa: F401
+        except ImportError:
+            print("influxdb-client not installed, skipping the old writer and using HTTPTransport")
+            args.skip_old = True
+            args.transport = "http"
+    if not args.skip_old:
+        start = time.monotonic()
+        produced = run_old(stand_in.url, args.events, args.rate)
+        # the old loop has no retries, a failed batch is simply gone
+        landed = stand_in.wait_for(args.events, timeout=30 if args.fail_every == 0 else 5)
+        report("per-flush write_api with Points (old)", stand_in, args.events, produced, start, landed)
+        stand_in.reset()
+
+    start = time.monotonic()
+    writer, produced = run_new(stand_in.url, args.events, args.rate, args)
+    landed = stand_in.wait_for(args.events, timeout=30)
+    transport = "InfluxClientTransport, as shipped" if args.transport == "influx" else "HTTPTransport"
+    report(f"persistent BatchWriter, line protocol over {transport} (new)", stand_in, args.events, produced, start, landed)
+    writer.close()
+    print(f"writer             {writer.stats()}")
+
+
+if __name__ == "__main__":
+    main()
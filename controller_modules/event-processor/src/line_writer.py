@@ -0,0 +1,257 @@
+import http.client
+import time
+import urllib.parse
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from typing import Any, Dict, Union
+from loguru import logger
+
+# One long-lived writer for InfluxDB. Events are queued as plain tuples, the
+# writer thread encodes them straight into a reusable line protocol buffer and
+# hands the buffer to a transport when it holds batch_size lines or max_bytes,
+# or flush_interval seconds after its first line. Failed sends are retried with
+# exponential backoff. While that goes on the bounded queue fills up and
+# write() pushes back on the caller (the MQTT thread) for up to put_timeout,
+# then drops the event and counts it.
+
+Scalar = Union[int, float, bool, str]
+
+STOP = object()
+
+
+def _escape(value: str, specials: str) -> str:
+    for char in specials:
+        if char in value:
+            value = value.replace(char, "\\" + char)
+    return value
+
+
+def format_field(value: Scalar) -> str:
+    # bool before int, bool is an int in python
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    return '"' + _escape(str(value), '\\"') + '"'
+
+
+# "measurement,tag=value,..." for the handful of tag sets events actually use
+_prefixes: Dict[tuple, str] = {}
+
+
+def _prefix(measurement: str, tags: Dict[str, Any]) -> str:
+    key = (measurement, tuple(tags.items()))
+    prefix = _prefixes.get(key, None)
+    if prefix is None:
+        prefix = _escape(measurement, ", ")
+        for name, value in tags.items():
+            if value is None or value == "":
+                continue
+            prefix += "," + _escape(str(name), ",= ") + "=" + _escape(str(value), ",= ")
+        if len(_prefixes) >= 1024:
+            _prefixes.clear()
+        _prefixes[key] = prefix
+    return prefix
+
+
+def encode_line(buffer: bytearray, measurement: str, tags: Dict[str, Any], fields: Dict[str, Scalar], time_ns: int = None):  # type: ignore
+    '''
+    append one line of line protocol to buffer
+    '''
+    line = _prefix(measurement, tags)
+    line += " " + ",".join([_escape(str(key), ",= ") + "=" + format_field(value) for key, value in fields.items()])
+    if time_ns is not None:
+        line += f" {int(time_ns)}"
+    buffer += line.encode("utf-8")
+    buffer += b"\n"
+
+
+class HTTPTransport(object):
+    '''
+    POSTs batches to the InfluxDB 2 /api/v2/write endpoint over one kept-alive
+    connection, reconnecting after an error
+    '''
+    def __init__(self, url: str, org: str, bucket: str, token: str = "", precision: str = "ns", timeout: float = 10.0):
+        parsed = urllib.parse.urlsplit(url)
+        self.https = parsed.scheme == "https"
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if self.https else 8086)
+        self.timeout = timeout
+        query = urllib.parse.urlencode({"org": org, "bucket": bucket, "precision": precision})
+        self.path = f"{parsed.path.rstrip('/')}/api/v2/write?{query}"
+        self.headers = {"Content-Type": "text/plain; charset=utf-8"}
+        if token != "":
+            self.headers["Authorization"] = f"Token {token}"
+        self.connection: Any = None
+
+    def send(self, data: Union[bytes, bytearray]):
+        if self.connection is None:
+            connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            self.connection = connection_class(self.host, self.port, timeout=self.timeout)  # type: ignore
+        try:
+            self.connection.request("POST", self.path, body=data, headers=self.headers)
+            response = self.connection.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError):
+            self.close()
+            raise
+        if response.status >= 300:
+            raise Exception(f"influx write failed with {response.status}: {body[:200]!r}")
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class InfluxClientTransport(object):
+    '''
+    sends batches through a synchronous write_api of an InfluxDBClient, made
+    once, so the client's own login (username/password) is reused
+    '''
+    def __init__(self, write_api: Any, bucket: str, org: str):
+        self.write_api = write_api
+        self.bucket = bucket
+        self.org = org
+
+    def send(self, data: Union[bytes, bytearray]):
+        self.write_api.write(bucket=self.bucket, org=self.org, record=bytes(data))
+
+    def close(self):
+        self.write_api.close()
+
+
+class BatchWriter(object):
+    def __init__(
+        self,
+        transport: Any,
+        batch_size: int = 5000,
+        max_bytes: int = 1 << 20,
+        flush_interval: float = 1.0,
+        queue_size: int = 10000,
+        put_timeout: float = 0.5,
+        retries: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 10.0,
+    ):
+        self.transport = transport
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.queue: Queue = Queue(maxsize=queue_size)
+        # reused for every batch, cleared after each flush
+        self.buffer = bytearray()
+        self.lines = 0
+        # monotonic time the oldest line in the buffer was encoded
+        self.oldest = 0.0
+
+        self.written = 0
+        self.batches = 0
+        self.retried = 0
+        # lines given up on after the last retry
+        self.failed = 0
+        # events write() couldn't queue within put_timeout
+        self.dropped = 0
+        self.max_depth = 0
+
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, args=(), daemon=True)
+
+    def start(self):
+        if not self.thread.is_alive():
+            self.thread.start()
+        return self
+
+    def write(self, measurement: str, tags: Dict[str, Any], fields: Dict[str, Scalar], time_ns: int = None) -> bool:  # type: ignore
+        try:
+            self.queue.put((measurement, tags, fields, time_ns), timeout=self.put_timeout)
+        except Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"EP: write queue full, {self.dropped} event(s) dropped so far")
+            return False
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def close(self, timeout: float = 10.0):
+        '''
+        flush what's queued and stop the writer thread
+        '''
+        if self.thread.is_alive():
+            self.queue.put(STOP)
+            self.thread.join(timeout)
+        self.transport.close()
+
+    def run(self):
+        while True:
+            if self.lines > 0:
+                wait = max(0.0, self.flush_interval - (time.monotonic() - self.oldest))
+            else:
+                wait = None
+            try:
+                item = self.queue.get(timeout=wait)
+            except Empty:
+                item = None
+
+            if item is STOP:
+                if self.lines > 0:
+                    self.flush()
+                self.stopped.set()
+                return
+            if item is not None:
+                if self.lines == 0:
+                    self.oldest = time.monotonic()
+                try:
+                    encode_line(self.buffer, *item)
+                    self.lines += 1
+                except Exception as e:
+                    logger.warning(f"EP: couldn't encode {item}: {e}")
+
+            if self.lines > 0 and (
+                self.lines >= self.batch_size
+                or len(self.buffer) >= self.max_bytes
+                or time.monotonic() - self.oldest >= self.flush_interval
+            ):
+                self.flush()
+
+    def flush(self):
+        delay = self.backoff
+        attempt = 0
+        while True:
+            try:
+                self.transport.send(self.buffer)
+                self.written += self.lines
+                self.batches += 1
+                break
+            except Exception as e:
+                attempt += 1
+                if attempt > self.retries:
+                    logger.warning(f"EP: giving up on {self.lines} line(s) after {attempt} attempts: {e}")
+                    self.failed += self.lines
+                    break
+                self.retried += 1
+                logger.debug(f"EP: write failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+        del self.buffer[:]
+        self.lines = 0
+
+    def stats(self) -> dict:
+        return {
+            "written": self.written,
+            "batches": self.batches,
+            "retried": self.retried,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "queued": self.queue.qsize(),
+            "max_depth": self.max_depth,
+        }
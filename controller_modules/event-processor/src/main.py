@@ -1,12 +1,12 @@
-from influxdb_client import InfluxDBClient, Point, WriteOptions
-from influxdb_client.client.write_api import SYNCHRONOUS, WriteType
+from influxdb_client import InfluxDBClient
+from influxdb_client.client.write_api import SYNCHRONOUS
 from datetime import datetime
 from mqtt_client import MQTTClient
-from typing import Any
+import line_writer
+from typing import Any, Dict
 from loguru import logger
 import threading
 import time
-from queue import Queue
 
 # start
 # create a queue
@@ -15,31 +15,38 @@ from queue import Queue
 
 # start listening to mqtt
 # everytime a new event comes in, format it and append to queue
-# every x seconds, pull everything from the queue and commit all events to database
+# a single long-lived line_writer.BatchWriter encodes them and commits them in
+# batches (on size or every flush_interval seconds)
 BUILDINGS = ["A", "B", "C", "D", "E", "F", "G", "H", "I"]
 
 class EventProcessor(object):
     def __init__(self):
         # influxDB
-        self.db_frequency = (
-            1  # how often should we check the queue to commit to DB in Hz?
-        )
         self.influx_client = InfluxDBClient(url='http://influxdb:8086', username='admin', password='bellavr23', org='avr')
         self.buckets_api = self.influx_client.buckets_api()
 
-        # shared
-        self.shared_queue = Queue()
+        # shared, events go straight from the MQTT thread into the writer's
+        # bounded queue, flushed at least once a second
+        transport = line_writer.InfluxClientTransport(
+            self.influx_client.write_api(write_options=SYNCHRONOUS), bucket='avr', org="bell-avr"
+        )
+        self.writer = line_writer.BatchWriter(transport, flush_interval=1.0)
 
         # mqtt
         self.mqtt_client = MQTTClient("mqtt", 1883)
         self.mqtt_client.register_callback('+/events/#', self.handle_event)
         self.mqtt_client.register_callback('+/commands/#', self.handle_command)
+        # per building clock offset against the controller, published by the
+        # controller's clock sync. used to put hit times on the controller's timebase
+        self.clock_offsets: Dict[str, dict] = {}
+        self.mqtt_client.register_callback('+/clock/offset', self.handle_clock_offset)
 
         self.event_id = 0
 
     def start(self):
         self.mqtt_client.start_threaded()
         self.setup_db()
+        self.writer.start()
         self.run_influx()
 
     ###################################################################################
@@ -67,21 +74,14 @@ class EventProcessor(object):
             raise Exception("avr bucket cant be found, check influx config!")
 
     def run_influx(self):
+        # the writer thread does the work, just report on it now and then
+        last = None
         while True:
-            if not self.shared_queue.empty():
-                updates = []
-                # pull everything from the queue and put into a list
-                while not self.shared_queue.empty():
-                    update = self.shared_queue.get()
-                    # logger.debug("Pulling an item from the queue!!!")
-                    updates.append(update)
-                if len(updates) >= 1:
-                    logger.debug(f"Processing {len(updates)} updates to the DB!!!")
-                    # logger.debug(updates)
-                    with self.influx_client.write_api(write_options=WriteOptions(write_type=WriteType.batching, batch_size=len(updates))) as write_api:
-                        write_api.write(bucket='avr', org="bell-avr", record=updates)
-                    updates.clear()
-            time.sleep(1 / self.db_frequency)
+            time.sleep(10)
+            stats = self.writer.stats()
+            if stats != last:
+                logger.debug(f"EP: writer {stats}")
+            last = stats
 
     ###################################################################################
     ###############################  C A L L B A C K S  ###############################
@@ -97,23 +97,53 @@ class EventProcessor(object):
             if subsystem in ["laser_detector", "relay", "ball_detector", "led_bar"]:
                 # logger.debug(f"EP: Building {source} received a {subsystem} event!")
                 #create the influxDB item
-                point = (
-                    Point("events")
-                    .tag("entity", source)
-                    .tag("subsystem", subsystem)
-                    .tag("type", msg["event_type"])
-                    .field("timestamp", time.time_ns())
-                    .field("id", self.event_id)
-                    .time(time.time_ns()) #type: ignore
-                    )
-                # logger.debug("Pushing an item into the queue!!!")
-                self.shared_queue.put(point)
+                received = time.time_ns()
+                event_time = self.event_time_ns(source, msg, received)
+                self.writer.write(
+                    "events",
+                    {"entity": source, "subsystem": subsystem, "type": msg["event_type"]},
+                    {"timestamp": event_time, "received": received, "id": self.event_id},
+                    event_time,
+                )
                 self.event_id += 1
         elif source == "ui":
             pass
         else:
             logger.warning(f"Received a message that doesnt fit the datamodel {topic}{msg}")
 
+    def event_time_ns(self, source: str, msg: dict, received: int) -> int:
+        '''
+        when the hit was read off the building's serial port, on the controller's
+        timebase. falls back to when it got here if that can't be known
+        '''
+        trace = msg.get("trace", None)
+        if trace is None or len(trace.get("stamps", [])) == 0:
+            return received
+        first = trace["stamps"][0][1]
+        if trace.get("ref", False):
+            # the adapter already applied its offset
+            return int(first * 1e9)
+        estimate = self.clock_offsets.get(source, None)
+        if estimate is None or "offset" not in estimate:
+            return received
+        return int((first - estimate["offset"]) * 1e9)
+
+    def handle_clock_offset(self, topic: str, msg: dict):
+        source = topic.split("/")[0]
+        if "offset" not in msg:
+            return
+        self.clock_offsets[source] = msg
+        self.writer.write(
+            "clock",
+            {"entity": source},
+            {
+                "offset": float(msg["offset"]),
+                "drift_ppm": float(msg.get("drift_ppm", 0.0)),
+                "rtt_ms": float(msg.get("rtt_ms", 0.0)),
+            },
+            time.time_ns(),
+        )
+
     def handle_command(self, topic: str, msg: dict):
         logger.debug("THE COMMAND CALLBACK WORKS!!!")
 